@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script pour vérifier les colonnes lues par les pages de liste
+
+Les colonnes de texte long sont différées (models.py, utils_modules/chargement.py) :
+les listes ne doivent pas les lire, les vues de détail doivent les charger dans
+leur requête principale. Le script appelle chaque page avec le client de test
+de Flask, connecté avec le premier administrateur, relève les colonnes des
+SELECT exécutés et retourne un code d'erreur si une règle n'est pas respectée.
+
+Utilisation :
+    python check_colonnes_chargees.py
+"""
+
+import re
+import sys
+
+from sqlalchemy import event
+
+from app import create_app
+from extensions import db
+from models import Client, Prestation, User
+
+app = create_app()
+
+# Colonnes différées, sous la forme table.colonne (ou alias table_1.colonne)
+COLONNES = {
+    'prestation.observations': r'\bprestation(?:_\d+)?[._]observations\b',
+    'document.observations_supplementaires': r'\bdocument(?:_\d+)?[._]observations_supplementaires\b',
+    'prestation_version.donnees': r'\bprestation_version(?:_\d+)?[._]donnees\b',
+    'client.adresse': r'\bclient(?:_\d+)?[._]adresse\b',
+    'client.tags': r'\bclient(?:_\d+)?[._]tags\b',
+    'notification.message': r'\bnotification(?:_\d+)?[._]message\b',
+}
+
+# Pages de liste : (url, colonnes qui ne doivent pas être lues)
+LISTES = [
+    ('/prestations/', list(COLONNES)),
+    ('/factures/factures', list(COLONNES)),
+    ('/clients/clients', ['client.tags', 'prestation.observations']),
+    ('/clients/clients/liste?format=json', ['client.adresse', 'client.tags']),
+    ('/documents/', list(COLONNES)),
+    ('/api/autocompletion/client?q=', list(COLONNES)),
+    ('/api/autocompletion/prestation?q=', list(COLONNES)),
+]
+
+
+def selections(requetes):
+    """Listes de colonnes des SELECT (avant le premier FROM : les jointures eager y figurent)."""
+    return [re.split(r'\bFROM\b', requete, maxsplit=1, flags=re.IGNORECASE)[0]
+            for requete in requetes if requete.lstrip().upper().startswith('SELECT')]
+
+
+def colonnes_lues(requetes, avec_objet=False):
+    """
+    Colonnes différées présentes dans les SELECT. Avec avec_objet, seulement
+    celles lues avec l'identifiant de leur table (requête qui charge l'objet,
+    et non chargement différé de la colonne seule).
+    """
+    trouvees = set()
+    for selection in selections(requetes):
+        for nom, motif in COLONNES.items():
+            table = nom.split('.')[0]
+            if re.search(motif, selection) and (
+                    not avec_objet or re.search(rf'\b{table}(?:_\d+)?\.id\b', selection)):
+                trouvees.add(nom)
+    return trouvees
+
+
+def appeler(client_http, url):
+    """Appelle une page et retourne (code HTTP, requêtes SQL exécutées)."""
+    requetes = []
+
+    def enregistrer(conn, cursor, statement, parameters, context, executemany):
+        requetes.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', enregistrer)
+    try:
+        reponse = client_http.get(url)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', enregistrer)
+    return reponse.status_code, requetes
+
+
+def pages_detail():
+    """Vues de détail et d'édition existantes : (url, colonnes qui doivent être lues dans la requête)."""
+    pages = []
+    prestation = db.session.query(Prestation.id).first()
+    if prestation:
+        pages.append((f'/prestations/view/{prestation.id}', ['prestation.observations']))
+    client = db.session.query(Client.id).first()
+    if client:
+        pages.append((f'/clients/clients/edit/{client.id}', ['client.adresse', 'client.tags']))
+    return pages
+
+
+def check_colonnes_chargees():
+    """
+    Affiche les colonnes différées lues par chaque page et retourne le nombre d'erreurs
+    """
+    with app.app_context():
+        admin = User.query.filter(User.role.in_(['admin', 'super_admin'])).first()
+        if admin is None:
+            print("Aucun administrateur : impossible d'appeler les pages.")
+            return 1
+        pages = pages_detail()
+        db.session.remove()
+
+        client_http = app.test_client()
+        with client_http.session_transaction() as session:
+            session['_user_id'] = str(admin.id)
+            session['_fresh'] = True
+
+        erreurs = 0
+        print("=== PAGES DE LISTE (colonnes différées non lues) ===\n")
+        for url, interdites in LISTES:
+            code, requetes = appeler(client_http, url)
+            lues = colonnes_lues(requetes) & set(interdites)
+            ok = code == 200 and not lues
+            erreurs += not ok
+            detail = f"lues : {', '.join(sorted(lues))}" if lues else "aucune colonne différée lue"
+            print(f"   {'OK ' if ok else 'ERR'} {url} [{code}] {len(requetes)} requête(s), {detail}")
+
+        print("\n=== VUES DE DÉTAIL (colonnes différées chargées) ===\n")
+        if not pages:
+            print("   Aucune donnée : vérification ignorée.")
+        for url, attendues in pages:
+            code, requetes = appeler(client_http, url)
+            manquantes = set(attendues) - colonnes_lues(requetes, avec_objet=True)
+            ok = code == 200 and not manquantes
+            erreurs += not ok
+            detail = f"manquantes : {', '.join(sorted(manquantes))}" if manquantes else "colonnes chargées"
+            print(f"   {'OK ' if ok else 'ERR'} {url} [{code}] {detail}")
+
+        print(f"\n{erreurs} erreur(s)")
+        return erreurs
+
+if __name__ == "__main__":
+    sys.exit(1 if check_colonnes_chargees() else 0)
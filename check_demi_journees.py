@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script pour vérifier la saisie des prestations à la demi-journée
+
+Crée par le formulaire d'ajout une prestation d'un après-midi (début et fin
+le même jour, l'après-midi), vérifie ses dates puis la supprime.
+
+Utilisation :
+    python check_demi_journees.py
+"""
+
+import sys
+from datetime import date, datetime, time as heure, timedelta
+
+from app import create_app
+from extensions import db
+from models import Client, Prestation, TypeDemenagement, User
+from utils_modules.creneaux import (
+    DEMI_JOURNEE_APRES_MIDI, DEMI_JOURNEE_MATIN, appliquer_demi_journee, demi_journee_de, periode_valide
+)
+
+app = create_app()
+
+def check_conversions():
+    """
+    Vérifie que demi_journee_de est l'inverse d'appliquer_demi_journee
+    """
+    erreurs = 0
+    jour = date.today()
+    for fin in (False, True):
+        for demi_journee in ('', DEMI_JOURNEE_MATIN, DEMI_JOURNEE_APRES_MIDI):
+            valeur = appliquer_demi_journee(jour, demi_journee, fin=fin)
+            retour = demi_journee_de(valeur, fin=fin)
+            attendu = demi_journee if demi_journee != DEMI_JOURNEE_MATIN or fin else ''
+            if retour != attendu:
+                print(f"   ✗ {'fin' if fin else 'début'} '{demi_journee}' -> {valeur:%H:%M:%S} -> '{retour}'")
+                erreurs += 1
+
+    for debut, fin in ((DEMI_JOURNEE_APRES_MIDI, DEMI_JOURNEE_APRES_MIDI), (DEMI_JOURNEE_MATIN, DEMI_JOURNEE_MATIN),
+                       ('', DEMI_JOURNEE_MATIN), (DEMI_JOURNEE_APRES_MIDI, '')):
+        if not periode_valide(appliquer_demi_journee(jour, debut), appliquer_demi_journee(jour, fin, fin=True)):
+            print(f"   ✗ Période refusée le même jour : début '{debut}', fin '{fin}'")
+            erreurs += 1
+    if periode_valide(appliquer_demi_journee(jour, DEMI_JOURNEE_APRES_MIDI),
+                      appliquer_demi_journee(jour, DEMI_JOURNEE_MATIN, fin=True)):
+        print("   ✗ Période acceptée : début l'après-midi, fin le matin du même jour")
+        erreurs += 1
+
+    if not erreurs:
+        print("   ✓ Conversions demi-journée <-> heure cohérentes")
+    return erreurs
+
+def check_ajout_apres_midi():
+    """
+    Ajoute une prestation d'un après-midi par le formulaire et vérifie ses dates
+    """
+    admin = User.query.filter_by(role='admin').first()
+    client = Client.query.first()
+    type_dem = TypeDemenagement.query.first()
+    if not admin or not client or not type_dem:
+        print("   Aucun administrateur, client ou type de déménagement : vérification ignorée.")
+        return 0
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    jour = date.today() + timedelta(days=1)
+    adresse = f"check_demi_journees {datetime.utcnow():%Y%m%d%H%M%S%f}"
+    erreurs = 0
+
+    with app.test_client() as client_http:
+        with client_http.session_transaction() as session_http:
+            session_http['_user_id'] = str(admin.id)
+            session_http['_fresh'] = True
+        reponse = client_http.post('/prestations/add', data={
+            'client_id': client.id,
+            'date_debut': jour.isoformat(),
+            'date_fin': jour.isoformat(),
+            'demi_journee_debut': DEMI_JOURNEE_APRES_MIDI,
+            'demi_journee_fin': DEMI_JOURNEE_APRES_MIDI,
+            'adresse_depart': adresse,
+            'adresse_arrivee': adresse,
+            'type_demenagement_id': type_dem.id,
+            'societe': '',
+            'montant': 0,
+            'priorite': 'Normale',
+            'statut': 'En attente',
+        })
+
+    prestation = Prestation.query.filter_by(adresse_depart=adresse).first()
+    if reponse.status_code != 302 or prestation is None:
+        print(f"   ✗ Prestation d'un après-midi refusée (HTTP {reponse.status_code})")
+        return 1
+
+    try:
+        if prestation.date_debut != datetime.combine(jour, heure(13, 0)):
+            print(f"   ✗ Début enregistré : {prestation.date_debut}")
+            erreurs += 1
+        if prestation.date_fin != datetime.combine(jour, heure(23, 59, 59)):
+            print(f"   ✗ Fin enregistrée : {prestation.date_fin}")
+            erreurs += 1
+        if (demi_journee_de(prestation.date_debut), demi_journee_de(prestation.date_fin, fin=True)) != \
+                (DEMI_JOURNEE_APRES_MIDI, DEMI_JOURNEE_APRES_MIDI):
+            print("   ✗ Demi-journées relues incorrectes dans le formulaire de modification")
+            erreurs += 1
+        if not erreurs:
+            print(f"   ✓ Prestation du {jour:%d/%m/%Y} après-midi enregistrée de 13:00 à 23:59:59")
+    finally:
+        db.session.delete(prestation)
+        db.session.commit()
+    return erreurs
+
+if __name__ == "__main__":
+    with app.app_context():
+        print("=== PRESTATIONS À LA DEMI-JOURNÉE ===\n")
+        erreurs = check_conversions() + check_ajout_apres_midi()
+        print(f"\n{erreurs} erreur(s) trouvée(s)")
+    sys.exit(1 if erreurs else 0)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script pour vérifier que les routes de disponibilité répondent toutes de la
+même façon pour les réservations à la demi-journée
+
+Crée, après la dernière prestation existante, une réservation d'un
+après-midi (13:00 - 23:59:59) et une réservation d'une journée entière
+(fin à minuit) pour un transporteur, interroge chaque route de disponibilité
+puis supprime les deux prestations.
+
+Utilisation :
+    python check_disponibilites.py
+"""
+
+import sys
+from datetime import datetime, time as heure, timedelta
+
+from sqlalchemy import func
+
+from app import create_app
+from extensions import db
+from models import Client, Prestation, User
+
+app = create_app()
+
+def _occupe_check_disponibilite(client_http, transporteur_id, jour, demi_debut, demi_fin):
+    reponse = client_http.post('/api/check_disponibilite', json={
+        'date_debut': jour, 'date_fin': jour, 'demi_journee_debut': demi_debut, 'demi_journee_fin': demi_fin
+    }).get_json()
+    return transporteur_id not in {t['id'] for t in reponse['transporteurs_disponibles']}
+
+def _occupe_transporteurs_disponibles(client_http, transporteur_id, jour, demi_debut, demi_fin):
+    reponse = client_http.post('/api/transporteurs-disponibles', json={
+        'date_debut': jour, 'date_fin': jour, 'demi_journee_debut': demi_debut, 'demi_journee_fin': demi_fin
+    }).get_json()
+    return not next(t['disponible'] for t in reponse['transporteurs'] if t['id'] == transporteur_id)
+
+def _occupe_check_transporteur(client_http, transporteur_id, jour, demi_debut, demi_fin):
+    reponse = client_http.post('/api/check-transporteur-disponibilite', json={
+        'transporteur_ids': [transporteur_id], 'date_debut': jour, 'date_fin': jour,
+        'demi_journee_debut': demi_debut, 'demi_journee_fin': demi_fin
+    }).get_json()
+    return not reponse['transporteurs'][str(transporteur_id)]['disponible']
+
+def _occupe_calendrier_flotte(client_http, transporteur_id, jour, demi_debut, demi_fin):
+    reponse = client_http.post('/api/transporteurs/check-disponibilite', json={
+        'date_debut': jour, 'date_fin': jour, 'demi_journee_debut': demi_debut, 'demi_journee_fin': demi_fin
+    }).get_json()
+    return transporteur_id not in {t['id'] for t in reponse['transporteurs']}
+
+ROUTES = [
+    ('/api/check_disponibilite', _occupe_check_disponibilite),
+    ('/api/transporteurs-disponibles', _occupe_transporteurs_disponibles),
+    ('/api/check-transporteur-disponibilite', _occupe_check_transporteur),
+    ('/api/transporteurs/check-disponibilite', _occupe_calendrier_flotte),
+]
+
+def check_disponibilites():
+    """
+    Interroge chaque route de disponibilité et retourne le nombre de réponses incorrectes
+    """
+    admin = User.query.filter_by(role='admin').first()
+    transporteur = User.query.filter_by(role='transporteur', statut='actif').order_by(User.id).first()
+    client = Client.query.first()
+    if not admin or not transporteur or not client:
+        print("   Aucun administrateur, transporteur actif ou client : vérification ignorée.")
+        return 0
+
+    # Jours sans autre réservation : après la dernière prestation existante
+    derniere_fin = db.session.query(func.max(Prestation.date_fin)).scalar() or datetime.now()
+    apres_midi = derniere_fin.date() + timedelta(days=2)
+    journee = apres_midi + timedelta(days=2)
+    libre = journee + timedelta(days=1)
+
+    prestations = [
+        Prestation(client_id=client.id, commercial_id=admin.id, statut='Confirmée',
+                   adresse_depart='check_disponibilites', adresse_arrivee='check_disponibilites', type_demenagement='',
+                   date_debut=datetime.combine(apres_midi, heure(13, 0)),
+                   date_fin=datetime.combine(apres_midi, heure(23, 59, 59))),
+        Prestation(client_id=client.id, commercial_id=admin.id, statut='Confirmée',
+                   adresse_depart='check_disponibilites', adresse_arrivee='check_disponibilites', type_demenagement='',
+                   date_debut=datetime.combine(journee, heure(0, 0)),
+                   date_fin=datetime.combine(journee, heure(0, 0))),
+    ]
+    for prestation in prestations:
+        prestation.transporteurs.append(transporteur)
+    db.session.add_all(prestations)
+    db.session.commit()
+
+    # (jour, demi-journée de début, demi-journée de fin, occupé attendu)
+    cas = [
+        (apres_midi, '', '', True),
+        (apres_midi, '', 'matin', False),
+        (apres_midi, 'apres_midi', 'apres_midi', True),
+        (journee, 'apres_midi', 'apres_midi', True),
+        (journee, '', 'matin', True),
+        (libre, '', '', False),
+    ]
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    erreurs = 0
+    try:
+        with app.test_client() as client_http:
+            with client_http.session_transaction() as session_http:
+                session_http['_user_id'] = str(admin.id)
+                session_http['_fresh'] = True
+            for jour, demi_debut, demi_fin, attendu in cas:
+                libelle = f"{jour:%d/%m/%Y} {demi_debut or 'journée'} -> {demi_fin or 'journée'}"
+                for route, occupe in ROUTES:
+                    obtenu = occupe(client_http, transporteur.id, jour.isoformat(), demi_debut, demi_fin)
+                    if obtenu != attendu:
+                        print(f"   ✗ {route} ({libelle}) : transporteur {transporteur.id} "
+                              f"{'occupé' if obtenu else 'disponible'}, attendu {'occupé' if attendu else 'disponible'}")
+                        erreurs += 1
+        if not erreurs:
+            print(f"   ✓ {len(ROUTES)} routes cohérentes sur {len(cas)} périodes")
+    finally:
+        for prestation in prestations:
+            db.session.delete(prestation)
+        db.session.commit()
+    return erreurs
+
+if __name__ == "__main__":
+    with app.app_context():
+        print("=== DISPONIBILITÉ À LA DEMI-JOURNÉE ===\n")
+        erreurs = check_disponibilites()
+        print(f"\n{erreurs} erreur(s) trouvée(s)")
+    sys.exit(1 if erreurs else 0)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script pour détecter les transporteurs affectés à des prestations qui se chevauchent
+
+Utilisation :
+    python check_double_reservations.py                 # analyse complète
+    python check_double_reservations.py --incremental   # prestations modifiées depuis la dernière analyse
+    python check_double_reservations.py --depuis 2025-06-01
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+
+from app import create_app
+from utils_modules.double_reservations import (
+    detecter_doubles_reservations, enregistrer_derniere_analyse, lire_derniere_analyse
+)
+
+app = create_app()
+
+def check_double_reservations(incremental=False, depuis=None):
+    """
+    Affiche les doubles réservations et retourne leur nombre
+    """
+    with app.app_context():
+        if incremental and depuis is None:
+            depuis = lire_derniere_analyse()
+            if depuis is None:
+                print("Aucune analyse précédente : analyse complète.")
+
+        debut_analyse = datetime.utcnow()
+        chrono = time.monotonic()
+        conflits = detecter_doubles_reservations(depuis)
+        duree = time.monotonic() - chrono
+
+        if depuis:
+            print(f"=== DOUBLES RÉSERVATIONS (prestations modifiées depuis le {depuis:%d/%m/%Y %H:%M}) ===\n")
+        else:
+            print("=== DOUBLES RÉSERVATIONS ===\n")
+
+        if not conflits:
+            print("   Aucune double réservation trouvée.")
+        for conflit in conflits:
+            print(f"   Transporteur {conflit.transporteur_id} : prestations {conflit.prestation_id} "
+                  f"et {conflit.autre_prestation_id} du {conflit.debut:%d/%m/%Y} au {conflit.fin:%d/%m/%Y}")
+
+        print(f"\n{len(conflits)} conflit(s) trouvé(s) en {duree:.2f} s")
+
+        enregistrer_derniere_analyse(debut_analyse)
+        return len(conflits)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Détection des doubles réservations de transporteurs")
+    parser.add_argument('--incremental', action='store_true',
+                        help="ne vérifier que les prestations modifiées depuis la dernière analyse")
+    parser.add_argument('--depuis', help="ne vérifier que les prestations modifiées depuis cette date (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    date_depuis = datetime.strptime(args.depuis, '%Y-%m-%d') if args.depuis else None
+    sys.exit(1 if check_double_reservations(args.incremental, date_depuis) else 0)
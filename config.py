@@ -33,5 +33,17 @@ class Config:
     INVOICE_PREFIX = "FAC"
     VAT_RATE = 20.0  # Default VAT rate (%)
     
+    # Availability engine settings
+    DISPONIBILITE_CACHE_TTL = int(os.environ.get('DISPONIBILITE_CACHE_TTL', 10))  # secondes, retard maximal entre workers
+    PLANNING_MAX_JOURS = 92  # Un trimestre maximum par requête de planning
+    PLANNING_MAX_TRANSPORTEURS = 200  # Lignes maximum par page de planning
+    RAPPORT_CAPACITE_MAX_JOURS = 366  # Une saison complète maximum par rapport de capacité
+    ICS_HISTORIQUE_JOURS = 90  # Prestations passées incluses dans les flux .ics des transporteurs
+    RAPPORT_STATISTIQUES_MAX_JOURS = 1096  # Trois ans maximum par lecture des agrégats journaliers
+    RAPPORT_COMMISSIONS_MAX_MOIS = 24  # Deux exercices maximum par relevé de commissions
+    COMMISSIONS_CACHE_TTL = int(os.environ.get('COMMISSIONS_CACHE_TTL', 300))  # secondes avant recalcul d'un mois clos
+    TABLEAU_DE_BORD_CACHE_TTL = int(os.environ.get('TABLEAU_DE_BORD_CACHE_TTL', 30))  # secondes
+    ANALYSE_CUBE_TTL = int(os.environ.get('ANALYSE_CUBE_TTL', 60))  # secondes entre deux rafraîchissements des cubes
+    
     # Session configuration
     PERMANENT_SESSION_LIFETIME = timedelta(days=7)
@@ -5,7 +5,7 @@ from wtforms import (
     SelectField, DateField, FloatField, BooleanField, 
     SelectMultipleField, HiddenField, IntegerField
 )
-from wtforms.validators import DataRequired, Email, Length, Optional, EqualTo
+from wtforms.validators import DataRequired, Email, Length, Optional, EqualTo, ValidationError
 from datetime import datetime, timedelta
 
 # Fonction de coercion personnalisu00e9e pour les select fields
@@ -17,6 +17,84 @@ def optional_int(value):
     except (ValueError, TypeError):
         return None
 
+class ChoixAsynchrone(SelectField):
+    """
+    Liste déroulante alimentée par /api/autocompletion/<source> au fil de la
+    saisie (static/js/autocompletion.js). Seule la valeur sélectionnée est
+    rendue, avec son libellé ; à la soumission, l'identifiant est vérifié par
+    une requête sur cette seule valeur au lieu de charger toutes les options.
+    
+    Args:
+        source: Type d'autocomplétion (client, transporteur, prestation)
+        placeholder: Option vide affichée en tête (valeur '')
+        parametres: Fonction (formulaire -> dict) de filtres de validation,
+            par exemple le client d'une prestation
+        recherche: Active le champ de recherche côté navigateur
+    """
+    
+    def __init__(self, label=None, validators=None, source=None, placeholder=None,
+                 parametres=None, recherche=True, **kwargs):
+        render_kw = dict(kwargs.pop('render_kw', None) or {})
+        if recherche:
+            render_kw['data-autocomplete'] = source
+        super().__init__(label, validators, coerce=optional_int, render_kw=render_kw, **kwargs)
+        self.source = source
+        self.placeholder = placeholder
+        self.parametres = parametres
+        self._libelles = None
+    
+    def _valeurs(self):
+        if self.data is None:
+            return []
+        return [self.data]
+    
+    def _selection(self):
+        # Libellés résolus une seule fois par rendu
+        from flask_login import current_user
+        from utils_modules.autocompletion import libelles
+        if self._libelles is None:
+            self._libelles = libelles(self.source, self._valeurs(), current_user)
+        return self._libelles
+    
+    def iter_choices(self):
+        valeurs = self._valeurs()
+        if self.placeholder is not None:
+            yield ('', self.placeholder, not valeurs, {})
+        # Options fournies par la route (liste courte, ex. prestations d'un client), puis la sélection
+        proposees = set()
+        for valeur, libelle in self.choices or []:
+            proposees.add(valeur)
+            yield (valeur, libelle, valeur in valeurs, {})
+        for valeur, libelle in self._selection().items():
+            if valeur not in proposees:
+                yield (valeur, libelle, True, {})
+    
+    def has_groups(self):
+        return False
+    
+    def pre_validate(self, form):
+        from flask_login import current_user
+        from utils_modules.autocompletion import ids_valides
+        valeurs = {v for v in self._valeurs() if v}
+        if not valeurs:
+            return
+        parametres = self.parametres(form) if self.parametres else None
+        if valeurs - ids_valides(self.source, valeurs, current_user, parametres):
+            raise ValidationError('Choix invalide.')
+
+
+class ChoixMultipleAsynchrone(ChoixAsynchrone, SelectMultipleField):
+    """Variante à sélection multiple de ChoixAsynchrone."""
+    widget = SelectMultipleField.widget
+    
+    def _valeurs(self):
+        return list(self.data or [])
+    
+    def populate_obj(self, obj, name):
+        # Des identifiants et non des objets : la relation est mise à jour par la route
+        pass
+
+
 class LoginForm(FlaskForm):
     username = StringField('Nom d\'utilisateur', validators=[DataRequired()])
     password = PasswordField('Mot de passe', validators=[DataRequired()])
@@ -56,10 +134,22 @@ class ClientForm(FlaskForm):
     submit = SubmitField('Enregistrer')
 
 class PrestationForm(FlaskForm):
-    client_id = SelectField('Client', coerce=optional_int, validators=[DataRequired()])
-    transporteurs = SelectMultipleField('Transporteurs', coerce=optional_int)
+    client_id = ChoixAsynchrone('Client', validators=[DataRequired()], source='client',
+                                placeholder='Sélectionnez un client')
+    transporteurs = ChoixMultipleAsynchrone('Transporteurs', source='transporteur')
     date_debut = DateField('Date de début', validators=[DataRequired()], default=datetime.now)
     date_fin = DateField('Date de fin', validators=[DataRequired()], default=datetime.now() + timedelta(days=1))
+    # Demi-journées pour partager une journée entre deux prestations
+    demi_journee_debut = SelectField('Début', choices=[
+        ('', 'Journée entière'),
+        ('matin', 'Matin'),
+        ('apres_midi', 'Après-midi')
+    ], default='')
+    demi_journee_fin = SelectField('Fin', choices=[
+        ('', 'Journée entière'),
+        ('matin', 'Matin'),
+        ('apres_midi', 'Après-midi')
+    ], default='')
     adresse_depart = TextAreaField('Adresse de départ', validators=[DataRequired()])
     adresse_arrivee = TextAreaField('Adresse d\'arrivée', validators=[DataRequired()])
     type_demenagement_id = SelectField('Type de déménagement', coerce=optional_int, validators=[DataRequired()])
@@ -90,8 +180,12 @@ class PrestationForm(FlaskForm):
     submit = SubmitField('Enregistrer')
 
 class FactureForm(FlaskForm):
-    client_id = SelectField('Client', coerce=optional_int, validators=[DataRequired()])
-    prestation_id = SelectField('Prestation', coerce=optional_int, validators=[Optional()])
+    client_id = ChoixAsynchrone('Client', validators=[DataRequired()], source='client',
+                                placeholder='Sélectionnez un client')
+    # Les prestations du client sont chargées par /factures/get_prestations/<client_id>
+    prestation_id = ChoixAsynchrone('Prestation', validators=[Optional()], source='prestation',
+                                    placeholder='Sélectionner une prestation (facultatif)', recherche=False,
+                                    parametres=lambda form: {'client_id': form.client_id.data})
     societe = SelectField('Société', choices=[
         ('', 'Sélectionner une société'),
         ('Cavalier', 'Cavalier'),
@@ -190,7 +284,7 @@ class SearchPrestationForm(FlaskForm):
     submit = SubmitField('Rechercher')
 
 class SearchFactureForm(FlaskForm):
-    client_id = SelectField('Client', coerce=optional_int)
+    client_id = HiddenField('Client', filters=[optional_int])  # Choisi par recherche asynchrone
     statut = SelectField('Statut')
     date_debut = DateField('Date début')
     date_fin = DateField('Date fin')
@@ -204,7 +298,8 @@ class SearchUserForm(FlaskForm):
     submit = SubmitField('Rechercher')
 
 class StockageForm(FlaskForm):
-    client_id = SelectField('Client', coerce=optional_int, validators=[DataRequired()])
+    client_id = ChoixAsynchrone('Client', validators=[DataRequired()], source='client',
+                                placeholder='Sélectionnez un client')
     reference = StringField('Référence', validators=[DataRequired()])
     date_debut = DateField('Date de début', validators=[DataRequired()], default=datetime.now)
     date_fin = DateField('Date de fin (facultative)', validators=[Optional()])
@@ -244,8 +339,8 @@ class ArticleStockageForm(FlaskForm):
     submit = SubmitField('Ajouter cet article')
 
 class SearchStockageForm(FlaskForm):
-    # Utiliser optional_int pour gérer les valeurs vides et autres cas problématiques
-    client_id = SelectField('Client', coerce=optional_int, validators=[Optional()])
+    client_id = ChoixAsynchrone('Client', validators=[Optional()], source='client',
+                                placeholder='Tous les clients')
     statut = SelectField('Statut')
     date_debut = DateField('Date début', validators=[Optional()])
     date_fin = DateField('Date fin', validators=[Optional()])
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script de migration pour le flux du calendrier par période et en mode delta :
+- colonne date_modification sur la table stockage ;
+- table suppression_calendrier (trace des prestations/stockages supprimés) et
+  sa colonne transporteur_id (retraits du calendrier d'un transporteur) ;
+- index sur les dates des prestations et des stockages, et sur prestation.date_modification.
+"""
+
+from app import create_app
+from extensions import db
+from models import SuppressionCalendrier
+from sqlalchemy import inspect, text
+import sys
+
+app = create_app()
+
+def migrate_calendrier_delta():
+    """
+    Ajoute les colonnes, la table et les index nécessaires au calendrier par période
+    """
+    try:
+        inspector = inspect(db.engine)
+
+        # 1. Colonne date_modification sur stockage
+        colonnes_stockage = [c['name'] for c in inspector.get_columns('stockage')]
+        if 'date_modification' not in colonnes_stockage:
+            db.session.execute(text("ALTER TABLE stockage ADD COLUMN date_modification TIMESTAMP"))
+            print("Colonne 'date_modification' ajoutée à la table stockage")
+
+        # 2. Table de suivi des suppressions
+        if not inspector.has_table('suppression_calendrier'):
+            SuppressionCalendrier.__table__.create(db.engine)
+            print("Table 'suppression_calendrier' créée")
+        else:
+            colonnes_suppression = [c['name'] for c in inspector.get_columns('suppression_calendrier')]
+            if 'transporteur_id' not in colonnes_suppression:
+                db.session.execute(text("ALTER TABLE suppression_calendrier ADD COLUMN transporteur_id INTEGER"))
+                db.session.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_suppression_calendrier_transporteur_id "
+                    "ON suppression_calendrier (transporteur_id)"
+                ))
+                print("Colonne 'transporteur_id' ajoutée à la table suppression_calendrier")
+
+        # 3. Index pour les filtres par période et le mode delta
+        index_a_creer = [
+            ('idx_prestation_dates', 'prestation', 'date_debut, date_fin'),
+            ('idx_prestation_date_modification', 'prestation', 'date_modification'),
+            ('idx_stockage_dates', 'stockage', 'date_debut, date_fin')
+        ]
+        for nom_index, table, colonnes in index_a_creer:
+            db.session.execute(text(f"CREATE INDEX IF NOT EXISTS {nom_index} ON {table} ({colonnes})"))
+            print(f"Index '{nom_index}' vérifié sur {table}({colonnes})")
+
+        db.session.commit()
+        print("Migration du calendrier terminée avec succès!")
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erreur lors de la migration: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    with app.app_context():
+        migrate_calendrier_delta()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script de migration pour les cubes d'analyse : ajoute la colonne
+facture.date_modification (rafraîchissement incrémental) et son index.
+"""
+
+from app import create_app
+from extensions import db
+from sqlalchemy import inspect, text
+import sys
+
+app = create_app()
+
+def migrate_facture_modification():
+    """
+    Ajoute la colonne date_modification à la table facture
+    """
+    try:
+        colonnes = [c['name'] for c in inspect(db.engine).get_columns('facture')]
+        if 'date_modification' not in colonnes:
+            db.session.execute(text("ALTER TABLE facture ADD COLUMN date_modification TIMESTAMP"))
+            print("Colonne 'date_modification' ajoutée à la table facture")
+
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_facture_date_modification ON facture (date_modification)"
+        ))
+        print("Index 'ix_facture_date_modification' vérifié")
+
+        db.session.commit()
+        print("Migration de la table facture terminée avec succès!")
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erreur lors de la migration: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    with app.app_context():
+        migrate_facture_modification()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script de migration de l'autocomplétion : crée les index lower(nom) et
+lower(prenom) des tables client et user, utilisés par la recherche par
+préfixe des champs de sélection (/api/autocompletion/<type>).
+"""
+
+from app import create_app
+from extensions import db
+from models import Client, User
+from sqlalchemy.schema import CreateIndex
+import sys
+
+app = create_app()
+
+def migrate_index_autocompletion():
+    """
+    Crée les index d'autocomplétion manquants
+    """
+    try:
+        for modele in (Client, User):
+            for index in modele.__table__.indexes:
+                if index.name.endswith('_lower'):
+                    # Index sur expression : non détectés par la réflexion, d'où IF NOT EXISTS
+                    db.session.execute(CreateIndex(index, if_not_exists=True))
+                    print(f"Index '{index.name}' vérifié")
+
+        db.session.commit()
+        print("Migration des index d'autocomplétion terminée avec succès!")
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erreur lors de la migration: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    with app.app_context():
+        migrate_index_autocompletion()
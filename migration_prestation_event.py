@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script de migration du journal des événements des prestations
+(utils_modules/evenements.py) :
+- table prestation_event et ses index (chronologie d'une prestation,
+  recherche par type sur une période).
+Les réponses déjà ajoutées au texte des observations y restent et sont
+toujours affichées.
+"""
+
+from app import create_app
+from extensions import db
+from models import PrestationEvenement
+from sqlalchemy import inspect
+import sys
+
+app = create_app()
+
+def migrate_prestation_event():
+    """
+    Crée la table prestation_event si elle n'existe pas
+    """
+    try:
+        if inspect(db.engine).has_table(PrestationEvenement.__tablename__):
+            print("La table prestation_event existe déjà")
+            return
+
+        PrestationEvenement.__table__.create(db.engine)
+        print("Table 'prestation_event' et index créés")
+        print("Migration du journal des événements terminée avec succès!")
+
+    except Exception as e:
+        print(f"Erreur lors de la migration: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    with app.app_context():
+        migrate_prestation_event()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script de migration de la recherche plein texte : crée la table
+recherche_index (FTS5 sous SQLite, tsvector + GIN sous PostgreSQL) et y
+indexe tous les clients, prestations, documents et factures.
+
+L'index est ensuite tenu à jour par l'application. Relancer ce script pour le
+reconstruire après des modifications faites hors de l'ORM.
+
+Utilisation :
+    python migration_recherche.py
+    python migration_recherche.py --taille-lot 1000
+"""
+
+import argparse
+import sys
+
+from app import create_app
+from extensions import db
+from utils_modules.recherche import TAILLE_LOT_DEFAUT, creer_index, reconstruire
+
+app = create_app()
+
+def migrate_recherche(taille_lot=TAILLE_LOT_DEFAUT):
+    """
+    Crée l'index de recherche et l'alimente
+    """
+    try:
+        creer_index(db.session.connection())
+        print("Table 'recherche_index' vérifiée")
+
+        nb_objets = reconstruire(taille_lot=taille_lot, journal=print)
+        db.session.commit()
+        print(f"{nb_objets} objets indexés")
+        print("Migration de la recherche terminée avec succès!")
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erreur lors de la migration: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crée et remplit l'index de recherche plein texte")
+    parser.add_argument('--taille-lot', type=int, default=TAILLE_LOT_DEFAUT,
+                        help="Nombre d'objets indexés par requête")
+    args = parser.parse_args()
+
+    with app.app_context():
+        migrate_recherche(args.taille_lot)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script de migration des agrégats journaliers : crée la table stats_daily et
+la (re)construit à partir des clients, prestations, factures et stockages.
+
+La table est ensuite maintenue à chaque écriture par l'application. Relancer
+ce script après des modifications faites hors de l'ORM (SQL brut, mises à
+jour en masse), de préférence en période creuse : les écritures faites
+pendant la reconstruction ne sont pas reprises.
+
+Utilisation :
+    python migration_stats_daily.py
+    python migration_stats_daily.py --taille-lot 5000
+"""
+
+import argparse
+import sys
+
+from app import create_app
+from extensions import db
+from models import StatJournaliere
+from sqlalchemy import inspect
+from utils_modules.stats_journalieres import TAILLE_LOT_DEFAUT, reconstruire
+
+app = create_app()
+
+def migrate_stats_daily(taille_lot=TAILLE_LOT_DEFAUT):
+    """
+    Crée la table stats_daily si besoin et reconstruit les agrégats
+    """
+    try:
+        if not inspect(db.engine).has_table('stats_daily'):
+            StatJournaliere.__table__.create(db.engine)
+            print("Table 'stats_daily' créée")
+
+        nb_lignes = reconstruire(taille_lot=taille_lot, journal=print)
+        db.session.commit()
+        print(f"{nb_lignes} agrégats journaliers écrits")
+        print("Migration des agrégats journaliers terminée avec succès!")
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erreur lors de la migration: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruit la table des agrégats journaliers")
+    parser.add_argument('--taille-lot', type=int, default=TAILLE_LOT_DEFAUT,
+                        help="Nombre de lignes lues par requête")
+    args = parser.parse_args()
+
+    with app.app_context():
+        migrate_stats_daily(args.taille_lot)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script de migration pour les flux .ics des transporteurs :
+ajoute la colonne user.token_calendrier et son index unique.
+"""
+
+from app import create_app
+from extensions import db
+from sqlalchemy import inspect, text
+import sys
+
+app = create_app()
+
+def migrate_token_calendrier():
+    """
+    Ajoute la colonne token_calendrier à la table user
+    """
+    try:
+        colonnes = [c['name'] for c in inspect(db.engine).get_columns('user')]
+        if 'token_calendrier' not in colonnes:
+            db.session.execute(text('ALTER TABLE "user" ADD COLUMN token_calendrier VARCHAR(64)'))
+            print("Colonne 'token_calendrier' ajoutée à la table user")
+
+        # L'unicité est portée par un index (ALTER TABLE ... ADD COLUMN UNIQUE n'est pas supporté par SQLite)
+        db.session.execute(text(
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_user_token_calendrier ON "user" (token_calendrier)'
+        ))
+        print("Index unique 'idx_user_token_calendrier' vérifié")
+
+        db.session.commit()
+        print("Migration du token calendrier terminée avec succès!")
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erreur lors de la migration: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    with app.app_context():
+        migrate_token_calendrier()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script de migration de l'historique des prestations par différences
+(utils_modules/versions.py) :
+- colonnes instantane et champs sur la table prestation_version (les
+  versions existantes, complètes, sont marquées comme instantanés) ;
+- index (prestation_id, version) pour la reconstruction des versions.
+"""
+
+from app import create_app
+from extensions import db
+from sqlalchemy import inspect, text
+import sys
+
+app = create_app()
+
+def migrate_versions_delta():
+    """
+    Ajoute les colonnes et l'index de l'historique par différences
+    """
+    try:
+        colonnes = [c['name'] for c in inspect(db.engine).get_columns('prestation_version')]
+
+        if 'instantane' not in colonnes:
+            db.session.execute(text(
+                "ALTER TABLE prestation_version ADD COLUMN instantane BOOLEAN NOT NULL DEFAULT TRUE"
+            ))
+            print("Colonne 'instantane' ajoutée à la table prestation_version")
+
+        if 'champs' not in colonnes:
+            db.session.execute(text("ALTER TABLE prestation_version ADD COLUMN champs VARCHAR(500)"))
+            print("Colonne 'champs' ajoutée à la table prestation_version")
+
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_prestation_version ON prestation_version (prestation_id, version)"
+        ))
+        print("Index 'idx_prestation_version' vérifié")
+
+        db.session.commit()
+        print("Migration de l'historique des versions terminée avec succès!")
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erreur lors de la migration: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    with app.app_context():
+        migrate_versions_delta()
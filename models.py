@@ -1,3 +1,4 @@
+import secrets
 from datetime import datetime
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -41,6 +42,13 @@ class User(UserMixin, db.Model):
     notes = db.Column(db.Text, nullable=True)
     derniere_connexion = db.Column(db.DateTime, nullable=True)
     date_creation = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    token_calendrier = db.Column(db.String(64), unique=True, nullable=True)  # Abonnement au flux .ics
+    
+    # Index pour l'autocomplétion par préfixe (utils_modules/autocompletion.py)
+    __table_args__ = (
+        db.Index('idx_user_nom_lower', db.func.lower(nom)),
+        db.Index('idx_user_prenom_lower', db.func.lower(prenom)),
+    )
     
     prestations = db.relationship('Prestation', secondary=prestation_transporteurs, back_populates='transporteurs')
     type_vehicule = db.relationship('TypeVehicule', backref='transporteurs')
@@ -59,23 +67,34 @@ class User(UserMixin, db.Model):
     
     def is_transporteur(self):
         return self.role == 'transporteur' or self.is_admin()
+    
+    def generer_token_calendrier(self):
+        """Génère (ou régénère, ce qui révoque l'ancien lien) le token du flux .ics"""
+        self.token_calendrier = secrets.token_urlsafe(32)
+        return self.token_calendrier
 
 class Client(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nom = db.Column(db.String(64), nullable=False)
     prenom = db.Column(db.String(64), nullable=False)
-    adresse = db.Column(db.Text, nullable=True)
+    adresse = db.deferred(db.Column(db.Text, nullable=True))  # Différée : voir utils_modules/chargement.py
     code_postal = db.Column(db.String(10), nullable=True)
     ville = db.Column(db.String(64), nullable=True)
     pays = db.Column(db.String(64), default='France')
     telephone = db.Column(db.String(20), nullable=True)
     email = db.Column(db.String(120), nullable=True)
     type_client = db.Column(db.String(50), nullable=True)
-    tags = db.Column(db.Text, nullable=True)
+    tags = db.deferred(db.Column(db.Text, nullable=True))
     statut = db.Column(db.String(20), default='actif')
     archive = db.Column(db.Boolean, default=False)
     date_creation = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
+    # Index pour l'autocomplétion par préfixe (utils_modules/autocompletion.py)
+    __table_args__ = (
+        db.Index('idx_client_nom_lower', db.func.lower(nom)),
+        db.Index('idx_client_prenom_lower', db.func.lower(prenom)),
+    )
+    
     prestations_principales = db.relationship('Prestation', backref=db.backref('client_principal', lazy=True), lazy=True, foreign_keys="Prestation.client_id")
     prestations_supplementaires = db.relationship('Prestation', secondary=prestation_clients, back_populates='clients_supplementaires')
     factures = db.relationship('Facture', backref='client', lazy=True)
@@ -91,7 +110,7 @@ class Document(db.Model):
     taille = db.Column(db.Integer, nullable=True)   # Taille en octets
     format = db.Column(db.String(20), nullable=True)  # Extension du fichier (pdf, jpg, etc.)
     notes = db.Column(db.Text, nullable=True)  # Notes sur le document
-    observations_supplementaires = db.Column(db.Text, nullable=True)  # Observations supplémentaires (texte enrichi)
+    observations_supplementaires = db.deferred(db.Column(db.Text, nullable=True))  # Observations supplémentaires (texte enrichi, différé)
     tags = db.Column(db.String(200), nullable=True)  # Tags pour faciliter la recherche
     statut = db.Column(db.String(50), default='Actif')  # Actif, Archivé, Supprimé
     date_upload = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -227,10 +246,10 @@ class Prestation(db.Model):
     status_transporteur = db.Column(db.String(20), default='en_attente')  # en_attente, accepte, refuse
     raison_refus = db.Column(db.Text, nullable=True)  # Raison du refus par le transporteur
     date_reponse = db.Column(db.DateTime, nullable=True)  # Date de réponse du transporteur
-    observations = db.Column(db.Text, nullable=True)
+    observations = db.deferred(db.Column(db.Text, nullable=True))  # Historique des réponses, différé
     archive = db.Column(db.Boolean, default=False)
     date_creation = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    date_modification = db.Column(db.DateTime, nullable=True)
+    date_modification = db.Column(db.DateTime, nullable=True, onupdate=datetime.utcnow)
     createur_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     modificateur_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     stockage_id = db.Column(db.Integer, db.ForeignKey('stockage.id'), nullable=True)
@@ -239,6 +258,12 @@ class Prestation(db.Model):
     societe = db.Column(db.String(100), nullable=True)
     montant = db.Column(db.Float, nullable=True, default=0)
     
+    # Index pour les requêtes par période (calendrier, disponibilités) et le mode delta
+    __table_args__ = (
+        db.Index('idx_prestation_dates', 'date_debut', 'date_fin'),
+        db.Index('idx_prestation_date_modification', 'date_modification'),
+    )
+    
     # Relations
     commercial = db.relationship('User', foreign_keys=[commercial_id], backref='prestations_commercial')
     createur = db.relationship('User', foreign_keys=[createur_id], backref='prestations_creees')
@@ -247,7 +272,8 @@ class Prestation(db.Model):
     clients_supplementaires = db.relationship('Client', secondary=prestation_clients, back_populates='prestations_supplementaires')
     factures = db.relationship('Facture', backref='prestation', lazy=True)
     type_demenagement_obj = db.relationship('TypeDemenagement', backref='prestations')
-    versions = db.relationship('PrestationVersion', backref='prestation_courante', lazy=True, foreign_keys="PrestationVersion.prestation_id")
+    versions = db.relationship('PrestationVersion', backref='prestation_courante', lazy=True, foreign_keys="PrestationVersion.prestation_id", cascade='all, delete-orphan')
+    evenements = db.relationship('PrestationEvenement', backref='prestation', lazy=True, cascade='all, delete-orphan')
     
     def __repr__(self):
         return f"Prestation {self.id} - {self.client_principal.nom} {self.client_principal.prenom}"
@@ -262,15 +288,42 @@ class PrestationVersion(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     prestation_id = db.Column(db.Integer, db.ForeignKey('prestation.id'), nullable=False)
     version = db.Column(db.Integer, nullable=False)
-    donnees = db.Column(db.Text, nullable=False)  # JSON avec toutes les données de la prestation
+    donnees = db.deferred(db.Column(db.Text, nullable=False))  # JSON : données complètes ou champs modifiés (différé)
+    instantane = db.Column(db.Boolean, nullable=False, default=True)  # True : données complètes, False : delta (utils_modules/versions.py)
+    champs = db.Column(db.String(500), nullable=True)  # Champs modifiés par cette version, séparés par des virgules
     modifie_par = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     date_modification = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('idx_prestation_version', 'prestation_id', 'version'),
+    )
+    
     modificateur = db.relationship('User', backref='versions_prestations')
     
     def __repr__(self):
         return f"Version {self.version} de Prestation {self.prestation_id}"
 
+class PrestationEvenement(db.Model):
+    """Journal des événements d'une prestation, en ajout seul (voir utils_modules/evenements.py)"""
+    __tablename__ = 'prestation_event'
+    id = db.Column(db.Integer, primary_key=True)
+    prestation_id = db.Column(db.Integer, db.ForeignKey('prestation.id'), nullable=False)
+    type = db.Column(db.String(50), nullable=False)  # acceptation, refus, assignation
+    acteur_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    donnees = db.Column(db.Text, nullable=True)  # JSON : commentaire, raison, transporteur...
+    
+    # Chronologie d'une prestation, et recherche par type sur une période
+    __table_args__ = (
+        db.Index('idx_prestation_event_prestation', 'prestation_id', 'date', 'id'),
+        db.Index('idx_prestation_event_type', 'type', 'date'),
+    )
+    
+    acteur = db.relationship('User')
+    
+    def __repr__(self):
+        return f"<PrestationEvenement {self.type} de Prestation {self.prestation_id}>"
+
 class Facture(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     numero = db.Column(db.String(50), unique=True, nullable=False)
@@ -287,6 +340,11 @@ class Facture(db.Model):
     mode_paiement = db.Column(db.String(50), nullable=True)
     observations = db.Column(db.Text, nullable=True)
     commercial_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    societe = db.Column(db.String(50), nullable=True)  # Ajoutée par migration_facture_societe.py
+    montant_acompte = db.Column(db.Float, nullable=True, default=0)  # Colonnes ajoutées par update_facture_schema.py
+    commission_pourcentage = db.Column(db.Float, nullable=True, default=0)
+    commission_montant = db.Column(db.Float, nullable=True, default=0)
+    date_modification = db.Column(db.DateTime, nullable=True, onupdate=datetime.utcnow, index=True)
     
     commercial = db.relationship('User', foreign_keys=[commercial_id], backref='factures_creees')
     fichiers = db.relationship('FichierFacture', backref='facture', lazy=True, cascade="all, delete-orphan")
@@ -333,6 +391,11 @@ class Stockage(db.Model):
     observations = db.Column(db.Text, nullable=True)
     archive = db.Column(db.Boolean, default=False)
     date_creation = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    date_modification = db.Column(db.DateTime, nullable=True, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('idx_stockage_dates', 'date_debut', 'date_fin'),
+    )
     
     client = db.relationship('Client', backref='stockages')
     factures = db.relationship('Facture', backref='stockage', lazy=True)
@@ -373,9 +436,33 @@ class ArticleStockage(db.Model):
     def __repr__(self):
         return f"<ArticleStockage {self.nom}>"
 
+class SuppressionCalendrier(db.Model):
+    """Trace des prestations et stockages supprimés, pour le mode delta du calendrier"""
+    __tablename__ = 'suppression_calendrier'
+    id = db.Column(db.Integer, primary_key=True)
+    type_objet = db.Column(db.String(20), nullable=False)  # prestation, stockage
+    objet_id = db.Column(db.Integer, nullable=False)
+    # Transporteur du calendrier duquel la prestation est retirée (désaffectation ou suppression) ;
+    # vide : suppression, pour les calendriers qui voient toutes les prestations
+    transporteur_id = db.Column(db.Integer, nullable=True, index=True)
+    date_suppression = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f"<SuppressionCalendrier {self.type_objet} {self.objet_id}>"
+
+class StatJournaliere(db.Model):
+    """Agrégat journalier d'un indicateur, maintenu à chaque écriture (voir utils_modules/stats_journalieres.py)"""
+    __tablename__ = 'stats_daily'
+    jour = db.Column(db.Date, primary_key=True)
+    indicateur = db.Column(db.String(80), primary_key=True)  # ex: factures_emises, prestations_creees:En attente
+    valeur = db.Column(db.Float, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<StatJournaliere {self.jour} {self.indicateur}={self.valeur}>"
+
 class Notification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    message = db.Column(db.Text, nullable=False)
+    message = db.deferred(db.Column(db.Text, nullable=False))  # Différé : voir utils_modules/chargement.py
     type = db.Column(db.String(50), nullable=False, default='info')  # info, success, warning, danger
     date_creation = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     lu = db.Column(db.Boolean, default=False)
@@ -16,6 +16,9 @@ from utils import (
     save_document, generate_invoice_number, 
     calculate_dashboard_stats, is_authorized
 )
+from utils_modules.disponibilite import get_index_disponibilite, SOURCE_TRANSPORTEUR_ID
+from utils_modules.clients import compteurs_clients, filtrer_clients
+from utils_modules.pagination import paginer_keyset
 
 # Blueprints
 auth_bp = Blueprint('auth', __name__)
@@ -71,26 +74,23 @@ def index():
     show_archived = request.args.get('archives', False) == 'true'
     search_query = request.args.get('query', '')
     
-    # Base query
-    query = Client.query
-    
-    # Apply filters
-    if not show_archived:
-        query = query.filter_by(archive=False)
-    
-    if search_query:
-        query = query.filter(
-            (Client.nom.ilike(f'%{search_query}%')) |
-            (Client.prenom.ilike(f'%{search_query}%')) |
-            (Client.email.ilike(f'%{search_query}%')) |
-            (Client.telephone.ilike(f'%{search_query}%'))
-        )
-    
-    # Execute query
-    clients = query.order_by(Client.date_creation.desc()).all()
+    # Mêmes filtres et même pagination par curseur que routes/client.py
+    query = filtrer_clients(Client.query, search_query, None if show_archived else False)
+    try:
+        page = paginer_keyset(query, Client.date_creation, Client.id,
+                              apres=request.args.get('apres'), avant=request.args.get('avant'),
+                              par_page=request.args.get('per_page', 24, type=int))
+    except ValueError:
+        return redirect(url_for('client.index'))
     
     return render_template('clients/index.html', 
-                           clients=clients, 
+                           clients=page.items, 
+                           compteurs=compteurs_clients([c.id for c in page.items]),
+                           pagination=page,
+                           pagination_endpoint='client.index',
+                           pagination_parametres={'query': search_query, 'archives': request.args.get('archives', '')},
+                           total=None,
+                           total_exact=True,
                            form=form, 
                            show_archived=show_archived,
                            search_query=search_query,
@@ -196,7 +196,8 @@ def delete(id):
     client = Client.query.get_or_404(id)
     
     # Check if client has prestations or factures
-    if client.prestations or client.factures:
+    compteurs = compteurs_clients([client.id])[client.id]
+    if compteurs['prestations'] or compteurs['factures']:
         flash('Impossible de supprimer ce client car il a des prestations ou factures associées.', 'danger')
         return redirect(url_for('client.index'))
     
@@ -748,20 +749,17 @@ def check_disponibilite():
     ).all()
     
     # Filtrer les transporteurs qui ont déjà des prestations durant cette période
-    transporteurs_occupes_ids = []
-    
-    prestations_periode = Prestation.query.filter(
-        Prestation.date_debut < date_fin_obj,
-        Prestation.date_fin > date_debut_obj
-    )
-    
-    # Exclure la prestation en cours d'édition
-    if prestation_id and prestation_id != 'null':
-        prestations_periode = prestations_periode.filter(Prestation.id != int(prestation_id))
-    
-    for prestation in prestations_periode.all():
-        if prestation.transporteur_id:
-            transporteurs_occupes_ids.append(prestation.transporteur_id)
+    # (index d'intervalles sur l'ancienne colonne Prestation.transporteur_id)
+    if prestation_id == 'null':
+        prestation_id = None
+    index = get_index_disponibilite(SOURCE_TRANSPORTEUR_ID)
+    reservations = {
+        t_id: [r for r in liste if r.debut < date_fin_obj and r.fin > date_debut_obj]
+        for t_id, liste in index.reservations_par_transporteur(
+            date_debut_obj, date_fin_obj, exclure_prestation_id=prestation_id
+        ).items()
+    }
+    transporteurs_occupes_ids = [t_id for t_id, liste in reservations.items() if liste]
     
     # Filtrer les transporteurs disponibles
     transporteurs_disponibles = [t for t in transporteurs_disponibles if t.id not in transporteurs_occupes_ids]
@@ -777,18 +775,16 @@ def check_disponibilite():
     
     for transporteur in transporteurs_occupes:
         # Trouver la prochaine date de disponibilité
-        derniere_prestation = Prestation.query.filter(
-            Prestation.transporteur_id == transporteur.id,
-            Prestation.date_fin > date_debut_obj
-        ).order_by(Prestation.date_fin.asc()).first()
+        fins = [r.fin for r in index.reservations_transporteur(transporteur.id) if r.fin > date_debut_obj]
+        derniere_fin = min(fins) if fins else None
         
-        if derniere_prestation and derniere_prestation.date_fin < date_fin_plus_30:
+        if derniere_fin and derniere_fin < date_fin_plus_30:
             transporteurs_bientot_disponibles.append({
                 'id': transporteur.id,
                 'nom': transporteur.nom,
                 'email': transporteur.email,
                 'type_vehicule': transporteur.type_vehicule,
-                'disponible_le': derniere_prestation.date_fin.strftime('%d/%m/%Y')
+                'disponible_le': derniere_fin.strftime('%d/%m/%Y')
             })
     
     # Véhicules suggérés selon le type de prestation
@@ -1,9 +1,24 @@
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, jsonify, request, current_app, Response, stream_with_context, url_for
 from flask_login import current_user, login_required
-from models import TypeDemenagement, TypeVehicule, User, Prestation, Transporteur, Vehicule, Client
+from models import TypeDemenagement, TypeVehicule, User, Prestation, PrestationVersion, Transporteur, Vehicule, Client, Document, Facture
 from datetime import datetime, timedelta
 from sqlalchemy import or_, and_
 from extensions import db
+from utils_modules.disponibilite import get_index_disponibilite
+from utils_modules.creneaux import periode_demandee
+from utils_modules.chargement import textes_longs
+from utils_modules.capacite import rapport_capacite, generer_csv
+from utils_modules.stats_journalieres import statistiques_periode
+from utils_modules.analyse import CUBES, ErreurAnalyse, analyser, parser_mois
+from utils_modules.commissions import COLONNES_RELEVE, releves
+from utils_modules.recherche import rechercher
+from utils_modules.prestations import OPERATIONS, ErreurOperation, operation_masse
+from utils_modules.reponses import ErreurReponse, repondre
+from utils_modules.evenements import TYPES, evenement_en_dict, journaliser, page_evenements, requete_evenements
+from utils_modules.versions import comparer_versions, reconstruire_version
+from utils_modules.autocompletion import (
+    ErreurAutocompletion, libelles as autocompletion_libelles, rechercher as autocompletion_rechercher
+)
 
 api_bp = Blueprint('api', __name__)
 
@@ -56,10 +71,11 @@ def get_transporteurs_disponibles():
         if not date_debut or not date_fin:
             return jsonify({'success': False, 'message': 'Dates requises'}), 400
         
-        # Convertir les dates en objets datetime
+        # Convertir les dates, à la demi-journée près si demandé
         try:
-            date_debut = datetime.strptime(date_debut, '%Y-%m-%d')
-            date_fin = datetime.strptime(date_fin, '%Y-%m-%d')
+            date_debut, date_fin = periode_demandee(
+                date_debut, date_fin, data.get('demi_journee_debut'), data.get('demi_journee_fin')
+            )
         except ValueError:
             return jsonify({'success': False, 'message': 'Format de date invalide'}), 400
         
@@ -69,31 +85,18 @@ def get_transporteurs_disponibles():
             type_demenagement = TypeDemenagement.query.get(type_demenagement_id)
         
         # Récupérer tous les transporteurs (utilisateurs avec rôle transporteur)
-        transporteurs = User.query.filter_by(role='transporteur', statut='actif').all()
-        
-        # Récupérer les prestations existantes dans cette période
-        prestations = Prestation.query.filter(
-            or_(
-                and_(
-                    Prestation.date_debut >= date_debut,
-                    Prestation.date_debut <= date_fin
-                ),
-                and_(
-                    Prestation.date_fin >= date_debut,
-                    Prestation.date_fin <= date_fin
-                ),
-                and_(
-                    Prestation.date_debut <= date_debut,
-                    Prestation.date_fin >= date_fin
-                )
-            )
-        ).all()
+        transporteurs = User.query.options(
+            db.joinedload(User.type_vehicule)
+        ).filter_by(role='transporteur', statut='actif').all()
         
         # Transporteurs déjà occupés (via la table d'association prestation_transporteurs)
-        transporteurs_occupes = set()
-        for p in prestations:
-            for t in p.transporteurs:
-                transporteurs_occupes.add(t.id)
+        index = get_index_disponibilite()
+        transporteurs_occupes = index.transporteurs_occupes(date_debut, date_fin)
+        
+        # Prochain créneau libre de la même durée pour tous les transporteurs occupés, en une passe
+        prochaines_dispos = index.prochaines_disponibilites(
+            transporteurs_occupes, date_debut, date_fin - date_debut
+        )
         
         # Types de véhicules recommandés
         types_vehicule_recommandes = []
@@ -103,33 +106,26 @@ def get_transporteurs_disponibles():
         # Préparer les résultats
         resultats = []
         for user in transporteurs:
-            # Récupérer le transporteur associé
-            transporteur = Transporteur.query.filter_by(user_id=user.id).first()
-            if not transporteur:
-                continue
-                
             # Vérifier si le transporteur est occupé
             disponible = user.id not in transporteurs_occupes
             
             # Vérifier si le transporteur a un véhicule du type recommandé
             vehicule_compatible = True
-            if types_vehicule_recommandes and transporteur.vehicule_id:
-                vehicule = Vehicule.query.get(transporteur.vehicule_id)
-                if vehicule and vehicule.type_id not in types_vehicule_recommandes:
-                    vehicule_compatible = False
+            if types_vehicule_recommandes and user.type_vehicule_id:
+                vehicule_compatible = user.type_vehicule_id in types_vehicule_recommandes
             
-            # Récupérer les informations du véhicule
+            # Véhicule déclaré par le transporteur (les véhicules du parc ne sont pas liés aux utilisateurs)
             vehicule_info = None
-            if transporteur.vehicule_id:
-                vehicule = Vehicule.query.get(transporteur.vehicule_id)
-                if vehicule:
-                    vehicule_info = {
-                        'id': vehicule.id,
-                        'marque': vehicule.marque,
-                        'modele': vehicule.modele,
-                        'immatriculation': vehicule.immatriculation,
-                        'type': vehicule.type.nom if vehicule.type else 'Non spécifié'
-                    }
+            if user.vehicule or user.type_vehicule:
+                vehicule_info = {
+                    'nom': user.vehicule,
+                    'type_id': user.type_vehicule_id,
+                    'type': user.type_vehicule.nom if user.type_vehicule else 'Non spécifié'
+                }
+            
+            prochaine_disponibilite = None
+            if not disponible:
+                prochaine_disponibilite = prochaines_dispos[user.id].strftime('%Y-%m-%d')
             
             # Ajouter le transporteur au résultat
             resultats.append({
@@ -137,12 +133,10 @@ def get_transporteurs_disponibles():
                 'nom': user.nom,
                 'prenom': user.prenom,
                 'email': user.email,
-                'telephone': user.telephone,
                 'disponible': disponible,
                 'vehicule_compatible': vehicule_compatible,
                 'vehicule': vehicule_info,
-                'note': transporteur.note,
-                'prochaine_disponibilite': None  # À implémenter
+                'prochaine_disponibilite': prochaine_disponibilite
             })
         
         return jsonify({
@@ -259,42 +253,28 @@ def check_transporteur_disponibilite():
         if not transporteur_ids or not date_debut or not date_fin:
             return jsonify({'success': False, 'message': 'Paramètres manquants'}), 400
         
-        # Convertir les dates en objets datetime
+        # Convertir les dates, à la demi-journée près si demandé
         try:
-            date_debut = datetime.strptime(date_debut, '%Y-%m-%d')
-            date_fin = datetime.strptime(date_fin, '%Y-%m-%d')
+            date_debut, date_fin = periode_demandee(
+                date_debut, date_fin, data.get('demi_journee_debut'), data.get('demi_journee_fin')
+            )
         except ValueError:
             return jsonify({'success': False, 'message': 'Format de date invalide'}), 400
         
-        # Récupérer les prestations existantes dans cette période
-        query = Prestation.query.filter(
-            or_(
-                and_(
-                    Prestation.date_debut >= date_debut,
-                    Prestation.date_debut <= date_fin
-                ),
-                and_(
-                    Prestation.date_fin >= date_debut,
-                    Prestation.date_fin <= date_fin
-                ),
-                and_(
-                    Prestation.date_debut <= date_debut,
-                    Prestation.date_fin >= date_fin
-                )
-            )
+        # Transporteurs déjà occupés (en excluant la prestation en cours de modification)
+        transporteurs_occupes = get_index_disponibilite().transporteurs_occupes(
+            date_debut, date_fin, exclure_prestation_id=prestation_id
         )
         
-        # Exclure la prestation actuelle si on est en mode modification
-        if prestation_id:
-            query = query.filter(Prestation.id != prestation_id)
-            
-        prestations = query.all()
-        
-        # Transporteurs déjà occupés
-        transporteurs_occupes = set()
-        for p in prestations:
-            for t in p.transporteurs:
-                transporteurs_occupes.add(t.id)
+        # Charger en une seule requête les transporteurs demandés
+        ids_valides = []
+        for transporteur_id in transporteur_ids:
+            try:
+                ids_valides.append(int(transporteur_id))
+            except ValueError:
+                # Ignorer les IDs non valides
+                pass
+        users = {u.id: u for u in User.query.filter(User.id.in_(ids_valides)).all()} if ids_valides else {}
         
         # Vérifier la disponibilité de chaque transporteur
         resultats = {}
@@ -304,7 +284,7 @@ def check_transporteur_disponibilite():
                 disponible = transporteur_id not in transporteurs_occupes
                 
                 # Récupérer les informations du transporteur
-                user = User.query.get(transporteur_id)
+                user = users.get(transporteur_id)
                 if user:
                     resultats[transporteur_id] = {
                         'id': user.id,
@@ -465,6 +445,9 @@ def get_transporteur_prestations(transporteur_id):
             'message': f"Une erreur est survenue: {str(e)}"
         }), 500
 
+# Code HTTP des réponses de transporteur rejetées
+CODES_REPONSE = {'statut_invalide': 400, 'introuvable': 404, 'non_assigne': 403, 'deja_repondu': 409}
+
 @api_bp.route('/prestation/<int:prestation_id>/status', methods=['POST'])
 def update_prestation_status(prestation_id):
     """
@@ -495,57 +478,21 @@ def update_prestation_status(prestation_id):
                 'message': 'Statut invalide'
             }), 400
         
-        # Récupérer la prestation
-        prestation = Prestation.query.get(prestation_id)
-        if not prestation:
-            return jsonify({
-                'success': False,
-                'message': 'Prestation non trouvée'
-            }), 404
-        
-        # Vérifier que l'utilisateur est autorisé (soit un transporteur assigné, soit un admin/commercial)
-        is_assigned = current_user in prestation.transporteurs
-        is_authorized = current_user.is_admin() or current_user.role == 'commercial'
-        
-        if not (is_assigned or is_authorized):
-            return jsonify({
-                'success': False,
-                'message': 'Vous n\'êtes pas autorisé à modifier cette prestation'
-            }), 403
-        
-        # Mettre à jour le statut
-        prestation.status_transporteur = status
-        
-        # Enregistrer la date de réponse
-        prestation.date_reponse = datetime.now()
-        
-        # Enregistrer la raison du refus si le statut est 'refuse'
-        if status == 'refuse' and reason:
-            prestation.raison_refus = reason
-        
-        # Ajouter une note si une raison est fournie
-        if reason:
-            # Créer ou mettre à jour les notes de la prestation
-            if prestation.observations:
-                prestation.observations += f"\n\n[{datetime.now().strftime('%d/%m/%Y %H:%M')}] Réponse du transporteur {current_user.prenom} {current_user.nom}: {status.upper()}\n{reason}"
-            else:
-                prestation.observations = f"[{datetime.now().strftime('%d/%m/%Y %H:%M')}] Réponse du transporteur {current_user.prenom} {current_user.nom}: {status.upper()}\n{reason}"
+        # Un admin ou un commercial peut enregistrer la réponse d'un transporteur
+        transporteur_id = current_user.id
+        if data.get('transporteur_id') is not None:
+            if not (current_user.is_admin() or current_user.role == 'commercial'):
+                return jsonify({
+                    'success': False,
+                    'message': 'Vous n\'êtes pas autorisé à modifier cette prestation'
+                }), 403
+            transporteur_id = int(data['transporteur_id'])
         
-        # Mettre à jour la date de modification
-        prestation.date_modification = datetime.now()
-        prestation.modificateur_id = current_user.id
-        
-        # Si la prestation est refusée, mettre à jour son statut global
-        if status == 'refuse' and current_user.role == 'transporteur':
-            # Retirer le transporteur de la prestation
-            prestation.transporteurs.remove(current_user)
-            
-            # Si c'était le seul transporteur, mettre la prestation en attente
-            if len(prestation.transporteurs) == 0:
-                prestation.statut = 'En attente'
-        
-        # Sauvegarder les modifications
-        db.session.commit()
+        # Transition conditionnelle, effets et commit dans une seule transaction
+        try:
+            repondre(prestation_id, transporteur_id, status, reason or None, acteur_id=current_user.id)
+        except ErreurReponse as e:
+            return jsonify({'success': False, 'message': str(e)}), CODES_REPONSE[e.code]
         
         return jsonify({
             'success': True,
@@ -582,47 +529,38 @@ def check_disponibilite():
         if not date_debut or not date_fin:
             return jsonify({'success': False, 'message': 'Dates requises'}), 400
         
-        # Convertir les dates en objets datetime
+        # Convertir les dates, à la demi-journée près si demandé
         try:
-            date_debut_obj = datetime.strptime(date_debut, '%Y-%m-%d')
-            date_fin_obj = datetime.strptime(date_fin, '%Y-%m-%d')
+            date_debut_obj, date_fin_obj = periode_demandee(
+                date_debut, date_fin, data.get('demi_journee_debut'), data.get('demi_journee_fin')
+            )
         except ValueError:
             return jsonify({'success': False, 'message': 'Format de date invalide'}), 400
         
-        # Récupérer tous les transporteurs actifs
-        transporteurs = User.query.filter_by(role='transporteur', statut='actif').all()
+        # Récupérer tous les transporteurs actifs avec leur type de véhicule
+        transporteurs = User.query.options(
+            db.joinedload(User.type_vehicule)
+        ).filter_by(role='transporteur', statut='actif').all()
         
-        # Récupérer les prestations existantes dans cette période
-        prestations = Prestation.query.filter(
-            or_(
-                and_(
-                    Prestation.date_debut >= date_debut_obj,
-                    Prestation.date_debut <= date_fin_obj
-                ),
-                and_(
-                    Prestation.date_fin >= date_debut_obj,
-                    Prestation.date_fin <= date_fin_obj
-                ),
-                and_(
-                    Prestation.date_debut <= date_debut_obj,
-                    Prestation.date_fin >= date_fin_obj
-                )
-            )
-        ).all()
+        # Réservations qui chevauchent la période, regroupées par transporteur (index d'intervalles)
+        index = get_index_disponibilite()
+        reservations = index.reservations_par_transporteur(date_debut_obj, date_fin_obj)
         
-        # Créer un dictionnaire pour stocker les transporteurs et leurs prestations
-        transporteurs_prestations = {t.id: [] for t in transporteurs}
+        # Premier créneau libre de la même durée pour chaque transporteur occupé
+        prochaines_dispos = index.prochaines_disponibilites(
+            reservations.keys(), date_debut_obj, date_fin_obj - date_debut_obj
+        )
         
-        # Remplir le dictionnaire avec les prestations
-        for p in prestations:
-            for t in p.transporteurs:
-                if t.id in transporteurs_prestations:
-                    transporteurs_prestations[t.id].append({
-                        'id': p.id,
-                        'date_debut': p.date_debut.strftime('%Y-%m-%d'),
-                        'date_fin': p.date_fin.strftime('%Y-%m-%d'),
-                        'titre': p.titre
-                    })
+        # Créer un dictionnaire pour stocker les transporteurs et leurs prestations
+        transporteurs_prestations = {
+            t.id: [{
+                'id': r.prestation_id,
+                'date_debut': r.debut.strftime('%Y-%m-%d'),
+                'date_fin': r.fin.strftime('%Y-%m-%d'),
+                'titre': r.type_demenagement
+            } for r in reservations.get(t.id, [])]
+            for t in transporteurs
+        }
         
         # Déterminer les transporteurs disponibles et bientôt disponibles
         transporteurs_disponibles = []
@@ -639,35 +577,17 @@ def check_disponibilite():
                 'prestations': transporteurs_prestations[t.id]
             }
             
-            # Récupérer le type de véhicule du transporteur
-            transporteur_db = Transporteur.query.filter_by(user_id=t.id).first()
-            if transporteur_db and transporteur_db.vehicule:
-                transporteur_info['type_vehicule'] = transporteur_db.vehicule.type_vehicule.nom if transporteur_db.vehicule.type_vehicule else None
-            else:
-                transporteur_info['type_vehicule'] = None
+            # Type de véhicule du transporteur (chargé avec la liste)
+            transporteur_info['type_vehicule'] = t.type_vehicule.nom if t.type_vehicule else None
             
             # Vérifier si le transporteur est disponible pour cette période
             if not transporteurs_prestations[t.id]:
                 transporteurs_disponibles.append(transporteur_info)
             else:
                 # Vérifier si le transporteur sera bientôt disponible (dans les 7 jours suivant la fin de la période)
-                sera_disponible = True
-                date_disponible = None
-                
-                for p in transporteurs_prestations[t.id]:
-                    p_date_fin = datetime.strptime(p['date_fin'], '%Y-%m-%d')
-                    
-                    # Si la prestation se termine après la période demandée et dans les 7 jours
-                    if p_date_fin > date_fin_obj and (p_date_fin - date_fin_obj).days <= 7:
-                        if date_disponible is None or p_date_fin > date_disponible:
-                            date_disponible = p_date_fin
-                    
-                    # Si la prestation chevauche complètement la période demandée
-                    elif datetime.strptime(p['date_debut'], '%Y-%m-%d') <= date_debut_obj and p_date_fin >= date_fin_obj:
-                        sera_disponible = False
-                        break
+                date_disponible = prochaines_dispos[t.id]
                 
-                if sera_disponible and date_disponible:
+                if date_disponible - date_fin_obj <= timedelta(days=7):
                     transporteur_info['disponible_le'] = date_disponible.strftime('%d/%m/%Y')
                     transporteurs_bientot_disponibles.append(transporteur_info)
         
@@ -727,11 +647,9 @@ def notify_transporteur():
             prestation.date_modification = datetime.now()
             prestation.modificateur_id = current_user.id
             
-            # Ajouter une note
-            if prestation.observations:
-                prestation.observations += f"\n\n[{datetime.now().strftime('%d/%m/%Y %H:%M')}] Transporteur {transporteur.prenom} {transporteur.nom} assigné par {current_user.prenom} {current_user.nom}"
-            else:
-                prestation.observations = f"[{datetime.now().strftime('%d/%m/%Y %H:%M')}] Transporteur {transporteur.prenom} {transporteur.nom} assigné par {current_user.prenom} {current_user.nom}"
+            # Tracer l'assignation dans le journal des événements
+            journaliser(prestation.id, 'assignation', current_user.id, transporteur_id=transporteur.id,
+                        transporteur=f"{transporteur.prenom} {transporteur.nom}")
             
             # Sauvegarder les modifications
             db.session.commit()
@@ -757,13 +675,42 @@ def notify_transporteur():
         }), 500
 
 @api_bp.route('/clients', methods=['GET'])
+@login_required
 def get_clients():
     """
-    Récupère la liste des clients pour le dropdown de sélection
+    Récupère la liste des clients pour le dropdown de sélection.
+    
+    Paramètres optionnels pour les champs à recherche asynchrone :
+    q (texte saisi, renvoie au plus `limite` clients, 20 par défaut, 50 au
+    plus) et id (libellé d'un client déjà sélectionné).
     """
     try:
-        # Récupérer tous les clients
-        clients = Client.query.order_by(Client.nom, Client.prenom).all()
+        q = request.args.get('q', '').strip()
+        client_id = request.args.get('id', type=int)
+        # L'adresse (colonne différée) fait partie de la réponse
+        requete = Client.query.options(*textes_longs(Client, 'adresse'))
+        
+        if client_id is not None:
+            clients = requete.filter_by(id=client_id).all()
+        elif 'q' in request.args:
+            limite = min(max(request.args.get('limite', 20, type=int), 1), 50)
+            if not q:
+                clients = []
+            else:
+                candidats = rechercher(q, ['client'], limite)
+                if candidats is not None:
+                    # Index plein texte : on garde l'ordre de pertinence
+                    ids = [objet_id for _, objet_id, _ in candidats]
+                    par_id = {c.id: c for c in requete.filter(Client.id.in_(ids))} if ids else {}
+                    clients = [par_id[i] for i in ids if i in par_id]
+                else:
+                    search = f"%{q}%"
+                    clients = requete.filter(
+                        or_(Client.nom.ilike(search), Client.prenom.ilike(search), Client.email.ilike(search))
+                    ).order_by(Client.nom, Client.prenom).limit(limite).all()
+        else:
+            # Récupérer tous les clients
+            clients = requete.order_by(Client.nom, Client.prenom).all()
         
         # Formater les données des clients
         clients_data = []
@@ -786,3 +733,532 @@ def get_clients():
             'success': False,
             'message': f"Erreur lors de la récupération des clients: {str(e)}"
         }), 500
+
+@api_bp.route('/autocompletion/<type_objet>', methods=['GET'])
+@login_required
+def autocompletion(type_objet):
+    """
+    Autocomplétion des champs de sélection : client, transporteur ou prestation.
+    
+    Paramètres : q (début des mots recherchés), limite (20 par défaut, 50 au
+    plus) et offset pour la suite des résultats ; ids (ex : 3,7) pour résoudre
+    les libellés de valeurs déjà sélectionnées ; client_id pour limiter les
+    prestations à un client.
+    """
+    parametres = {'client_id': request.args.get('client_id', type=int)}
+    try:
+        if 'ids' in request.args:
+            ids = [int(i) for i in request.args['ids'].split(',') if i.strip().isdigit()]
+            trouves = autocompletion_libelles(type_objet, ids, current_user, parametres)
+            return jsonify({
+                'success': True,
+                'resultats': [{'id': i, 'libelle': trouves[i]} for i in ids if i in trouves],
+                'suite': False
+            })
+        
+        resultats, suite = autocompletion_rechercher(
+            type_objet,
+            request.args.get('q', '').strip(),
+            current_user,
+            limite=request.args.get('limite', 20, type=int),
+            offset=request.args.get('offset', 0, type=int),
+            parametres=parametres
+        )
+        return jsonify({'success': True, 'resultats': resultats, 'suite': suite})
+    except ErreurAutocompletion as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    except Exception as e:
+        current_app.logger.error(f"Erreur lors de l'autocomplétion ({type_objet}): {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f"Erreur lors de l'autocomplétion: {str(e)}"
+        }), 500
+
+@api_bp.route('/rapports/capacite', methods=['GET'])
+@login_required
+def rapport_capacite_vehicules():
+    """
+    Rapport de capacité par jour et par type de véhicule : prestations à servir
+    face aux transporteurs disponibles. Paramètres : date_debut, date_fin
+    (YYYY-MM-DD) et format=csv pour un export en streaming.
+    """
+    if not (current_user.is_admin() or current_user.role == 'commercial'):
+        return jsonify({'success': False, 'message': 'Accès non autorisé'}), 403
+    
+    date_debut_str = request.args.get('date_debut')
+    date_fin_str = request.args.get('date_fin')
+    if not date_debut_str or not date_fin_str:
+        return jsonify({
+            'success': False,
+            'message': 'Paramètres manquants. Veuillez spécifier date_debut et date_fin.'
+        }), 400
+    
+    try:
+        date_debut = datetime.strptime(date_debut_str, '%Y-%m-%d')
+        date_fin = datetime.strptime(date_fin_str, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Format de date invalide. Utilisez le format YYYY-MM-DD.'
+        }), 400
+    
+    nb_jours = (date_fin - date_debut).days + 1
+    max_jours = current_app.config.get('RAPPORT_CAPACITE_MAX_JOURS', 366)
+    if nb_jours < 1 or nb_jours > max_jours:
+        return jsonify({
+            'success': False,
+            'message': f'La période doit couvrir entre 1 et {max_jours} jours.'
+        }), 400
+    
+    try:
+        lignes = rapport_capacite(date_debut, date_fin)
+        
+        if request.args.get('format') == 'csv':
+            nom_fichier = f"capacite_{date_debut:%Y%m%d}_{date_fin:%Y%m%d}.csv"
+            return Response(
+                stream_with_context(generer_csv(lignes)),
+                mimetype='text/csv',
+                headers={'Content-Disposition': f'attachment; filename={nom_fichier}'}
+            )
+        
+        return jsonify({
+            'success': True,
+            'date_debut': date_debut.strftime('%Y-%m-%d'),
+            'date_fin': date_fin.strftime('%Y-%m-%d'),
+            'lignes': [ligne._asdict() for ligne in lignes],
+            'penuries': [ligne._asdict() for ligne in lignes if ligne.ecart < 0]
+        })
+    except Exception as e:
+        current_app.logger.error(f"Erreur lors du calcul du rapport de capacité: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f"Erreur lors du calcul du rapport de capacité: {str(e)}"
+        }), 500
+
+@api_bp.route('/rapports/statistiques', methods=['GET'])
+@login_required
+def rapport_statistiques_journalieres():
+    """
+    Indicateurs par jour (clients, prestations par statut, factures, loyers de
+    stockage) lus dans les agrégats journaliers. Paramètres : date_debut,
+    date_fin (YYYY-MM-DD).
+    """
+    if not (current_user.is_admin() or current_user.role == 'commercial'):
+        return jsonify({'success': False, 'message': 'Accès non autorisé'}), 403
+    
+    date_debut_str = request.args.get('date_debut')
+    date_fin_str = request.args.get('date_fin')
+    if not date_debut_str or not date_fin_str:
+        return jsonify({
+            'success': False,
+            'message': 'Paramètres manquants. Veuillez spécifier date_debut et date_fin.'
+        }), 400
+    
+    try:
+        date_debut = datetime.strptime(date_debut_str, '%Y-%m-%d')
+        date_fin = datetime.strptime(date_fin_str, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Format de date invalide. Utilisez le format YYYY-MM-DD.'
+        }), 400
+    
+    nb_jours = (date_fin - date_debut).days + 1
+    max_jours = current_app.config.get('RAPPORT_STATISTIQUES_MAX_JOURS', 1096)
+    if nb_jours < 1 or nb_jours > max_jours:
+        return jsonify({
+            'success': False,
+            'message': f'La période doit couvrir entre 1 et {max_jours} jours.'
+        }), 400
+    
+    try:
+        return jsonify({
+            'success': True,
+            'date_debut': date_debut.strftime('%Y-%m-%d'),
+            'date_fin': date_fin.strftime('%Y-%m-%d'),
+            'jours': statistiques_periode(date_debut, date_fin)
+        })
+    except Exception as e:
+        current_app.logger.error(f"Erreur lors de la lecture des statistiques: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f"Erreur lors de la lecture des statistiques: {str(e)}"
+        }), 500
+
+@api_bp.route('/analyse/<nom_cube>', methods=['GET'])
+@login_required
+def analyse_cube(nom_cube):
+    """
+    Ventilation ad hoc des factures ou des prestations (cube en mémoire).
+    Paramètres : dimensions (ex : mois,type_demenagement,commercial), mesure
+    (ex : montant_ttc), depuis/jusqu_a (YYYY-MM), un filtre par dimension
+    (ex : statut=Payée, répétable) et format=csv pour un export.
+    Un commercial ne voit que ses factures et ses prestations : le filtre
+    commercial est imposé, celui de la requête ignoré.
+    """
+    if not (current_user.is_admin() or current_user.role == 'commercial'):
+        return jsonify({'success': False, 'message': 'Accès non autorisé'}), 403
+    
+    definition = CUBES.get(nom_cube)
+    if definition is None:
+        return jsonify({
+            'success': False,
+            'message': f"Cube inconnu. Cubes disponibles : {', '.join(CUBES)}"
+        }), 404
+    
+    dimensions = [d for d in request.args.get('dimensions', 'mois').split(',') if d]
+    filtres = {
+        dimension: request.args.getlist(dimension)
+        for dimension in definition.dimensions if dimension in request.args
+    }
+    # Un commercial n'analyse que sa propre activité (comme pour les relevés de commissions)
+    if not current_user.is_admin():
+        filtres['commercial'] = [current_user.id]
+    
+    try:
+        lignes = analyser(
+            nom_cube, dimensions,
+            mesure=request.args.get('mesure') or None,
+            filtres=filtres,
+            depuis=request.args.get('depuis'),
+            jusqu_a=request.args.get('jusqu_a')
+        )
+    except ErreurAnalyse as e:
+        return jsonify({
+            'success': False,
+            'message': str(e),
+            'dimensions': list(definition.dimensions) + ['mois', 'annee'],
+            'mesures': list(definition.mesures)
+        }), 400
+    except Exception as e:
+        current_app.logger.error(f"Erreur lors de l'analyse {nom_cube}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f"Erreur lors de l'analyse: {str(e)}"
+        }), 500
+    
+    if request.args.get('format') == 'csv':
+        colonnes = dimensions + ['nombre', 'total']
+        return Response(
+            stream_with_context(generer_csv(
+                (tuple(ligne[colonne] for colonne in colonnes) for ligne in lignes), colonnes=colonnes
+            )),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename=analyse_{nom_cube}.csv'}
+        )
+    
+    return jsonify({
+        'success': True,
+        'cube': nom_cube,
+        'dimensions': dimensions,
+        'lignes': lignes
+    })
+
+@api_bp.route('/rapports/commissions', methods=['GET'])
+@login_required
+def rapport_commissions():
+    """
+    Relevés mensuels des commerciaux (factures, commissions, prestations
+    converties). Paramètres : depuis, jusqu_a (YYYY-MM), commercial_id et
+    format=csv pour un export en streaming. Un commercial ne voit que ses
+    propres relevés.
+    """
+    if not (current_user.is_admin() or current_user.role == 'commercial'):
+        return jsonify({'success': False, 'message': 'Accès non autorisé'}), 403
+    
+    if not request.args.get('depuis') or not request.args.get('jusqu_a'):
+        return jsonify({
+            'success': False,
+            'message': 'Paramètres manquants. Veuillez spécifier depuis et jusqu_a (YYYY-MM).'
+        }), 400
+    
+    try:
+        premier_mois = parser_mois(request.args['depuis'])
+        dernier_mois = parser_mois(request.args['jusqu_a'])
+    except ErreurAnalyse as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    max_mois = current_app.config.get('RAPPORT_COMMISSIONS_MAX_MOIS', 24)
+    if dernier_mois < premier_mois or dernier_mois - premier_mois + 1 > max_mois:
+        return jsonify({
+            'success': False,
+            'message': f'La période doit couvrir entre 1 et {max_mois} mois.'
+        }), 400
+    
+    commercial_id = request.args.get('commercial_id', type=int)
+    if not current_user.is_admin():
+        commercial_id = current_user.id
+    
+    try:
+        lignes = releves(premier_mois, dernier_mois, commercial_id)
+        
+        if request.args.get('format') == 'csv':
+            nom_fichier = f"commissions_{request.args['depuis']}_{request.args['jusqu_a']}.csv"
+            return Response(
+                stream_with_context(generer_csv(lignes, colonnes=COLONNES_RELEVE)),
+                mimetype='text/csv',
+                headers={'Content-Disposition': f'attachment; filename={nom_fichier}'}
+            )
+        
+        return jsonify({
+            'success': True,
+            'depuis': request.args['depuis'],
+            'jusqu_a': request.args['jusqu_a'],
+            'releves': [ligne._asdict() for ligne in lignes]
+        })
+    except Exception as e:
+        current_app.logger.error(f"Erreur lors du calcul des relevés de commissions: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f"Erreur lors du calcul des relevés de commissions: {str(e)}"
+        }), 500
+
+@api_bp.route('/search', methods=['GET'])
+@login_required
+def recherche_globale():
+    """
+    Recherche plein texte classée dans les clients, prestations, documents et
+    factures visibles par l'utilisateur. Paramètres : q, types (ex :
+    client,prestation) et limite (20 par défaut, 50 au plus).
+    """
+    q = request.args.get('q', '').strip()
+    limite = min(max(request.args.get('limite', 20, type=int), 1), 50)
+    
+    # Types visibles selon le rôle (mêmes règles que les listes correspondantes)
+    if current_user.is_admin():
+        types_autorises = ['client', 'prestation', 'document', 'facture']
+    elif current_user.role == 'transporteur':
+        types_autorises = ['prestation']
+    else:
+        types_autorises = ['client', 'prestation', 'facture']
+    types_demandes = [t for t in request.args.get('types', '').split(',') if t]
+    types = [t for t in types_demandes if t in types_autorises] if types_demandes else types_autorises
+    
+    if not q or not types:
+        return jsonify({'success': True, 'q': q, 'resultats': []})
+    
+    try:
+        # Marge pour les résultats écartés par les règles de visibilité
+        candidats = rechercher(q, types, limite * 3)
+        if candidats is None:
+            return jsonify({
+                'success': False,
+                'message': "L'index de recherche n'est pas initialisé (migration_recherche.py)."
+            }), 503
+        
+        ids_par_type = {}
+        for type_objet, objet_id, _ in candidats:
+            ids_par_type.setdefault(type_objet, []).append(objet_id)
+        
+        objets = {}
+        if ids_par_type.get('client'):
+            for c in Client.query.filter(Client.id.in_(ids_par_type['client'])):
+                objets[('client', c.id)] = {
+                    'titre': f"{c.nom} {c.prenom}",
+                    'details': ' - '.join(v for v in (c.ville, c.telephone, c.email) if v),
+                    'url': url_for('client.details', id=c.id)
+                }
+        if ids_par_type.get('prestation'):
+            requete = Prestation.query.options(db.joinedload(Prestation.client_principal)).filter(
+                Prestation.id.in_(ids_par_type['prestation'])
+            )
+            if current_user.role == 'transporteur':
+                requete = requete.filter(Prestation.transporteurs.any(id=current_user.id))
+            elif current_user.role == 'commercial' and not current_user.is_admin() and current_user.id != 1:
+                requete = requete.filter(Prestation.commercial_id == current_user.id)
+            for p in requete:
+                client = p.client_principal
+                objets[('prestation', p.id)] = {
+                    'titre': f"{p.type_demenagement} - {client.nom} {client.prenom}" if client else p.type_demenagement,
+                    'details': f"{p.date_debut.strftime('%d/%m/%Y')} : {p.adresse_depart} → {p.adresse_arrivee}",
+                    'url': url_for('prestation.view', id=p.id)
+                }
+        if ids_par_type.get('document'):
+            for d in Document.query.filter(Document.id.in_(ids_par_type['document'])):
+                objets[('document', d.id)] = {
+                    'titre': d.nom,
+                    'details': d.type or '',
+                    'url': url_for('documents.view', id=d.id)
+                }
+        if ids_par_type.get('facture'):
+            for f in Facture.query.options(db.joinedload(Facture.client)).filter(
+                Facture.id.in_(ids_par_type['facture'])
+            ):
+                objets[('facture', f.id)] = {
+                    'titre': f"Facture {f.numero}",
+                    'details': f"{f.client.nom} {f.client.prenom} - {f.montant_ttc:.2f} € - {f.statut}" if f.client else f.statut,
+                    'url': url_for('facture.view', id=f.id)
+                }
+        
+        resultats = []
+        for type_objet, objet_id, score in candidats:
+            objet = objets.get((type_objet, objet_id))
+            if objet is None:
+                continue
+            resultats.append({'type': type_objet, 'id': objet_id, 'score': round(score, 4), **objet})
+            if len(resultats) >= limite:
+                break
+        
+        return jsonify({'success': True, 'q': q, 'resultats': resultats})
+    except Exception as e:
+        current_app.logger.error(f"Erreur lors de la recherche: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f"Erreur lors de la recherche: {str(e)}"
+        }), 500
+
+def _versions_autorisees():
+    return current_user.is_admin() or current_user.role == 'commercial'
+
+@api_bp.route('/prestations/<int:prestation_id>/versions', methods=['GET'])
+@login_required
+def versions_prestation(prestation_id):
+    """
+    Liste des versions d'une prestation (sans les données) : numéro, date,
+    auteur, type (instantané ou delta) et champs modifiés.
+    """
+    if not _versions_autorisees():
+        return jsonify({'success': False, 'message': 'Accès non autorisé'}), 403
+    
+    versions = PrestationVersion.query.options(db.joinedload(PrestationVersion.modificateur)).filter_by(
+        prestation_id=prestation_id
+    ).order_by(PrestationVersion.version.desc()).all()
+    return jsonify({
+        'success': True,
+        'prestation_id': prestation_id,
+        'versions': [{
+            'version': v.version,
+            'date_modification': v.date_modification.isoformat(),
+            'modifie_par': f"{v.modificateur.prenom} {v.modificateur.nom}" if v.modificateur else None,
+            'instantane': v.instantane,
+            'champs': v.champs.split(',') if v.champs else []
+        } for v in versions]
+    })
+
+@api_bp.route('/prestations/<int:prestation_id>/versions/<int:numero>', methods=['GET'])
+@login_required
+def version_prestation(prestation_id, numero):
+    """Données complètes d'une version, reconstruites depuis l'instantané précédent."""
+    if not _versions_autorisees():
+        return jsonify({'success': False, 'message': 'Accès non autorisé'}), 403
+    
+    donnees = reconstruire_version(prestation_id, numero)
+    if donnees is None:
+        return jsonify({'success': False, 'message': 'Version introuvable'}), 404
+    return jsonify({'success': True, 'prestation_id': prestation_id, 'version': numero, 'donnees': donnees})
+
+@api_bp.route('/prestations/<int:prestation_id>/versions/diff', methods=['GET'])
+@login_required
+def diff_versions_prestation(prestation_id):
+    """
+    Différences entre deux versions : paramètres de et a (par défaut, la
+    dernière version et la précédente). Un texte prolongé est renvoyé sous
+    la forme {'ajout': suite}, les autres champs sous la forme {'avant', 'apres'}.
+    """
+    if not _versions_autorisees():
+        return jsonify({'success': False, 'message': 'Accès non autorisé'}), 403
+    
+    a = request.args.get('a', type=int)
+    if a is None:
+        a = db.session.query(db.func.max(PrestationVersion.version)).filter(
+            PrestationVersion.prestation_id == prestation_id
+        ).scalar()
+    de = request.args.get('de', type=int)
+    if de is None and a is not None:
+        de = a - 1
+    
+    differences = comparer_versions(prestation_id, de, a) if a is not None and de is not None else None
+    if differences is None:
+        return jsonify({'success': False, 'message': 'Version introuvable'}), 404
+    return jsonify({'success': True, 'prestation_id': prestation_id, 'de': de, 'a': a, 'differences': differences})
+
+def _page_evenements_json(query):
+    """Page de la chronologie (paramètres apres, avant, per_page) au format JSON."""
+    page = page_evenements(query, apres=request.args.get('apres'), avant=request.args.get('avant'),
+                           par_page=request.args.get('per_page', 50, type=int))
+    return {
+        'evenements': [evenement_en_dict(e) for e in page.items],
+        'curseur_suivant': page.curseur_suivant,
+        'curseur_precedent': page.curseur_precedent
+    }
+
+@api_bp.route('/prestations/<int:prestation_id>/evenements', methods=['GET'])
+@login_required
+def evenements_prestation(prestation_id):
+    """
+    Chronologie d'une prestation (réponses des transporteurs, assignations),
+    les plus récents d'abord, paginée par curseur (apres, avant, per_page).
+    """
+    prestation = Prestation.query.get_or_404(prestation_id)
+    if not _versions_autorisees() and current_user not in prestation.transporteurs:
+        return jsonify({'success': False, 'message': 'Accès non autorisé'}), 403
+    
+    try:
+        page = _page_evenements_json(requete_evenements(prestation_id=prestation_id))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Curseur invalide'}), 400
+    return jsonify({'success': True, 'prestation_id': prestation_id, **page})
+
+@api_bp.route('/evenements', methods=['GET'])
+@login_required
+def evenements():
+    """
+    Événements de toutes les prestations : filtres type (répétable, ex :
+    type=refus), depuis et jusqu_a (dates ISO, jusqu_a exclue), pagination
+    par curseur comme la chronologie d'une prestation.
+    """
+    if not _versions_autorisees():
+        return jsonify({'success': False, 'message': 'Accès non autorisé'}), 403
+    
+    types = request.args.getlist('type')
+    if any(t not in TYPES for t in types):
+        return jsonify({'success': False, 'message': f"Type invalide (types : {', '.join(TYPES)})"}), 400
+    try:
+        depuis = datetime.fromisoformat(request.args['depuis']) if request.args.get('depuis') else None
+        jusqu_a = datetime.fromisoformat(request.args['jusqu_a']) if request.args.get('jusqu_a') else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Format de date invalide'}), 400
+    
+    try:
+        page = _page_evenements_json(requete_evenements(types=types, depuis=depuis, jusqu_a=jusqu_a))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Curseur invalide'}), 400
+    return jsonify({'success': True, **page})
+
+
+@api_bp.route('/prestations/masse/<operation>', methods=['POST'])
+@login_required
+def operation_masse_prestations(operation):
+    """
+    Opération en masse sur des prestations : archiver, statut ou reaffecter.
+    
+    Corps JSON : ids (liste) ou filtre (mêmes filtres que la liste des
+    prestations : query, archives), paramètres de l'opération (archive ;
+    statut ; de et vers) et dry_run pour obtenir le rapport sans rien modifier.
+    """
+    if operation not in OPERATIONS:
+        return jsonify({'success': False, 'message': 'Opération inconnue'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    filtre = data.get('filtre')
+    if filtre is not None and not isinstance(filtre, dict):
+        return jsonify({'success': False, 'message': 'Filtre invalide'}), 400
+    try:
+        rapport = operation_masse(
+            operation, current_user,
+            ids=data.get('ids'),
+            filtre=filtre,
+            parametres=data,
+            dry_run=bool(data.get('dry_run'))
+        )
+        return jsonify({'success': True, **rapport})
+    except ErreurOperation as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except PermissionError as e:
+        return jsonify({'success': False, 'message': str(e)}), 403
+    except Exception as e:
+        current_app.logger.error(f"Erreur lors de l'opération en masse {operation}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f"Une erreur est survenue: {str(e)}"
+        }), 500
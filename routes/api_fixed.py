@@ -4,6 +4,7 @@ from models import TypeDemenagement, TypeVehicule, User, Prestation, Transporteu
 from datetime import datetime, timedelta
 from sqlalchemy import or_, and_
 from extensions import db
+from utils_modules.evenements import journaliser
 
 api_bp = Blueprint('api', __name__)
 
@@ -523,13 +524,11 @@ def update_prestation_status(prestation_id):
         if status == 'refuse' and reason:
             prestation.raison_refus = reason
         
-        # Ajouter une note si une raison est fournie
-        if reason:
-            # Créer ou mettre à jour les notes de la prestation
-            if prestation.observations:
-                prestation.observations += f"\n\n[{datetime.now().strftime('%d/%m/%Y %H:%M')}] Réponse du transporteur {current_user.prenom} {current_user.nom}: {status.upper()}\n{reason}"
-            else:
-                prestation.observations = f"[{datetime.now().strftime('%d/%m/%Y %H:%M')}] Réponse du transporteur {current_user.prenom} {current_user.nom}: {status.upper()}\n{reason}"
+        # Enregistrer la réponse dans le journal des événements
+        if status == 'accepte':
+            journaliser(prestation.id, 'acceptation', current_user.id, commentaire=reason or None)
+        else:
+            journaliser(prestation.id, 'refus', current_user.id, raison=reason or None)
         
         # Mettre à jour la date de modification
         prestation.date_modification = datetime.now()
@@ -4,7 +4,12 @@ API pour récupérer la liste des transporteurs
 from flask import Blueprint, jsonify, request, current_app
 from models import User, Client, Prestation, TypeDemenagement, Transporteur, Vehicule, Facture, Stockage, Document
 from datetime import datetime, timedelta
+from sqlalchemy.orm import selectinload
 import json
+import re
+
+from utils_modules.disponibilite import get_index_disponibilite
+from utils_modules.creneaux import periode_demandee
 
 # Créer un blueprint pour les API de transporteurs
 api_transporteurs = Blueprint('api_transporteurs', __name__)
@@ -13,23 +18,30 @@ api_transporteurs = Blueprint('api_transporteurs', __name__)
 def liste_transporteurs():
     """Récupérer la liste de tous les transporteurs avec leurs véhicules"""
     try:
-        # Récupérer tous les transporteurs
-        transporteurs = Transporteur.query.all()
+        # Récupérer tous les transporteurs, leurs véhicules chargés en une seule requête supplémentaire
+        transporteurs = Transporteur.query.options(
+            selectinload(Transporteur.vehicules)
+        ).order_by(Transporteur.nom, Transporteur.id).all()
         
         # Préparer la liste des transporteurs avec leurs véhicules
         transporteurs_liste = []
         
         for transporteur in transporteurs:
-            # Récupérer le véhicule principal du transporteur
-            vehicule = Vehicule.query.filter_by(transporteur_id=transporteur.id, principal=True).first()
+            # Véhicule principal : celui référencé par le transporteur, sinon son premier véhicule actif
+            vehicule = next((v for v in transporteur.vehicules if v.id == transporteur.vehicule_id), None)
+            if vehicule is None:
+                vehicule = next((v for v in sorted(transporteur.vehicules, key=lambda v: v.id)
+                                 if v.statut == 'actif'), None)
             
             # Déterminer si le véhicule est adapté pour les déménagements
             vehicule_adapte = False
             vehicule_nom = "Pas de véhicule"
             
             if vehicule:
-                vehicule_adapte = vehicule.capacite >= 15  # Exemple: un véhicule est adapté s'il a une capacité d'au moins 15m³
-                vehicule_nom = f"{vehicule.marque} {vehicule.modele} ({vehicule.capacite}m³)"
+                capacite = _capacite_m3(vehicule.capacite)
+                vehicule_adapte = capacite is not None and capacite >= 15  # Exemple: un véhicule est adapté s'il a une capacité d'au moins 15m³
+                vehicule_nom = f"{vehicule.marque} {vehicule.modele} ({capacite:g}m³)" if capacite is not None \
+                    else f"{vehicule.marque} {vehicule.modele}"
             
             # Ajouter le transporteur à la liste
             transporteurs_liste.append({
@@ -42,10 +54,14 @@ def liste_transporteurs():
                 'vehicule_adapte': vehicule_adapte
             })
         
-        return jsonify({
+        # ETag calculé sur le contenu pour permettre une revalidation (304)
+        reponse = jsonify({
             'success': True,
             'transporteurs': transporteurs_liste
         })
+        reponse.add_etag()
+        reponse.headers['Cache-Control'] = 'private, no-cache'
+        return reponse.make_conditional(request)
     
     except Exception as e:
         current_app.logger.error(f"Erreur lors de la récupération des transporteurs: {str(e)}")
@@ -54,6 +70,13 @@ def liste_transporteurs():
             'message': f"Erreur lors de la récupération des transporteurs: {str(e)}"
         }), 500
 
+def _capacite_m3(capacite):
+    """Extrait la capacité en m³ d'une valeur texte (ex: '20', '20m3', '12,5 m³')"""
+    if capacite is None:
+        return None
+    match = re.match(r'\s*(\d+(?:[.,]\d+)?)', str(capacite))
+    return float(match.group(1).replace(',', '.')) if match else None
+
 @api_transporteurs.route('/api/transporteurs/check-disponibilite', methods=['POST'])
 def check_disponibilite():
     """Vérifier la disponibilité des transporteurs pour une période donnée"""
@@ -73,8 +96,10 @@ def check_disponibilite():
         
         # Convertir les dates en objets datetime
         try:
-            date_debut_obj = datetime.strptime(date_debut, '%Y-%m-%d')
-            date_fin_obj = datetime.strptime(date_fin, '%Y-%m-%d')
+            date_debut_obj, date_fin_obj = periode_demandee(
+                date_debut, date_fin,
+                request.form.get('demi_journee_debut'), request.form.get('demi_journee_fin')
+            )
         except ValueError:
             return jsonify({
                 'success': False,
@@ -84,21 +109,18 @@ def check_disponibilite():
         # Récupérer tous les transporteurs
         transporteurs = Transporteur.query.all()
         
-        # Récupérer toutes les prestations qui chevauchent la période demandée
-        prestations = Prestation.query.filter(
-            Prestation.date_debut <= date_fin_obj,
-            Prestation.date_fin >= date_debut_obj
-        ).all()
-        
-        # Exclure la prestation en cours d'édition si prestation_id est fourni
-        if prestation_id:
-            prestations = [p for p in prestations if str(p.id) != prestation_id]
+        # Réservations qui chevauchent la période demandée, regroupées par transporteur
+        # (en excluant la prestation en cours d'édition si prestation_id est fourni)
+        index = get_index_disponibilite()
+        reservations = index.reservations_par_transporteur(
+            date_debut_obj, date_fin_obj, exclure_prestation_id=prestation_id
+        )
         
-        # Récupérer les IDs des transporteurs déjà assignés à ces prestations
-        transporteurs_occupes = set()
-        for prestation in prestations:
-            if prestation.transporteurs:
-                transporteurs_occupes.update([t.id for t in prestation.transporteurs])
+        # Premier créneau libre de la même durée pour chaque transporteur occupé
+        prochaines_dispos = index.prochaines_disponibilites(
+            reservations.keys(), date_debut_obj, date_fin_obj - date_debut_obj,
+            exclure_prestation_id=prestation_id
+        )
         
         # Déterminer les transporteurs disponibles et bientôt disponibles
         transporteurs_disponibles = []
@@ -129,16 +151,11 @@ def check_disponibilite():
             }
             
             # Vérifier si le transporteur est disponible
-            if transporteur.id not in transporteurs_occupes:
+            if transporteur.id not in reservations:
                 transporteurs_disponibles.append(transporteur_obj)
             else:
                 # Vérifier quand le transporteur sera disponible
-                prochaine_dispo = None
-                for prestation in prestations:
-                    if transporteur in prestation.transporteurs:
-                        fin_prestation = prestation.date_fin
-                        if prochaine_dispo is None or fin_prestation > prochaine_dispo:
-                            prochaine_dispo = fin_prestation
+                prochaine_dispo = prochaines_dispos.get(transporteur.id)
                 
                 if prochaine_dispo:
                     # Ajouter la date de disponibilité
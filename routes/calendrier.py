@@ -1,9 +1,13 @@
-from flask import Blueprint, render_template, jsonify, request
+from flask import Blueprint, render_template, jsonify, request, current_app, url_for, Response
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
 
 from extensions import db
-from models import Prestation, Stockage
+from models import Prestation, Stockage, User
+from utils_modules.chargement import textes_longs
+from utils_modules.calendrier import evenements_depuis, evenements_periode, parser_date_calendrier
+from utils_modules.evenements import projeter_observations
+from utils_modules.ics import preparer_flux
 
 calendrier_bp = Blueprint('calendrier', __name__)
 
@@ -18,161 +22,45 @@ def fullscreen():
 @calendrier_bp.route('/api/prestations/calendrier')
 @login_required
 def api_prestations_calendrier():
-    import logging
-    logging.basicConfig(level=logging.INFO)
-    logging.info(f"=== API CALENDRIER === Récupération des événements pour le calendrier, utilisateur: {current_user.username}, rôle: {current_user.role}")
-    
-    # Initialiser la liste des événements
-    events = []
+    """
+    Flux d'événements du calendrier.
     
-    # 1. Récupérer les prestations
+    Paramètres optionnels :
+    - start / end : fenêtre affichée (envoyés automatiquement par FullCalendar) ;
+    - since : date de la dernière récupération ; la réponse ne contient alors que
+      les événements créés ou modifiés ('events'), les identifiants à retirer
+      ('deleted') et l'horodatage à renvoyer au prochain appel ('timestamp').
+    """
     try:
-        # Récupérer toutes les prestations non archivées
-        prestations_query = Prestation.query
-        logging.info(f"Requête de prestations créée")
-        
-        # Filtrer selon le rôle
-        if current_user.role == 'transporteur':
-            logging.info(f"Filtrage des prestations pour transporteur {current_user.id}")
-            prestations_query = prestations_query.filter(
-                Prestation.transporteurs.any(id=current_user.id)
-            )
-        
-        # Récupérer toutes les prestations
-        prestations = prestations_query.all()
-        logging.info(f"Nombre de prestations trouvées: {len(prestations)}")
-        
-        # Convertir les prestations en événements
-        for prestation in prestations:
-            try:
-                # Couleur en fonction du statut
-                color = {
-                    'En attente': '#ffc107',
-                    'Confirmée': '#17a2b8',
-                    'En cours': '#007bff',
-                    'Terminée': '#28a745',
-                    'Annulée': '#dc3545',
-                    'Refusée': '#6c757d'
-                }.get(prestation.statut, '#6c757d')
-                
-                client_title = 'Sans client'
-                if prestation.client:
-                    client_title = f'{prestation.client.nom} {prestation.client.prenom}'
-                
-                # Convertir les dates en string ISO pour FullCalendar
-                try:
-                    start_date = prestation.date_debut.isoformat()
-                    end_date = prestation.date_fin.isoformat()
-                except Exception as e:
-                    logging.error(f"Erreur lors de la conversion des dates de prestation: {str(e)}")
-                    start_date = "2025-04-03T00:00:00"  # Date par défaut en cas d'erreur
-                    end_date = "2025-04-03T23:59:59"
-                
-                event = {
-                    'id': prestation.id,
-                    'title': f'{prestation.type_demenagement} - {client_title}',
-                    'start': start_date,
-                    'end': end_date,
-                    'allDay': True,
-                    'backgroundColor': color,
-                    'borderColor': color,
-                    'textColor': '#fff' if prestation.statut not in ['En attente'] else '#000',
-                    'extendedProps': {
-                        'type': 'prestation',
-                        'statut': prestation.statut,
-                        'client': client_title,
-                        'adresse_depart': prestation.adresse_depart,
-                        'adresse_arrivee': prestation.adresse_arrivee,
-                        'type_demenagement': prestation.type_demenagement,
-                        'observations': prestation.observations or ''
-                    }
-                }
-                
-                events.append(event)
-                logging.info(f"Prestation {prestation.id} ajoutée au calendrier")
-            except Exception as e:
-                logging.error(f"Erreur lors de la conversion de la prestation {prestation.id}: {str(e)}")
-    except Exception as e:
-        logging.error(f"Erreur lors de la récupération des prestations: {str(e)}")
+        debut = parser_date_calendrier(request.args['start']) if request.args.get('start') else None
+        fin = parser_date_calendrier(request.args['end']) if request.args.get('end') else None
+        depuis = parser_date_calendrier(request.args['since']) if request.args.get('since') else None
+    except ValueError:
+        return jsonify({'error': 'Format de date invalide (ISO 8601 attendu)'}), 400
+    
+    # Horodatage pris avant les requêtes pour ne manquer aucune modification concurrente
+    horodatage = datetime.utcnow()
     
-    # 2. Récupérer les stockages
     try:
-        # Récupérer tous les stockages actifs
-        stockages_query = Stockage.query
-        logging.info(f"Requête de stockages créée")
-        
-        # Filtrer selon le rôle si nécessaire
-        if current_user.role == 'client':
-            logging.info(f"Filtrage des stockages pour client {current_user.id}")
-            stockages_query = stockages_query.filter(Stockage.client_id == current_user.id)
-        
-        # Récupérer tous les stockages
-        stockages = stockages_query.all()
-        logging.info(f"Nombre de stockages trouvés: {len(stockages)}")
-        
-        # Convertir les stockages en événements
-        for stockage in stockages:
-            try:
-                # Couleur pour les stockages - vert plus clair
-                color = '#4caf50'  # Vert
-                
-                client_title = 'Sans client'
-                if hasattr(stockage, 'client') and stockage.client:
-                    client_title = f'{stockage.client.nom} {stockage.client.prenom}'
-                
-                # Déterminer le titre du stockage
-                stockage_title = f'Stockage'
-                if hasattr(stockage, 'nom') and stockage.nom:
-                    stockage_title = f'Stockage - {stockage.nom}'
-                
-                # Convertir les dates en string ISO pour FullCalendar
-                try:
-                    start_date = stockage.date_debut.isoformat() if hasattr(stockage, 'date_debut') and stockage.date_debut else datetime.now().isoformat()
-                    end_date = stockage.date_fin.isoformat() if hasattr(stockage, 'date_fin') and stockage.date_fin else (datetime.now() + timedelta(days=30)).isoformat()
-                except Exception as e:
-                    logging.error(f"Erreur lors de la conversion des dates de stockage: {str(e)}")
-                    start_date = datetime.now().isoformat()
-                    end_date = (datetime.now() + timedelta(days=30)).isoformat()
-                
-                event = {
-                    'id': f'stock-{stockage.id}',  # Préfixe pour différencier des prestations
-                    'title': f'{stockage_title} - {client_title}',
-                    'start': start_date,
-                    'end': end_date,
-                    'allDay': True,
-                    'backgroundColor': color,
-                    'borderColor': color,
-                    'textColor': '#fff',
-                    'extendedProps': {
-                        'type': 'stockage',
-                        'client': client_title
-                    }
-                }
-                
-                # Ajouter d'autres propriétés si disponibles
-                if hasattr(stockage, 'adresse'):
-                    event['extendedProps']['adresse'] = stockage.adresse
-                if hasattr(stockage, 'observations'):
-                    event['extendedProps']['observations'] = stockage.observations or ''
-                if hasattr(stockage, 'statut'):
-                    event['extendedProps']['statut'] = stockage.statut
-                
-                events.append(event)
-                logging.info(f"Stockage {stockage.id} ajouté au calendrier")
-            except Exception as e:
-                logging.error(f"Erreur lors de la conversion du stockage {stockage.id}: {str(e)}")
+        if depuis is not None:
+            events, supprimes = evenements_depuis(current_user, depuis, debut, fin)
+            return jsonify({
+                'events': events,
+                'deleted': supprimes,
+                'timestamp': horodatage.isoformat()
+            })
+        
+        events = evenements_periode(current_user, debut, fin)
     except Exception as e:
-        logging.error(f"Erreur lors de la récupération des stockages: {str(e)}")
+        current_app.logger.error(f"Erreur lors de la récupération des événements du calendrier: {str(e)}")
+        return jsonify({'error': f'Erreur lors de la récupération des événements: {str(e)}'}), 500
     
-    # Cette section est maintenant gérée dans le bloc ci-dessus
-    logging.info(f"Nombre total d'événements générés: {len(events)}")
-    
-    logging.info(f"Nombre total d'événements générés: {len(events)}")
+    current_app.logger.debug(
+        f"Calendrier: {len(events)} événement(s) pour {current_user.username} ({debut} - {fin})"
+    )
     
-    # Si aucun événement n'a été trouvé, ajouter des événements de test
-    if len(events) == 0:
-        logging.warning("Aucun événement n'a été trouvé, ajout d'événements de test")
-        
+    # Sans fenêtre ni événement (ancien appel sans paramètres), ajouter des événements de test
+    if not events and debut is None and fin is None:
         # Date pour aujourd'hui et demain
         today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
         tomorrow = today + timedelta(days=1)
@@ -212,8 +100,6 @@ def api_prestations_calendrier():
             },
             'color': '#17a2b8'
         })
-        
-        logging.info(f"Événements de test ajoutés: {len(events)}")
     
     return jsonify(events)
 
@@ -254,7 +140,7 @@ def api_prestation_details(id):
             id = int(id)
         
         # Récupérer la prestation
-        prestation = Prestation.query.get_or_404(id)
+        prestation = Prestation.query.options(*textes_longs(Prestation)).get_or_404(id)
         logging.info(f"Prestation trouvée: {prestation.id}")
         
         # Vérifier les droits d'accès
@@ -280,7 +166,7 @@ def api_prestation_details(id):
             'adresse_arrivee': prestation.adresse_arrivee,
             'type_demenagement': prestation.type_demenagement,
             'statut': prestation.statut,
-            'observations': prestation.observations,
+            'observations': projeter_observations([prestation])[prestation.id],
             'transporteurs': transporteurs
         }
         
@@ -292,3 +178,49 @@ def api_prestation_details(id):
             'error': 'Erreur serveur',
             'message': f"Impossible de récupérer les détails de la prestation: {str(e)}"
         }), 500
+
+@calendrier_bp.route('/abonnement', methods=['GET', 'POST'])
+@login_required
+def abonnement_ics():
+    """
+    Lien d'abonnement au flux .ics du transporteur connecté (à ajouter dans
+    l'application calendrier du téléphone). POST régénère le lien, ce qui
+    révoque l'ancien.
+    """
+    if current_user.role != 'transporteur':
+        return jsonify({'success': False, 'message': 'Accès réservé aux transporteurs'}), 403
+    
+    if request.method == 'POST' or not current_user.token_calendrier:
+        current_user.generer_token_calendrier()
+        db.session.commit()
+    
+    return jsonify({
+        'success': True,
+        'url': url_for('calendrier.flux_ics', token=current_user.token_calendrier, _external=True)
+    })
+
+@calendrier_bp.route('/transporteur/<token>.ics')
+def flux_ics(token):
+    """
+    Flux iCalendar des prestations d'un transporteur, accessible sans session
+    grâce au token (les applications calendrier ne gèrent pas la connexion).
+    Répond 304 si le calendrier n'a pas changé depuis le dernier ETag reçu.
+    """
+    transporteur = User.query.filter_by(
+        token_calendrier=token, role='transporteur', statut='actif'
+    ).first()
+    if not transporteur:
+        # Réponse directe : le gestionnaire 404 de l'application redirige vers le tableau de bord
+        return Response('Calendrier introuvable', status=404, mimetype='text/plain')
+    
+    etag, generer = preparer_flux(
+        transporteur, current_app.config.get('ICS_HISTORIQUE_JOURS', 90)
+    )
+    if request.if_none_match.contains(etag):
+        reponse = Response(status=304)
+    else:
+        reponse = Response(generer(), mimetype='text/calendar')
+        reponse.headers['Content-Disposition'] = 'inline; filename=prestations.ics'
+    reponse.set_etag(etag)
+    reponse.headers['Cache-Control'] = 'private, no-cache'
+    return reponse
@@ -1,5 +1,5 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, send_file
-from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app
+from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app, jsonify
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 import os
@@ -10,15 +10,81 @@ from models import Client, Document
 from forms import ClientForm, SearchClientForm
 from utils import allowed_file, save_document
 from config import Config
+from utils_modules.chargement import textes_longs
+from utils_modules.clients import client_en_dict, compteurs_clients, filtrer_clients
+from utils_modules.pagination import compter_plafonne, paginer_keyset
 
 client_bp = Blueprint('client', __name__)
 
+def _page_annuaire(texte, archives, type_client=None, options=()):
+    """
+    Page de l'annuaire des clients selon les paramètres de la requête :
+    pagination par curseur sur (date_creation, id), les plus récents d'abord,
+    et compteurs des clients de la page. `options` s'applique à la requête
+    de la page (colonnes différées affichées par la liste).
+    
+    Raises:
+        ValueError: si le curseur est invalide
+    """
+    clients_query = filtrer_clients(Client.query, texte, archives, type_client)
+    
+    apres = request.args.get('apres')
+    avant = request.args.get('avant')
+    # Nombre de clients calculé (plafonné) sur la première page seulement
+    total = request.args.get('total', '')
+    if apres or avant:
+        total_exact = not total.endswith('+')
+        total = int(total.rstrip('+')) if total.rstrip('+').isdigit() else None
+    else:
+        total, total_exact = compter_plafonne(clients_query, Client.id)
+    
+    page = paginer_keyset(clients_query.options(*options), Client.date_creation, Client.id, apres=apres, avant=avant,
+                          par_page=request.args.get('per_page', 24, type=int))
+    compteurs = compteurs_clients([c.id for c in page.items])
+    return page, compteurs, total, total_exact
+
+def _reponse_json(page, compteurs, total, total_exact, **extra):
+    """Page de l'annuaire au format JSON (défilement infini)."""
+    return jsonify({
+        'success': True,
+        'clients': [client_en_dict(c, compteurs[c.id]) for c in page.items],
+        'curseur_suivant': page.curseur_suivant,
+        'curseur_precedent': page.curseur_precedent,
+        'total': None if total is None else f"{total}{'' if total_exact else '+'}",
+        **extra
+    })
+
 @client_bp.route('/clients/liste')
 @login_required
 def liste():
-    # Récupérer tous les clients
-    clients = Client.query.order_by(Client.date_creation.desc()).all()
-    return render_template('clients/liste.html', clients=clients)
+    # Filtres de la vue avancée : tous, particulier, professionnel, active, archived
+    query = request.args.get('query', '').strip()
+    filtre = request.args.get('filtre', 'all')
+    archives = {'active': False, 'archived': True}.get(filtre)
+    type_client = filtre if filtre in ('particulier', 'professionnel') else None
+    
+    try:
+        page, compteurs, total, total_exact = _page_annuaire(query, archives, type_client)
+    except ValueError:
+        if request.args.get('format') == 'json':
+            return jsonify({'success': False, 'message': 'Curseur de pagination invalide'}), 400
+        return redirect(url_for('client.liste'))
+    
+    if request.args.get('format') == 'json':
+        # Les cartes sont rendues côté serveur pour garder un seul gabarit
+        html = render_template('clients/cartes.html', clients=page.items, compteurs=compteurs)
+        return _reponse_json(page, compteurs, total, total_exact, html=html)
+    
+    return render_template(
+        'clients/liste.html',
+        clients=page.items,
+        compteurs=compteurs,
+        pagination=page,
+        total=total,
+        total_exact=total_exact,
+        query=query,
+        filtre=filtre
+    )
 
 @client_bp.route('/clients')
 @login_required
@@ -29,34 +95,36 @@ def index():
     query = request.args.get('query', '')
     show_archived = request.args.get('archives', type=bool, default=False)
     
-    clients_query = Client.query
-    
-    # Filter by archive status
-    if not show_archived:
-        clients_query = clients_query.filter_by(archive=False)
-    
-    # Apply search if provided
-    if query:
-        search = f"%{query}%"
-        clients_query = clients_query.filter(
-            (Client.nom.ilike(search)) |
-            (Client.prenom.ilike(search)) |
-            (Client.telephone.ilike(search)) |
-            (Client.email.ilike(search)) |
-            (Client.type_client.ilike(search)) |
-            (Client.tags.ilike(search)) |
-            (Client.code_postal.ilike(search)) |
-            (Client.ville.ilike(search)) |
-            (Client.pays.ilike(search))
+    try:
+        page, compteurs, total, total_exact = _page_annuaire(
+            query, None if show_archived else False, options=textes_longs(Client, 'adresse')
         )
+    except ValueError:
+        if request.args.get('format') == 'json':
+            return jsonify({'success': False, 'message': 'Curseur de pagination invalide'}), 400
+        flash('Lien de pagination invalide.', 'warning')
+        return redirect(url_for('client.index', query=query or None, archives=request.args.get('archives')))
+    
+    if request.args.get('format') == 'json':
+        return _reponse_json(page, compteurs, total, total_exact)
     
-    # Order by most recent first
-    clients = clients_query.order_by(Client.date_creation.desc()).all()
+    parametres = {
+        'query': query or None,
+        'archives': request.args.get('archives'),
+        'per_page': page.par_page if 'per_page' in request.args else None,
+        'total': None if total is None else f"{total}{'' if total_exact else '+'}"
+    }
     
     return render_template(
         'clients/index.html',
         title='Gestion des Clients',
-        clients=clients,
+        clients=page.items,
+        compteurs=compteurs,
+        pagination=page,
+        pagination_endpoint='client.index',
+        pagination_parametres={cle: valeur for cle, valeur in parametres.items() if valeur is not None},
+        total=total,
+        total_exact=total_exact,
         form=form,
         query=query,
         search_query=query,
@@ -122,7 +190,7 @@ def add():
 @client_bp.route('/clients/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
 def edit(id):
-    client = Client.query.get_or_404(id)
+    client = Client.query.options(*textes_longs(Client)).get_or_404(id)
     form = ClientForm(obj=client)
     
     if form.validate_on_submit():
@@ -209,7 +277,7 @@ def edit(id):
 @client_bp.route('/clients/details/<int:id>')
 @login_required
 def details(id):
-    client = Client.query.get_or_404(id)
+    client = Client.query.options(*textes_longs(Client)).get_or_404(id)
     
     return render_template(
         'clients/details.html',
@@ -234,7 +302,8 @@ def delete(id):
     client = Client.query.get_or_404(id)
     
     # Check if client has prestations or factures
-    if client.prestations or client.factures:
+    compteurs = compteurs_clients([client.id])[client.id]
+    if compteurs['prestations'] or compteurs['factures']:
         flash('Impossible de supprimer ce client car il est associé à des prestations ou factures.', 'danger')
         return redirect(url_for('client.index'))
     
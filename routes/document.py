@@ -8,6 +8,8 @@ import uuid
 from extensions import db
 from models import Document, Client, Prestation, Stockage
 from utils import requires_roles
+from utils_modules.chargement import textes_longs
+from utils_modules.recherche import ids_correspondants
 
 # Création des blueprints
 document_bp = Blueprint('document', __name__)
@@ -30,12 +32,17 @@ def index():
     
     # Appliquer les filtres
     if query:
-        search = f"%{query}%"
-        documents_query = documents_query.filter(
-            (Document.nom.ilike(search)) |
-            (Document.notes.ilike(search)) |
-            (Document.tags.ilike(search))
-        )
+        # Index plein texte si disponible, sinon recherche par sous-chaîne
+        ids = ids_correspondants('document', query)
+        if ids is not None:
+            documents_query = documents_query.filter(Document.id.in_(ids))
+        else:
+            search = f"%{query}%"
+            documents_query = documents_query.filter(
+                (Document.nom.ilike(search)) |
+                (Document.notes.ilike(search)) |
+                (Document.tags.ilike(search))
+            )
     
     if type_doc:
         documents_query = documents_query.filter(Document.type == type_doc)
@@ -68,9 +75,7 @@ def index():
 @requires_roles('admin', 'super_admin')
 def add():
     """Ajouter un nouveau document"""
-    # Préparer les choix pour les clients et prestations
-    clients = Client.query.filter_by(archive=False).order_by(Client.nom).all()
-    
+    # Le client est choisi par autocomplétion (/api/autocompletion/client)
     if request.method == 'POST':
         # Récupérer les données du formulaire
         nom = request.form.get('nom')
@@ -85,18 +90,18 @@ def add():
         # Validation de base
         if not nom:
             flash('Le nom du document est obligatoire.', 'danger')
-            return render_template('documents/add.html', clients=clients)
+            return render_template('documents/add.html')
         
         # Traitement du fichier
         if 'fichier' not in request.files:
             flash('Aucun fichier sélectionné.', 'danger')
-            return render_template('documents/add.html', clients=clients)
+            return render_template('documents/add.html')
         
         fichier = request.files['fichier']
         
         if fichier.filename == '':
             flash('Aucun fichier sélectionné.', 'danger')
-            return render_template('documents/add.html', clients=clients)
+            return render_template('documents/add.html')
         
         # Sécurisation du nom de fichier et création d'un nom unique
         filename = secure_filename(fichier.filename)
@@ -150,13 +155,13 @@ def add():
         return redirect(url_for('documents.index'))
     
     # Méthode GET - Afficher le formulaire
-    return render_template('documents/add.html', clients=clients)
+    return render_template('documents/add.html')
 
 @documents_bp.route('/view/<int:id>')
 @login_required
 def view(id):
     """Afficher un document"""
-    document = Document.query.get_or_404(id)
+    document = Document.query.options(*textes_longs(Document)).get_or_404(id)
     return render_template('documents/view.html', document=document)
 
 @documents_bp.route('/edit/<int:id>', methods=['GET', 'POST'])
@@ -164,8 +169,7 @@ def view(id):
 @requires_roles('admin', 'super_admin')
 def edit(id):
     """Modifier un document existant"""
-    document = Document.query.get_or_404(id)
-    clients = Client.query.filter_by(archive=False).order_by(Client.nom).all()
+    document = Document.query.options(*textes_longs(Document)).get_or_404(id)
     
     if request.method == 'POST':
         # Mettre à jour les données du document
@@ -219,7 +223,7 @@ def edit(id):
         return redirect(url_for('documents.view', id=document.id))
     
     # Méthode GET - Afficher le formulaire pré-rempli
-    return render_template('documents/edit.html', document=document, clients=clients)
+    return render_template('documents/edit.html', document=document)
 
 @documents_bp.route('/delete/<int:id>')
 @login_required
@@ -2,12 +2,15 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request,
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
 import os
+from sqlalchemy import case, func
 from werkzeug.utils import secure_filename
 
 from extensions import db
 from models import Facture, Client, Prestation, FichierFacture
 from forms import FactureForm, SearchFactureForm
 from utils import generate_invoice_number
+from utils_modules.chargement import textes_longs
+from utils_modules.pagination import paginer_keyset
 from config import Config
 
 facture_bp = Blueprint('facture', __name__)
@@ -21,10 +24,6 @@ def index():
     
     form = SearchFactureForm()
     
-    # Populate client dropdown for filter
-    all_clients = [(c.id, f"{c.nom} {c.prenom}") for c in Client.query.order_by(Client.nom).all()]
-    form.client_id.choices = [('', 'Tous les clients')] + all_clients
-    
     # Populate statut dropdown for filter
     statut_choices = [
         ('', 'Tous les statuts'),
@@ -38,6 +37,9 @@ def index():
     # Get filters
     client_id = request.args.get('client_id', type=int)
     statut = request.args.get('statut')
+    per_page = request.args.get('per_page', 20, type=int)
+    apres = request.args.get('apres')
+    avant = request.args.get('avant')
     date_debut_str = request.args.get('date_debut')
     date_fin_str = request.args.get('date_fin')
     
@@ -62,9 +64,14 @@ def index():
     # Build query
     factures_query = Facture.query
     
+    # Le client est choisi par recherche asynchrone (/api/clients) : seul son libellé est chargé ici
+    client_libelle = ''
     if client_id:
         factures_query = factures_query.filter_by(client_id=client_id)
         form.client_id.data = client_id
+        client = db.session.query(Client.nom, Client.prenom).filter_by(id=client_id).first()
+        if client:
+            client_libelle = f"{client.nom} {client.prenom}"
         
     if statut:
         factures_query = factures_query.filter_by(statut=statut)
@@ -78,25 +85,58 @@ def index():
         next_day = date_fin + timedelta(days=1)
         factures_query = factures_query.filter(Facture.date_emission < next_day)
     
-    # Order by most recent first
-    factures = factures_query.order_by(Facture.date_emission.desc()).all()
-    
-    # Calculate totals
-    total_ht = sum(f.montant_ht for f in factures)
-    total_ttc = sum(f.montant_ttc for f in factures)
+    # Totaux et nombre de factures par statut en une seule requête agrégée
+    def nombre(valeur):
+        return func.coalesce(func.sum(case((Facture.statut == valeur, 1), else_=0)), 0)
+    
+    agregats = factures_query.with_entities(
+        func.count(Facture.id),
+        func.coalesce(func.sum(Facture.montant_ht), 0),
+        func.coalesce(func.sum(Facture.montant_ttc), 0),
+        nombre('En attente'),
+        nombre('Payée'),
+        nombre('Retard'),
+        nombre('Annulée')
+    ).order_by(None).one()
+    total, total_ht, total_ttc = agregats[0], float(agregats[1]), float(agregats[2])
     
     # Count by status
     status_counts = {
-        'En attente': sum(1 for f in factures if f.statut == 'En attente'),
-        'Payée': sum(1 for f in factures if f.statut == 'Payée'),
-        'Retard': sum(1 for f in factures if f.statut == 'Retard'),
-        'Annulée': sum(1 for f in factures if f.statut == 'Annulée')
+        'En attente': int(agregats[3]),
+        'Payée': int(agregats[4]),
+        'Retard': int(agregats[5]),
+        'Annulée': int(agregats[6])
+    }
+    
+    # Lignes de la page, les plus récentes d'abord (pagination par curseur)
+    try:
+        page = paginer_keyset(
+            factures_query.options(db.joinedload(Facture.client), db.joinedload(Facture.prestation)),
+            Facture.date_emission, Facture.id,
+            apres=apres, avant=avant, par_page=per_page
+        )
+    except ValueError:
+        flash('Lien de pagination invalide.', 'warning')
+        return redirect(url_for('facture.index'))
+    
+    parametres = {
+        'client_id': client_id,
+        'statut': statut or None,
+        'date_debut': date_debut_str or None,
+        'date_fin': date_fin_str or None,
+        'per_page': page.par_page if 'per_page' in request.args else None
     }
     
     return render_template(
         'factures/index.html',
         title='Gestion des Factures',
-        factures=factures,
+        factures=page.items,
+        pagination=page,
+        pagination_endpoint='facture.index',
+        pagination_parametres={cle: valeur for cle, valeur in parametres.items() if valeur is not None},
+        total=total,
+        total_exact=True,
+        client_libelle=client_libelle,
         form=form,
         total_ht=total_ht,
         total_ttc=total_ttc,
@@ -115,12 +155,7 @@ def add():
     # Generate a new invoice number
     suggested_numero = generate_invoice_number()
     
-    # Populate client dropdown
-    form.client_id.choices = [(c.id, f"{c.nom} {c.prenom}") for c in 
-                             Client.query.filter_by(archive=False).order_by(Client.nom).all()]
-    
-    # Empty prestation dropdown initially
-    form.prestation_id.choices = [('', 'Sélectionner une prestation (facultatif)')]
+    # Client : champ à autocomplétion ; les prestations sont chargées à la sélection du client
     
     # Set default date values
     if not form.date_emission.data:
@@ -179,17 +214,15 @@ def edit(id):
     facture = Facture.query.get_or_404(id)
     form = FactureForm(obj=facture)
     
-    # Populate client dropdown
-    form.client_id.choices = [(c.id, f"{c.nom} {c.prenom}") for c in 
-                             Client.query.filter_by(archive=False).order_by(Client.nom).all()]
-    
-    # Populate prestation dropdown
-    client_prestations = Prestation.query.filter_by(
+    # Client : champ à autocomplétion ; seules les prestations du client sont proposées
+    client_prestations = db.session.query(
+        Prestation.id, Prestation.type_demenagement, Prestation.adresse_depart, Prestation.adresse_arrivee
+    ).filter_by(
         client_id=facture.client_id, 
         archive=False
     ).order_by(Prestation.date_debut.desc()).all()
     
-    form.prestation_id.choices = [('', 'Sélectionner une prestation (facultatif)')] + [
+    form.prestation_id.choices = [
         (p.id, f"{p.type_demenagement} - {p.adresse_depart} à {p.adresse_arrivee}") 
         for p in client_prestations
     ]
@@ -250,7 +283,7 @@ def view(id):
         return redirect(url_for('dashboard.index'))
     
     facture = Facture.query.get_or_404(id)
-    client = Client.query.get(facture.client_id)
+    client = Client.query.options(*textes_longs(Client, 'adresse')).get(facture.client_id)
     prestation = Prestation.query.get(facture.prestation_id) if facture.prestation_id else None
     
     # Récupérer les fichiers associés à cette facture
@@ -1,13 +1,21 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, session, current_app
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
 from sqlalchemy import and_, or_, not_
+from sqlalchemy.exc import SQLAlchemyError
 import json
 
 from extensions import db
-from models import Prestation, Client, User, TypeDemenagement, Vehicule
+from models import Prestation, PrestationVersion, Client, User, TypeDemenagement, Vehicule
 from forms import PrestationForm, SearchPrestationForm
-from utils import notifier_transporteurs, accepter_prestation, refuser_prestation
+from utils import notifier_transporteurs_lot, accepter_prestation, refuser_prestation
+from utils_modules.affectation import affecter_transporteurs
+from utils_modules.chargement import textes_longs
+from utils_modules.creneaux import appliquer_demi_journee, demi_journee_de, periode_valide
+from utils_modules.evenements import projeter_observations
+from utils_modules.pagination import compter_plafonne, paginer_keyset
+from utils_modules.prestations import condition_visibilite, conditions_filtre
+from utils_modules.versions import comparer, comparer_versions, reconstruire_version
 
 prestation_bp = Blueprint('prestation', __name__)
 
@@ -19,60 +27,64 @@ def index():
     # Handle search and filter
     query = request.args.get('query', '')
     show_archived = request.args.get('archives', type=bool, default=False)
-    page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
+    apres = request.args.get('apres')
+    avant = request.args.get('avant')
     
-    # Base query with eager loading
+    # Base query with eager loading : jointures pour les relations simples,
+    # selectinload pour les collections (pas de lignes dupliquées par la jointure)
     prestations_query = Prestation.query.options(
         db.joinedload(Prestation.client_principal),
-        db.joinedload(Prestation.transporteurs),
-        db.joinedload(Prestation.commercial)
+        db.joinedload(Prestation.commercial),
+        db.joinedload(Prestation.modificateur),
+        db.selectinload(Prestation.transporteurs),
+        db.selectinload(Prestation.factures)
     )
     
-    # Filter by archive status
-    if not show_archived:
-        prestations_query = prestations_query.filter_by(archive=False)
-    
-    # For transporteur role, only show assigned prestations
-    if current_user.role == 'transporteur':
-        prestations_query = prestations_query.filter(
-            Prestation.transporteurs.any(id=current_user.id)
-        )
-    # For commercial role (non-admin), only show their own prestations
-    elif current_user.role == 'commercial' and not current_user.is_admin() and current_user.id != 1:
-        prestations_query = prestations_query.filter(
-            Prestation.commercial_id == current_user.id
-        )
-    
-    # Apply search if provided
-    if query:
-        search = f"%{query}%"
-        # Find client IDs matching the search
-        matching_client_ids = [c.id for c in Client.query.filter(
-            (Client.nom.ilike(search)) | 
-            (Client.prenom.ilike(search))
-        ).all()]
-        
-        prestations_query = prestations_query.filter(
-            (Prestation.adresse_depart.ilike(search)) |
-            (Prestation.adresse_arrivee.ilike(search)) |
-            (Prestation.type_demenagement.ilike(search)) |
-            (Prestation.tags.ilike(search)) |
-            (Prestation.client_id.in_(matching_client_ids))
-        )
-    
-    # Order by date (most recent first)
-    prestations_query = prestations_query.order_by(Prestation.date_debut.desc())
+    # Visibilité selon le rôle (transporteur : prestations affectées ; commercial : les siennes),
+    # archives et recherche : filtres partagés avec les opérations en masse
+    visibilite = condition_visibilite(current_user)
+    if visibilite is not None:
+        prestations_query = prestations_query.filter(visibilite)
+    prestations_query = prestations_query.filter(*conditions_filtre(query, show_archived))
+    
+    # Nombre de résultats calculé (plafonné) sur la première page seulement,
+    # puis transmis par les liens de navigation
+    total = request.args.get('total', '')
+    if apres or avant:
+        total_exact = not total.endswith('+')
+        total = int(total.rstrip('+')) if total.rstrip('+').isdigit() else None
+    else:
+        total, total_exact = compter_plafonne(prestations_query, Prestation.id)
     
-    # Execute query with pagination
-    prestations = prestations_query.paginate(page=page, per_page=per_page, error_out=False)
+    # Pagination par curseur sur (date_debut, id), les plus récentes d'abord
+    try:
+        page = paginer_keyset(prestations_query, Prestation.date_debut, Prestation.id,
+                              apres=apres, avant=avant, par_page=per_page)
+    except ValueError:
+        flash('Lien de pagination invalide.', 'warning')
+        return redirect(url_for('prestation.index', query=query or None,
+                                archives=request.args.get('archives')))
+    
+    parametres = {
+        'query': query or None,
+        'archives': request.args.get('archives'),
+        'per_page': page.par_page if 'per_page' in request.args else None,
+        'total': None if total is None else f"{total}{'' if total_exact else '+'}"
+    }
     
     return render_template(
         'prestations/index.html',
         title='Prestations',
-        prestations=prestations,
+        prestations=page.items,
+        pagination=page,
+        pagination_endpoint='prestation.index',
+        pagination_parametres={cle: valeur for cle, valeur in parametres.items() if valeur is not None},
+        total=total,
+        total_exact=total_exact,
         form=form,
         query=query,
+        search_query=query,
         show_archived=show_archived
     )
 
@@ -126,8 +138,12 @@ def add():
         types_demenagement = [{'id': t.id, 'nom': t.nom} for t in all_types]
         
         if form.validate_on_submit():
-            # Validation des dates
-            if form.date_debut.data > form.date_fin.data:
+            # Dates à la demi-journée près (matin / après-midi)
+            date_debut = appliquer_demi_journee(form.date_debut.data, form.demi_journee_debut.data)
+            date_fin = appliquer_demi_journee(form.date_fin.data, form.demi_journee_fin.data, fin=True)
+            
+            # Validation des dates, à la demi-journée près
+            if not periode_valide(date_debut, date_fin):
                 flash('La date de fin doit être postérieure à la date de début.', 'danger')
                 return render_template(
                     'prestations/add.html',
@@ -168,8 +184,8 @@ def add():
             prestation = Prestation(
                 client_id=form.client_id.data,
                 commercial_id=current_user.id,
-                date_debut=form.date_debut.data,
-                date_fin=form.date_fin.data,
+                date_debut=date_debut,
+                date_fin=date_fin,
                 adresse_depart=form.adresse_depart.data,
                 adresse_arrivee=form.adresse_arrivee.data,
                 type_demenagement=type_dem_name,
@@ -182,36 +198,18 @@ def add():
                 type_demenagement_id=type_dem_id if type_dem_id and type_dem_id > 0 else None
             )
             
-            # Add transporteurs
-            transporteurs_to_notify = []
-            
-            # Vérifier d'abord si des transporteurs ont été sélectionnés via le widget et stockés dans la session
-            selected_transporteurs = session.get('selected_transporteurs', [])
-            
-            if selected_transporteurs:
-                # Utiliser les transporteurs sélectionnés via le widget
-                for t_id in selected_transporteurs:
-                    transporteur = User.query.get(t_id)
-                    if transporteur and transporteur.role == 'transporteur':
-                        prestation.transporteurs.append(transporteur)
-                        transporteurs_to_notify.append(transporteur)
-                        
-                # Supprimer les transporteurs sélectionnés de la session
-                session.pop('selected_transporteurs', None)
-            elif form.transporteurs.data:
-                # Utiliser les transporteurs sélectionnés via le formulaire standard
-                for t_id in form.transporteurs.data:
-                    transporteur = User.query.get(t_id)
-                    if transporteur and transporteur.role == 'transporteur':
-                        prestation.transporteurs.append(transporteur)
-                        transporteurs_to_notify.append(transporteur)
-            
+            # Transporteurs sélectionnés via le widget (session) ou le formulaire standard, chargés en une requête
+            selected_transporteurs = session.pop('selected_transporteurs', None)
+            transporteurs_to_notify = affecter_transporteurs(
+                prestation, selected_transporteurs or form.transporteurs.data or []
+            )
             db.session.add(prestation)
-            db.session.commit()
             
-            # Notifier les transporteurs assignés
+            # Prestation, affectations et notifications dans la même transaction
             if transporteurs_to_notify:
-                notifier_transporteurs(prestation, transporteurs_to_notify)
+                db.session.flush()
+                notifier_transporteurs_lot([(prestation, transporteurs_to_notify)], commit=False)
+            db.session.commit()
             
             flash('Prestation ajoutée avec succès!', 'success')
             return redirect(url_for('prestation.index'))
@@ -236,7 +234,7 @@ def add():
 @login_required
 def edit(id):
     # Récupérer la prestation existante
-    prestation = Prestation.query.get_or_404(id)
+    prestation = Prestation.query.options(*textes_longs(Prestation)).get_or_404(id)
     
     # Vérifier les permissions
     if current_user.role == 'transporteur' and current_user.id not in [t.id for t in prestation.transporteurs]:
@@ -253,25 +251,13 @@ def edit(id):
     # Passer les types de déménagement directement au template
     types_demenagement = [{'id': t.id, 'nom': t.nom} for t in all_types]
     
-    # Peupler les clients dans le formulaire
-    clients = []
-    if current_user.is_admin():
-        clients = Client.query.order_by(Client.nom).all()
-    elif current_user.role == 'client':
-        clients = Client.query.filter_by(user_id=current_user.id).order_by(Client.nom).all()
-    else:
-        # Pour les commerciaux et autres rôles, montrer tous les clients
-        clients = Client.query.order_by(Client.nom).all()
-        
-    form.client_id.choices = [(0, 'Sélectionnez un client')] + [(c.id, f"{c.nom} {c.prenom}") for c in clients]
-    
-    # Populate transporteur dropdown
-    form.transporteurs.choices = [(u.id, f"{u.nom} {u.prenom} ({u.vehicule or 'Aucun véhicule'})") for u in 
-                                User.query.filter_by(role='transporteur', statut='actif').order_by(User.nom).all()]
+    # Clients et transporteurs : champs à autocomplétion, seules les valeurs choisies sont chargées
     
     # Pré-sélectionner les transporteurs actuels
     if request.method == 'GET':
         form.transporteurs.data = [t.id for t in prestation.transporteurs]
+        form.demi_journee_debut.data = demi_journee_de(prestation.date_debut)
+        form.demi_journee_fin.data = demi_journee_de(prestation.date_fin, fin=True)
     
     if form.validate_on_submit():
         try:
@@ -285,55 +271,40 @@ def edit(id):
                 if type_dem:
                     type_dem_name = type_dem.nom
             
+            # Dates à la demi-journée près (matin / après-midi), validées avant toute modification
+            date_debut = appliquer_demi_journee(form.date_debut.data, form.demi_journee_debut.data)
+            date_fin = appliquer_demi_journee(form.date_fin.data, form.demi_journee_fin.data, fin=True)
+            if not periode_valide(date_debut, date_fin):
+                flash('La date de fin doit être postérieure à la date de début.', 'danger')
+                return render_template(
+                    'prestations/edit.html',
+                    title='Modifier une Prestation',
+                    form=form,
+                    prestation=prestation,
+                    types_demenagement=types_demenagement
+                )
+            
             # Mettre à jour les attributs de la prestation
             form.populate_obj(prestation)
+            prestation.date_debut = date_debut
+            prestation.date_fin = date_fin
             
             # Définir le type de déménagement manuellement
             prestation.type_demenagement = type_dem_name
             
-            # Récupérer les transporteurs actuels avant modification
-            transporteurs_actuels = [t.id for t in prestation.transporteurs]
-            
-            # Gérer les transporteurs
-            prestation.transporteurs = []
-            nouveaux_transporteurs = []
-            transporteurs_a_notifier = []
-            
-            # Vérifier d'abord si des transporteurs ont été sélectionnés via le widget et stockés dans la session
-            from flask import session
-            selected_transporteurs = session.get('selected_transporteurs', [])
-            
-            if selected_transporteurs:
-                # Utiliser les transporteurs sélectionnés via le widget
-                for t_id in selected_transporteurs:
-                    transporteur = User.query.get(t_id)
-                    if transporteur and transporteur.role == 'transporteur':
-                        prestation.transporteurs.append(transporteur)
-                        # Vérifier si c'est un nouveau transporteur
-                        if t_id not in transporteurs_actuels:
-                            nouveaux_transporteurs.append(t_id)
-                            transporteurs_a_notifier.append(transporteur)
-                
-                # Supprimer les transporteurs sélectionnés de la session
-                session.pop('selected_transporteurs', None)
-            else:
-                # Utiliser les transporteurs sélectionnés via le formulaire standard
-                for transporteur_id in form.transporteurs.data:
-                    transporteur = User.query.get(transporteur_id)
-                    if transporteur and transporteur.role == 'transporteur':
-                        prestation.transporteurs.append(transporteur)
-                        # Vérifier si c'est un nouveau transporteur
-                        if transporteur_id not in transporteurs_actuels:
-                            nouveaux_transporteurs.append(transporteur_id)
-                            transporteurs_a_notifier.append(transporteur)
+            # Transporteurs : seuls les ajouts et retraits sont écrits, la réponse
+            # (statut, date, commentaire) des transporteurs conservés est préservée
+            selected_transporteurs = session.pop('selected_transporteurs', None)
+            transporteurs_a_notifier = affecter_transporteurs(
+                prestation, selected_transporteurs or form.transporteurs.data or []
+            )
             
-            # Enregistrer les modifications
+            # Modifications et notifications des nouveaux transporteurs dans la même transaction
+            if transporteurs_a_notifier:
+                notifier_transporteurs_lot([(prestation, transporteurs_a_notifier)], commit=False)
             db.session.commit()
             
-            # Envoyer des notifications aux nouveaux transporteurs assignés
             if transporteurs_a_notifier:
-                from utils import notifier_transporteurs
-                notifier_transporteurs(prestation, transporteurs_a_notifier)
                 flash(f'{len(transporteurs_a_notifier)} transporteur(s) notifié(s) de leur assignation.', 'info')
             
             flash('Prestation mise à jour avec succès!', 'success')
@@ -355,7 +326,7 @@ def edit(id):
 @login_required
 def view(id):
     # Récupérer la prestation
-    prestation = Prestation.query.get_or_404(id)
+    prestation = Prestation.query.options(*textes_longs(Prestation)).get_or_404(id)
     
     # Récupérer le client principal
     client = Client.query.get(prestation.client_id) if prestation.client_id else None
@@ -384,7 +355,8 @@ def view(id):
         prestation=prestation,
         client=client,
         clients=clients,
-        transporteurs=transporteurs
+        transporteurs=transporteurs,
+        observations=projeter_observations([prestation])[prestation.id]
     )
 
 @prestation_bp.route('/toggle_archive/<int:id>')
@@ -417,17 +389,37 @@ def toggle_archive(id):
 @login_required
 def historique(id):
     # Récupérer la prestation
-    prestation = Prestation.query.get_or_404(id)
+    prestation = Prestation.query.options(
+        db.joinedload(Prestation.client_principal), db.joinedload(Prestation.commercial)
+    ).get_or_404(id)
     
     # Vérifier les permissions
     if not current_user.is_admin() and current_user.role != 'commercial':
         flash('Vous n\'avez pas l\'autorisation de voir l\'historique des prestations.', 'danger')
         return redirect(url_for('prestation.index'))
     
-    # Pour l'instant, nous n'avons pas de système d'historique des versions
-    # Nous allons donc simplement afficher un message
-    flash('La fonctionnalité d\'historique des versions sera disponible prochainement.', 'info')
-    return redirect(url_for('prestation.view', id=id))
+    # Liste des versions sans leurs données (colonne différée)
+    versions = PrestationVersion.query.options(db.joinedload(PrestationVersion.modificateur)).filter_by(
+        prestation_id=id
+    ).order_by(PrestationVersion.version.desc()).all()
+    
+    # Modifications de la version sélectionnée (par défaut la dernière) par rapport à la précédente
+    numero = request.args.get('version', type=int) or (versions[0].version if versions else None)
+    differences = None
+    if numero == 1:
+        premiere = reconstruire_version(id, 1)
+        differences = comparer({}, premiere) if premiere is not None else None
+    elif numero:
+        differences = comparer_versions(id, numero - 1, numero)
+    
+    return render_template(
+        'prestations/historique.html',
+        title='Historique des modifications',
+        prestation=prestation,
+        versions=versions,
+        version_selectionnee=numero,
+        differences=differences
+    )
 
 @prestation_bp.route('/repondre/<int:id>', methods=['GET', 'POST'])
 @login_required
@@ -438,7 +430,7 @@ def repondre(id):
         return redirect(url_for('prestation.index'))
     
     # Récupérer la prestation
-    prestation = Prestation.query.get_or_404(id)
+    prestation = Prestation.query.options(*textes_longs(Prestation)).get_or_404(id)
     
     # Vérifier que le transporteur est bien assigné à cette prestation
     transporteur_assigne = False
@@ -457,12 +449,10 @@ def repondre(id):
         commentaire = request.form.get('commentaire')
         
         if reponse == 'accepter':
-            from utils.notifications import accepter_prestation
             if accepter_prestation(id, current_user.id, commentaire):
                 flash('Vous avez accepté cette prestation avec succès.', 'success')
                 return redirect(url_for('prestation.index'))
         elif reponse == 'refuser':
-            from utils.notifications import refuser_prestation
             if refuser_prestation(id, current_user.id, commentaire):
                 flash('Vous avez refusé cette prestation avec succès.', 'success')
                 return redirect(url_for('prestation.index'))
@@ -476,7 +466,8 @@ def repondre(id):
         'prestations/repondre.html',
         title='Répondre à la Prestation',
         prestation=prestation,
-        client=client
+        client=client,
+        observations=projeter_observations([prestation])[prestation.id]
     )
 
 @prestation_bp.route('/mes-prestations')
@@ -20,12 +20,7 @@ def index():
     """Liste des stockages"""
     form = SearchStockageForm()
     
-    # Initialiser les choix du formulaire
-    clients = Client.query.filter_by(archive=False).order_by(Client.nom).all()
-    form.client_id.choices = [(c.id, f"{c.nom} {c.prenom}") for c in clients]
-    # Utiliser 0 au lieu d'une chaîne vide pour éviter l'erreur de conversion
-    form.client_id.choices.insert(0, (0, 'Tous les clients'))
-    
+    # Initialiser les choix du formulaire (le client est un champ à autocomplétion)
     form.statut.choices = [
         ('Actif', 'Actif'),
         ('En attente', 'En attente'),
@@ -46,6 +41,7 @@ def index():
     
     if client_id and client_id != '':
         query = query.filter(Stockage.client_id == client_id)
+        form.client_id.data = int(client_id) if client_id.isdigit() else None
     
     if statut and statut != '':
         query = query.filter(Stockage.statut == statut)
@@ -112,10 +108,6 @@ def add():
             except ValueError:
                 pass
     
-    # Récupérer les clients actifs pour le formulaire
-    clients = Client.query.filter_by(archive=False).order_by(Client.nom).all()
-    form.client_id.choices = [(c.id, f"{c.nom} {c.prenom}") for c in clients]
-    
     if form.validate_on_submit():
         stockage = Stockage()
         stockage.client_id = form.client_id.data
@@ -193,10 +185,6 @@ def edit(id):
     form = StockageForm(obj=stockage)
     form_article = ArticleStockageForm()
     
-    # Récupérer les clients pour le formulaire
-    clients = Client.query.filter_by(archive=False).order_by(Client.nom).all()
-    form.client_id.choices = [(c.id, f"{c.nom} {c.prenom}") for c in clients]
-    
     # Récupérer les articles stockés
     articles_stockes = StockageArticle.query.filter_by(stockage_id=stockage.id).all()
     
@@ -1,10 +1,18 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, current_app
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
 from sqlalchemy import and_, or_, not_
 
 from extensions import db
-from models import Prestation, User, TypeDemenagement, TypeVehicule
+from models import Prestation, User, TypeDemenagement, TypeVehicule, prestation_transporteurs
+from utils_modules.disponibilite import (
+    get_index_disponibilite, matrice_disponibilite,
+    CELLULE_LIBRE, CELLULE_RESERVEE, CELLULE_MULTIPLE
+)
+from utils_modules.affectation import appliquer_plan, proposer_plan
+from utils_modules.double_reservations import detecter_doubles_reservations
+from utils_modules.creneaux import get_calendrier_flotte, parser_date_creneau, periode_demandee
+from utils_modules.reponses import affectation_active
 
 # Créer un blueprint pour les API de transporteurs
 transporteur_api_bp = Blueprint('transporteur_api', __name__, url_prefix='/api/transporteurs')
@@ -22,6 +30,9 @@ def check_disponibilite():
     date_fin_str = data.get('date_fin') or request.form.get('date_fin')
     type_demenagement_id = data.get('type_demenagement_id') or request.form.get('type_demenagement_id')
     prestation_id = data.get('prestation_id') or request.form.get('prestation_id')  # Optionnel, pour l'édition
+    # Optionnel : 'matin' ou 'apres_midi' pour ne réserver qu'une demi-journée
+    demi_journee_debut = data.get('demi_journee_debut') or request.form.get('demi_journee_debut')
+    demi_journee_fin = data.get('demi_journee_fin') or request.form.get('demi_journee_fin')
     
     # Valider les paramètres
     if not date_debut_str or not date_fin_str:
@@ -32,43 +43,41 @@ def check_disponibilite():
     
     try:
         # Convertir les dates
-        date_debut = datetime.strptime(date_debut_str, '%Y-%m-%d')
-        date_fin = datetime.strptime(date_fin_str, '%Y-%m-%d')
+        # (à la journée ou à l'heure près pour les demi-journées)
+        date_debut, date_fin = periode_demandee(date_debut_str, date_fin_str, demi_journee_debut, demi_journee_fin)
         
         # Valider le type de déménagement
         type_demenagement = None
         if type_demenagement_id and type_demenagement_id != '0':
             type_demenagement = TypeDemenagement.query.get(type_demenagement_id)
         
-        # Trouver les transporteurs déjà assignés à des prestations pendant cette période
-        transporteurs_occupes_query = User.query.join(User.prestations).filter(
-            and_(
-                User.role == 'transporteur',
-                User.statut == 'actif',
-                or_(
-                    # Chevauchement des dates
-                    and_(
-                        Prestation.date_debut <= date_fin,
-                        Prestation.date_fin >= date_debut
-                    )
-                )
-            )
-        )
-        
-        # Exclure la prestation en cours d'édition si applicable
-        if prestation_id:
-            transporteurs_occupes_query = transporteurs_occupes_query.filter(Prestation.id != prestation_id)
-        
-        # Obtenir les IDs des transporteurs occupés
-        transporteurs_occupes_ids = [t.id for t in transporteurs_occupes_query.all()]
+        # Trouver tous les transporteurs actifs (type de véhicule chargé dans la même requête)
+        tous_transporteurs = User.query.options(
+            db.joinedload(User.type_vehicule)
+        ).filter_by(role='transporteur', statut='actif').all()
+        transporteurs_par_id = {t.id: t for t in tous_transporteurs}
         
-        # Trouver tous les transporteurs actifs
-        tous_transporteurs = User.query.filter_by(role='transporteur', statut='actif').all()
+        # Trouver les transporteurs déjà assignés pendant cette période : ET binaire
+        # entre le calendrier à la demi-journée de chaque transporteur et la période
+        # (en excluant la prestation en cours d'édition). Un transporteur occupé le
+        # matin reste ainsi disponible pour une prestation l'après-midi.
+        calendrier = get_calendrier_flotte()
+        transporteurs_occupes_ids = calendrier.transporteurs_occupes(
+            transporteurs_par_id, date_debut, date_fin, exclure_prestation_id=prestation_id
+        )
+        index = get_index_disponibilite()
         
         # Séparer les transporteurs disponibles et bientôt disponibles
         transporteurs_disponibles = []
         transporteurs_bientot_disponibles = []
         
+        # Premier créneau libre de la durée demandée pour chaque transporteur occupé,
+        # calculé en une passe sur l'index (trous entre réservations compris)
+        prochaines_dispos = index.prochaines_disponibilites(
+            transporteurs_occupes_ids, date_debut, date_fin - date_debut,
+            exclure_prestation_id=prestation_id
+        )
+        
         for transporteur in tous_transporteurs:
             if transporteur.id not in transporteurs_occupes_ids:
                 # Transporteur disponible
@@ -77,25 +86,21 @@ def check_disponibilite():
                     'nom': transporteur.nom,
                     'prenom': transporteur.prenom,
                     'vehicule': transporteur.vehicule or 'Non spécifié',
-                    'type_vehicule': transporteur.type_vehicule or 'Standard',
+                    'type_vehicule': transporteur.type_vehicule.nom if transporteur.type_vehicule else 'Standard',
                     'disponible': True,
                     'vehicule_adapte': True  # Par défaut, considérer tous les véhicules comme adaptés
                 })
             else:
                 # Trouver quand le transporteur sera disponible
-                prochaine_dispo = Prestation.query.filter(
-                    Prestation.transporteurs.any(id=transporteur.id),
-                    Prestation.date_fin >= datetime.now()
-                ).order_by(Prestation.date_fin).first()
+                date_disponible = prochaines_dispos.get(transporteur.id)
                 
-                if prochaine_dispo:
-                    date_disponible = prochaine_dispo.date_fin + timedelta(days=1)
+                if date_disponible:
                     transporteurs_bientot_disponibles.append({
                         'id': transporteur.id,
                         'nom': transporteur.nom,
                         'prenom': transporteur.prenom,
                         'vehicule': transporteur.vehicule or 'Non spécifié',
-                        'type_vehicule': transporteur.type_vehicule or 'Standard',
+                        'type_vehicule': transporteur.type_vehicule.nom if transporteur.type_vehicule else 'Standard',
                         'disponible_le': date_disponible.strftime('%d/%m/%Y')
                     })
         
@@ -123,7 +128,7 @@ def check_disponibilite():
             vehicules_noms = [v['nom'].lower() for v in vehicules_recommandes]
             for t in transporteurs_disponibles:
                 # Vérifier si l'utilisateur a un type_vehicule_id associé
-                user = User.query.get(t['id'])
+                user = transporteurs_par_id.get(t['id'])
                 if user and user.type_vehicule_id:
                     # Vérifier si le type de véhicule est adapté pour ce type de déménagement
                     t['vehicule_adapte'] = user.type_vehicule_id in [v['id'] for v in vehicules_recommandes]
@@ -248,19 +253,24 @@ def liste_transporteurs():
     Route pour récupérer la liste de tous les transporteurs
     """
     try:
-        # Récupérer tous les transporteurs actifs
-        transporteurs = User.query.filter_by(role='transporteur', statut='actif').all()
+        # Transporteurs actifs, type de véhicule et occupation actuelle en une seule requête
+        maintenant = datetime.now()
+        est_occupe = db.session.query(prestation_transporteurs.c.user_id).join(
+            Prestation, Prestation.id == prestation_transporteurs.c.prestation_id
+        ).filter(
+            prestation_transporteurs.c.user_id == User.id,
+            affectation_active(),
+            Prestation.date_debut <= maintenant,
+            Prestation.date_fin >= maintenant
+        ).exists()
+        
+        resultats = db.session.query(User, est_occupe.label('est_occupe')).options(
+            db.joinedload(User.type_vehicule)
+        ).filter(User.role == 'transporteur', User.statut == 'actif').all()
         
         # Formater les données
         transporteurs_data = []
-        for transporteur in transporteurs:
-            # Vérifier si le transporteur est actuellement occupé
-            est_occupe = Prestation.query.join(Prestation.transporteurs).filter(
-                User.id == transporteur.id,
-                Prestation.date_debut <= datetime.now(),
-                Prestation.date_fin >= datetime.now()
-            ).first() is not None
-            
+        for transporteur, occupe in resultats:
             # Récupérer les informations du véhicule
             info_vehicule = "Non spécifié"
             if transporteur.type_vehicule:
@@ -273,16 +283,21 @@ def liste_transporteurs():
                 'nom': transporteur.nom,
                 'prenom': transporteur.prenom,
                 'vehicule': info_vehicule,
-                'disponible': not est_occupe
+                'disponible': not occupe
             })
         
         # Trier par disponibilité puis par nom
         transporteurs_data.sort(key=lambda x: (not x['disponible'], x['nom']))
         
-        return jsonify({
+        # ETag calculé sur le contenu : les widgets qui interrogent la liste à chaque
+        # chargement de formulaire revalident avec If-None-Match et reçoivent un 304
+        reponse = jsonify({
             'success': True,
             'transporteurs': transporteurs_data
         })
+        reponse.add_etag()
+        reponse.headers['Cache-Control'] = 'private, no-cache'
+        return reponse.make_conditional(request)
         
     except Exception as e:
         print(f"Erreur lors de la récupération des transporteurs: {str(e)}")
@@ -290,3 +305,203 @@ def liste_transporteurs():
             'success': False,
             'message': f'Erreur: {str(e)}'
         }), 500
+
+
+@transporteur_api_bp.route('/planning', methods=['GET'])
+@login_required
+def planning_transporteurs():
+    """
+    Route pour récupérer la matrice de disponibilité transporteur × jour
+    utilisée par la vue planning (une seule requête pour toute la période)
+    """
+    date_debut_str = request.args.get('date_debut')
+    date_fin_str = request.args.get('date_fin')
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    max_transporteurs = current_app.config.get('PLANNING_MAX_TRANSPORTEURS', 200)
+    limit = min(max(request.args.get('limit', max_transporteurs, type=int), 1), max_transporteurs)
+    
+    # Valider les paramètres
+    if not date_debut_str or not date_fin_str:
+        return jsonify({
+            'success': False,
+            'message': 'Paramètres manquants. Veuillez spécifier date_debut et date_fin.'
+        }), 400
+    
+    try:
+        date_debut = datetime.strptime(date_debut_str, '%Y-%m-%d')
+        date_fin = datetime.strptime(date_fin_str, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Format de date invalide. Utilisez le format YYYY-MM-DD.'
+        }), 400
+    
+    # Limiter la taille de la réponse : au plus un trimestre par requête
+    nb_jours = (date_fin - date_debut).days + 1
+    max_jours = current_app.config.get('PLANNING_MAX_JOURS', 92)
+    if nb_jours < 1 or nb_jours > max_jours:
+        return jsonify({
+            'success': False,
+            'message': f'La période doit couvrir entre 1 et {max_jours} jours.'
+        }), 400
+    
+    try:
+        # Transporteurs actifs (une page de lignes)
+        transporteurs_query = User.query.filter_by(role='transporteur', statut='actif')
+        total = transporteurs_query.count()
+        transporteurs = transporteurs_query.order_by(User.nom, User.prenom, User.id).offset(offset).limit(limit).all()
+        
+        matrice = matrice_disponibilite([t.id for t in transporteurs], date_debut, date_fin)
+        
+        return jsonify({
+            'success': True,
+            'date_debut': date_debut.strftime('%Y-%m-%d'),
+            'date_fin': date_fin.strftime('%Y-%m-%d'),
+            'jours': nb_jours,
+            'legende': {
+                CELLULE_LIBRE: 'libre',
+                CELLULE_RESERVEE: 'reserve',
+                CELLULE_MULTIPLE: 'plusieurs_reservations'
+            },
+            'total': total,
+            'offset': offset,
+            'limit': limit,
+            'transporteurs': [{
+                'id': t.id,
+                'nom': t.nom,
+                'prenom': t.prenom,
+                'cellules': matrice[t.id]['cellules'],
+                'reservations': matrice[t.id]['reservations']
+            } for t in transporteurs]
+        })
+    
+    except Exception as e:
+        print(f"Erreur lors de la construction du planning des transporteurs: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Erreur: {str(e)}'
+        }), 500
+
+
+@transporteur_api_bp.route('/affectation-auto', methods=['GET', 'POST'])
+@login_required
+def affectation_automatique():
+    """
+    Route d'affectation automatique des transporteurs aux prestations en attente.
+    
+    GET  ?date_debut=YYYY-MM-DD&date_fin=YYYY-MM-DD : propose un plan sans rien modifier.
+    POST {"affectations": [{"prestation_id": .., "transporteur_id": ..}, ...]} : applique
+         le plan (éventuellement retouché) en une transaction ; avec date_debut/date_fin
+         à la place, calcule puis applique directement le plan proposé.
+    """
+    if not (current_user.is_admin() or current_user.role == 'commercial'):
+        return jsonify({'success': False, 'message': 'Vous n\'êtes pas autorisé à assigner des transporteurs'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    affectations = data.get('affectations')
+    
+    try:
+        if request.method == 'POST' and affectations is not None:
+            if not isinstance(affectations, list) or not all(isinstance(a, dict) for a in affectations):
+                return jsonify({
+                    'success': False,
+                    'message': 'Format invalide : affectations doit être une liste d\'objets.'
+                }), 400
+            try:
+                resultat = appliquer_plan(
+                    (a.get('prestation_id'), a.get('transporteur_id')) for a in affectations
+                )
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)}), 400
+            return jsonify({
+                'success': True,
+                'message': f"{len(resultat['appliquees'])} affectation(s) appliquée(s).",
+                'appliquees': [{'prestation_id': p_id, 'transporteur_id': t_id} for p_id, t_id in resultat['appliquees']],
+                'ignorees': [{'prestation_id': p_id, 'transporteur_id': t_id} for p_id, t_id in resultat['ignorees']]
+            })
+        
+        date_debut_str = data.get('date_debut') or request.args.get('date_debut')
+        date_fin_str = data.get('date_fin') or request.args.get('date_fin')
+        if not date_debut_str or not date_fin_str:
+            return jsonify({
+                'success': False,
+                'message': 'Paramètres manquants. Veuillez spécifier date_debut et date_fin.'
+            }), 400
+        try:
+            date_debut = datetime.strptime(date_debut_str, '%Y-%m-%d')
+            date_fin = datetime.combine(datetime.strptime(date_fin_str, '%Y-%m-%d').date(), datetime.max.time())
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'Format de date invalide. Utilisez le format YYYY-MM-DD.'
+            }), 400
+        
+        plan = proposer_plan(date_debut, date_fin)
+        affectations_proposees = [a._asdict() for a in plan['affectations']]
+        
+        if request.method == 'GET':
+            return jsonify({
+                'success': True,
+                'affectations': affectations_proposees,
+                'non_affectees': plan['non_affectees']
+            })
+        
+        resultat = appliquer_plan((a.prestation_id, a.transporteur_id) for a in plan['affectations'])
+        return jsonify({
+            'success': True,
+            'message': f"{len(resultat['appliquees'])} affectation(s) appliquée(s).",
+            'appliquees': [{'prestation_id': p_id, 'transporteur_id': t_id} for p_id, t_id in resultat['appliquees']],
+            'ignorees': [{'prestation_id': p_id, 'transporteur_id': t_id} for p_id, t_id in resultat['ignorees']],
+            'non_affectees': plan['non_affectees']
+        })
+    
+    except Exception as e:
+        print(f"Erreur lors de l'affectation automatique des transporteurs: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Erreur: {str(e)}'
+        }), 500
+
+
+@transporteur_api_bp.route('/doubles-reservations', methods=['GET'])
+@login_required
+def doubles_reservations():
+    """
+    Route d'administration listant les transporteurs affectés à des prestations
+    qui se chevauchent. Paramètre optionnel depuis=YYYY-MM-DD[THH:MM] pour ne
+    vérifier que les prestations modifiées depuis cette date.
+    """
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs'}), 403
+    
+    depuis = None
+    depuis_str = request.args.get('depuis')
+    if depuis_str:
+        try:
+            depuis = parser_date_creneau(depuis_str)
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'Format de date invalide. Utilisez le format YYYY-MM-DD ou YYYY-MM-DDTHH:MM.'
+            }), 400
+    
+    try:
+        conflits = detecter_doubles_reservations(depuis)
+        return jsonify({
+            'success': True,
+            'total': len(conflits),
+            'conflits': [{
+                'transporteur_id': c.transporteur_id,
+                'prestation_id': c.prestation_id,
+                'autre_prestation_id': c.autre_prestation_id,
+                'debut': c.debut.isoformat(),
+                'fin': c.fin.isoformat()
+            } for c in conflits]
+        })
+    
+    except Exception as e:
+        print(f"Erreur lors de la détection des doubles réservations: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Erreur: {str(e)}'
+        }), 500
@@ -6,6 +6,7 @@ from flask_login import login_required, current_user
 from models import Prestation, User, Notification
 from utils import accepter_prestation, refuser_prestation
 from extensions import db
+from utils_modules.chargement import textes_longs
 from datetime import datetime
 
 transporteur_prestations = Blueprint('transporteur_prestations', __name__)
@@ -89,7 +90,7 @@ def notifications():
         return redirect(url_for('main.dashboard'))
     
     # Récupérer les notifications du transporteur
-    notifications = Notification.query.filter_by(
+    notifications = Notification.query.options(*textes_longs(Notification)).filter_by(
         user_id=current_user.id,
         role_destinataire='transporteur'
     ).order_by(Notification.date_creation.desc()).all()
@@ -0,0 +1,169 @@
+/**
+ * Autocomplétion des listes de sélection pour Cavalier Déménagement
+ *
+ * Toute liste <select data-autocomplete="client|transporteur|prestation">
+ * est remplacée à l'affichage par un champ de saisie qui interroge
+ * /api/autocompletion/<type> : le serveur n'envoie plus toutes les options,
+ * seulement la valeur sélectionnée. Le <select> d'origine reste dans le
+ * formulaire (masqué) et porte la valeur soumise.
+ *
+ * data-autocomplete-parent="<id d'un champ>" ajoute la valeur de ce champ
+ * comme filtre client_id (ex : prestations d'un client).
+ */
+
+(function() {
+    const DELAI_SAISIE = 250;
+    const LIMITE = 15;
+
+    function valeurVide(valeur) {
+        return valeur === '' || valeur === '0';
+    }
+
+    function activerAutocompletion(select) {
+        if (select.multiple || select.dataset.autocompletionActive) return;
+        select.dataset.autocompletionActive = '1';
+
+        const type = select.dataset.autocomplete;
+        const optionVide = Array.from(select.options).find(option => valeurVide(option.value));
+        const selection = select.options[select.selectedIndex];
+
+        // Champ de saisie affiché à la place du select
+        const conteneur = document.createElement('div');
+        conteneur.className = 'position-relative autocompletion';
+        const saisie = document.createElement('input');
+        saisie.type = 'text';
+        saisie.className = select.className.replace('form-select', 'form-control').replace('selectpicker', '');
+        saisie.placeholder = optionVide ? optionVide.text : 'Rechercher...';
+        saisie.autocomplete = 'off';
+        saisie.value = selection && !valeurVide(selection.value) ? selection.text : '';
+        if (select.required) {
+            // Un champ masqué requis bloquerait la soumission sans message visible
+            saisie.required = true;
+            select.required = false;
+        }
+        const liste = document.createElement('div');
+        liste.className = 'list-group position-absolute w-100 shadow-sm d-none';
+        liste.style.zIndex = 1050;
+        liste.style.maxHeight = '300px';
+        liste.style.overflowY = 'auto';
+
+        select.parentNode.insertBefore(conteneur, select);
+        conteneur.appendChild(saisie);
+        conteneur.appendChild(liste);
+        conteneur.appendChild(select);
+        select.classList.add('d-none');
+
+        let delai = null;
+        let numeroRequete = 0;
+        let texteRecherche = '';
+        let offset = 0;
+
+        function choisir(id, libelle) {
+            select.innerHTML = '';
+            if (optionVide) select.appendChild(optionVide.cloneNode(true));
+            if (id !== null) {
+                const option = new Option(libelle, id, true, true);
+                select.appendChild(option);
+                saisie.value = libelle;
+            } else {
+                select.value = optionVide ? optionVide.value : '';
+            }
+            masquer();
+            select.dispatchEvent(new Event('change', {bubbles: true}));
+        }
+
+        function masquer() {
+            liste.classList.add('d-none');
+            liste.innerHTML = '';
+        }
+
+        function charger(suite) {
+            const params = new URLSearchParams({q: texteRecherche, limite: LIMITE, offset: offset});
+            const parent = select.dataset.autocompleteParent && document.getElementById(select.dataset.autocompleteParent);
+            if (parent && parent.value) params.set('client_id', parent.value);
+
+            const requete = ++numeroRequete;
+            fetch(`/api/autocompletion/${type}?${params}`)
+                .then(response => response.json())
+                .then(data => {
+                    // Ignorer les réponses dépassées par une saisie plus récente
+                    if (requete !== numeroRequete || !data.success) return;
+                    if (!suite) liste.innerHTML = '';
+                    const plus = liste.querySelector('.autocompletion-plus');
+                    if (plus) plus.remove();
+
+                    if (!suite && data.resultats.length === 0) {
+                        const vide = document.createElement('div');
+                        vide.className = 'list-group-item text-muted';
+                        vide.textContent = 'Aucun résultat';
+                        liste.appendChild(vide);
+                    }
+                    data.resultats.forEach(resultat => {
+                        const item = document.createElement('button');
+                        item.type = 'button';
+                        item.className = 'list-group-item list-group-item-action';
+                        item.textContent = resultat.libelle;
+                        item.addEventListener('click', () => choisir(resultat.id, resultat.libelle));
+                        liste.appendChild(item);
+                    });
+                    if (data.suite) {
+                        const plusItem = document.createElement('button');
+                        plusItem.type = 'button';
+                        plusItem.className = 'list-group-item list-group-item-action text-primary autocompletion-plus';
+                        plusItem.textContent = 'Plus de résultats...';
+                        plusItem.addEventListener('click', () => {
+                            offset += LIMITE;
+                            charger(true);
+                        });
+                        liste.appendChild(plusItem);
+                    }
+                    liste.classList.remove('d-none');
+                })
+                .catch(error => console.error(`Erreur lors de l'autocomplétion (${type}):`, error));
+        }
+
+        function rechercher() {
+            clearTimeout(delai);
+            delai = setTimeout(() => {
+                texteRecherche = saisie.value.trim();
+                offset = 0;
+                charger(false);
+            }, DELAI_SAISIE);
+        }
+
+        saisie.addEventListener('input', function() {
+            // Texte effacé : plus de valeur sélectionnée
+            if (this.value.trim() === '' && !valeurVide(select.value)) {
+                choisir(null);
+            }
+            rechercher();
+        });
+        saisie.addEventListener('focus', rechercher);
+        saisie.addEventListener('keydown', function(e) {
+            if (e.key === 'Escape') masquer();
+        });
+        document.addEventListener('click', function(e) {
+            if (!conteneur.contains(e.target)) masquer();
+        });
+    }
+
+    function activerDans(racine) {
+        if (racine.matches && racine.matches('select[data-autocomplete]')) {
+            activerAutocompletion(racine);
+        }
+        if (racine.querySelectorAll) {
+            racine.querySelectorAll('select[data-autocomplete]').forEach(activerAutocompletion);
+        }
+    }
+
+    document.addEventListener('DOMContentLoaded', function() {
+        activerDans(document);
+
+        // Listes ajoutées dynamiquement (clients supplémentaires du groupage)
+        new MutationObserver(mutations => {
+            mutations.forEach(mutation => mutation.addedNodes.forEach(activerDans));
+        }).observe(document.body, {childList: true, subtree: true});
+    });
+
+    window.activerAutocompletion = activerAutocompletion;
+})();
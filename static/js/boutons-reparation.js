@@ -343,22 +343,6 @@ function repairAjouterClientButton() {
     
     console.log("Réparation du bouton d'ajout de client...");
     
-    // Récupérer la liste des clients depuis l'API
-    fetch('/api/clients')
-        .then(response => response.json())
-        .then(data => {
-            if (data.success) {
-                // Stocker la liste des clients pour une utilisation ultérieure
-                window.clientsList = data.clients;
-                console.log("Liste des clients récupérée:", window.clientsList.length, "clients trouvés");
-            } else {
-                console.error("Erreur lors de la récupération des clients:", data.message);
-            }
-        })
-        .catch(error => {
-            console.error("Erreur lors de la récupération des clients:", error);
-        });
-    
     // Supprimer les anciens écouteurs d'événements
     const newAjouterClientBtn = ajouterClientBtn.cloneNode(true);
     ajouterClientBtn.parentNode.replaceChild(newAjouterClientBtn, ajouterClientBtn);
@@ -378,14 +362,6 @@ function repairAjouterClientButton() {
         const clientIndex = clientsContainer.querySelectorAll('.client-supplementaire').length + 1;
         const clientId = `client-${clientIndex}`;
         
-        // Générer les options pour le select des clients
-        let clientOptions = '';
-        if (window.clientsList && window.clientsList.length > 0) {
-            clientOptions = window.clientsList.map(client => 
-                `<option value="${client.id}">${client.nom} ${client.prenom}</option>`
-            ).join('');
-        }
-        
         const clientHtml = `
             <div class="client-supplementaire mt-3 fade-in" id="${clientId}">
                 <div class="card">
@@ -398,9 +374,9 @@ function repairAjouterClientButton() {
                     <div class="card-body">
                         <div class="form-group">
                             <label for="client_supplementaire_${clientIndex}"><i class="fas fa-address-card"></i> Sélectionner un client</label>
-                            <select name="clients_supplementaires[]" id="client_supplementaire_${clientIndex}" class="form-control">
+                            <!-- Clients proposés par autocomplétion (autocompletion.js) -->
+                            <select name="clients_supplementaires[]" id="client_supplementaire_${clientIndex}" class="form-control" data-autocomplete="client">
                                 <option value="">Sélectionnez un client</option>
-                                ${clientOptions}
                             </select>
                         </div>
                     </div>
@@ -173,12 +173,84 @@ document.addEventListener('DOMContentLoaded', function() {
                     input.value = '';
                 });
                 
+                const clientRecherche = document.getElementById('client-recherche');
+                const clientFiltre = document.getElementById('client-filtre');
+                if (clientRecherche && clientFiltre) {
+                    clientRecherche.value = '';
+                    clientFiltre.value = '';
+                }
+                
                 // Submit the form to reset filters
                 filterForm.submit();
             }
         });
     }
     
+    // Filtre client : recherche asynchrone au lieu d'une liste de tous les clients
+    const clientRecherche = document.getElementById('client-recherche');
+    const clientFiltre = document.getElementById('client-filtre');
+    const clientSuggestions = document.getElementById('client-suggestions');
+    
+    if (clientRecherche && clientFiltre && clientSuggestions) {
+        let delaiRecherche = null;
+        let derniereRequete = 0;
+        
+        const masquerSuggestions = () => {
+            clientSuggestions.classList.add('d-none');
+            clientSuggestions.innerHTML = '';
+        };
+        
+        clientRecherche.addEventListener('input', function() {
+            // Le texte a changé : le client précédemment choisi ne s'applique plus
+            clientFiltre.value = '';
+            clearTimeout(delaiRecherche);
+            
+            const q = this.value.trim();
+            if (q.length < 2) {
+                masquerSuggestions();
+                return;
+            }
+            
+            delaiRecherche = setTimeout(() => {
+                const numeroRequete = ++derniereRequete;
+                fetch(`/api/clients?q=${encodeURIComponent(q)}&limite=15`)
+                    .then(response => response.json())
+                    .then(data => {
+                        // Ignorer les réponses arrivées après une saisie plus récente
+                        if (numeroRequete !== derniereRequete || !data.success) return;
+                        
+                        clientSuggestions.innerHTML = '';
+                        if (data.clients.length === 0) {
+                            const vide = document.createElement('div');
+                            vide.className = 'list-group-item text-muted';
+                            vide.textContent = 'Aucun client trouvé';
+                            clientSuggestions.appendChild(vide);
+                        }
+                        data.clients.forEach(client => {
+                            const item = document.createElement('button');
+                            item.type = 'button';
+                            item.className = 'list-group-item list-group-item-action';
+                            item.textContent = `${client.nom} ${client.prenom}`;
+                            item.addEventListener('click', () => {
+                                clientRecherche.value = item.textContent;
+                                clientFiltre.value = client.id;
+                                masquerSuggestions();
+                            });
+                            clientSuggestions.appendChild(item);
+                        });
+                        clientSuggestions.classList.remove('d-none');
+                    })
+                    .catch(error => console.error('Erreur lors de la recherche des clients:', error));
+            }, 250);
+        });
+        
+        document.addEventListener('click', function(e) {
+            if (e.target !== clientRecherche && !clientSuggestions.contains(e.target)) {
+                masquerSuggestions();
+            }
+        });
+    }
+    
     // Handle facture delete confirmation
     const deleteButtons = document.querySelectorAll('.delete-facture');
     deleteButtons.forEach(button => {
@@ -61,11 +61,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 throw new Error('Select client original non trouvé');
             }
             
-            const optionsClients = Array.from(clientSelect.options);
-            let optionsHTML = '';
-            optionsClients.forEach(option => {
-                optionsHTML += `<option value="${option.value}">${option.text}</option>`;
-            });
+            // Les clients sont proposés par autocomplétion (autocompletion.js)
+            const optionsHTML = '<option value="">Sélectionnez un client</option>';
             
             // Définir le contenu HTML
             clientDiv.innerHTML = `
@@ -78,7 +75,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     </div>
                     <div class="form-group">
                         <label class="form-label">Sélectionner un client</label>
-                        <select class="form-select" name="client_supplementaire_${compteurClients}">
+                        <select class="form-select" name="client_supplementaire_${compteurClients}" data-autocomplete="client">
                             ${optionsHTML}
                         </select>
                     </div>
@@ -162,12 +162,8 @@ document.addEventListener('DOMContentLoaded', function() {
             const clientDiv = document.createElement('div');
             clientDiv.className = 'client-supplementaire input-group mt-2';
             clientDiv.innerHTML = `
-                <select class="form-select" name="client_supplementaire_${numClients + 1}" required>
+                <select class="form-select" name="client_supplementaire_${numClients + 1}" data-autocomplete="client" required>
                     <option value="">Sélectionnez un client supplémentaire</option>
-                    ${Array.from(document.getElementById('client_id').options)
-                        .filter(opt => opt.value !== '0')
-                        .map(opt => `<option value="${opt.value}">${opt.text}</option>`)
-                        .join('')}
                 </select>
                 <button type="button" class="btn btn-outline-danger btn-supprimer-client">
                     <i class="fas fa-times"></i>
@@ -141,6 +141,13 @@ document.addEventListener('DOMContentLoaded', function() {
             formData.append('date_debut', dateDebut);
             formData.append('date_fin', dateFin);
             formData.append('type_demenagement_id', typeDemenagementId);
+            // Demi-journées (matin / après-midi) si renseignées
+            ['demi_journee_debut', 'demi_journee_fin'].forEach(function(champ) {
+                const select = document.getElementById(champ);
+                if (select && select.value) {
+                    formData.append(champ, select.value);
+                }
+            });
             
             if (prestationId) {
                 formData.append('prestation_id', prestationId);
@@ -4,6 +4,9 @@ from werkzeug.utils import secure_filename
 from models import User, Client, Prestation, Facture, Notification
 from extensions import db
 from flask import flash
+from utils_modules.statistiques import get_statistiques_tableau_de_bord
+# Réponses des transporteurs (machine à états, une seule transaction)
+from utils_modules.reponses import accepter_prestation, refuser_prestation
 
 def create_default_admin():
     """Create default admin user if it doesn't exist"""
@@ -118,35 +121,8 @@ def generate_invoice_number():
 
 def calculate_dashboard_stats():
     """Calculate statistics for the dashboard"""
-    now = datetime.now()
-    
-    # Client stats
-    total_clients = Client.query.filter_by(archive=False).count()
-    new_clients_month = Client.query.filter(
-        Client.date_creation >= now.replace(day=1, hour=0, minute=0, second=0),
-        Client.archive == False
-    ).count()
-    
-    # Prestation stats
-    total_prestations = Prestation.query.filter_by(archive=False).count()
-    prestations_en_cours = Prestation.query.filter_by(
-        statut='En cours', 
-        archive=False
-    ).count()
-    prestations_a_venir = Prestation.query.filter(
-        Prestation.date_debut > now,
-        Prestation.statut.in_(['En attente', 'Confirmée']),
-        Prestation.archive == False
-    ).count()
-    
-    # Facture stats
-    total_factures = Facture.query.count()
-    factures_impayees = Facture.query.filter_by(statut='En attente').count()
-    
-    # Calculate total revenue
-    total_revenue = db.session.query(db.func.sum(Facture.montant_ttc)).filter_by(
-        statut='Payée'
-    ).scalar() or 0
+    # Compteurs agrégés en cache (voir utils_modules/statistiques.py)
+    statistiques = get_statistiques_tableau_de_bord()
     
     # Recent activity
     recent_clients = Client.query.filter_by(archive=False).order_by(
@@ -158,18 +134,18 @@ def calculate_dashboard_stats():
     ).limit(5).all()
     
     recent_factures = Facture.query.order_by(
-        Facture.date_creation.desc()
+        Facture.date_emission.desc()
     ).limit(5).all()
     
     return {
-        'total_clients': total_clients,
-        'new_clients_month': new_clients_month,
-        'total_prestations': total_prestations,
-        'prestations_en_cours': prestations_en_cours,
-        'prestations_a_venir': prestations_a_venir,
-        'total_factures': total_factures,
-        'factures_impayees': factures_impayees,
-        'total_revenue': total_revenue,
+        'total_clients': statistiques['total_clients'],
+        'new_clients_month': statistiques['new_clients_month'],
+        'total_prestations': statistiques['total_prestations'],
+        'prestations_en_cours': statistiques['prestations_en_cours'],
+        'prestations_a_venir': statistiques['prestations_a_venir'],
+        'total_factures': statistiques['total_factures'],
+        'factures_impayees': statistiques['factures_impayees'],
+        'total_revenue': statistiques['total_revenue'],
         'recent_clients': recent_clients,
         'recent_prestations': recent_prestations,
         'recent_factures': recent_factures
@@ -228,55 +204,85 @@ def notifier_transporteurs(prestation, transporteurs, type_notification='assigna
         transporteurs: Liste des transporteurs à notifier (peut être une liste d'IDs ou d'objets User)
         type_notification: Type de notification ('assignation', 'modification', 'annulation')
     
+    Returns:
+        bool: True si les notifications ont été envoyées avec succès, False sinon
+    """
+    # Vérifier si la liste est vide
+    if not transporteurs:
+        return True
+    return notifier_transporteurs_lot([(prestation, transporteurs)], type_notification)
+
+
+def _message_notification(prestation, type_notification):
+    """Construit le message de notification d'un transporteur pour une prestation."""
+    # Créer le message approprié selon le type de notification
+    client_info = f"Client: {prestation.client_principal.nom} {prestation.client_principal.prenom}" if prestation.client_principal else ""
+    
+    if type_notification == 'assignation':
+        return f"Vous avez été assigné à une nouvelle prestation du {prestation.date_debut.strftime('%d/%m/%Y')} au {prestation.date_fin.strftime('%d/%m/%Y')}. \n{client_info}\nAdresse de départ: {prestation.adresse_depart}. \nAdresse d'arrivée: {prestation.adresse_arrivee}."
+    elif type_notification == 'modification':
+        return f"Une prestation à laquelle vous êtes assigné a été modifiée. \nDates: du {prestation.date_debut.strftime('%d/%m/%Y')} au {prestation.date_fin.strftime('%d/%m/%Y')}. \n{client_info}"
+    elif type_notification == 'annulation':
+        return f"Une prestation à laquelle vous étiez assigné a été annulée. \nDates: du {prestation.date_debut.strftime('%d/%m/%Y')} au {prestation.date_fin.strftime('%d/%m/%Y')}. \n{client_info}"
+    return f"Mise à jour concernant une prestation. \nDates: du {prestation.date_debut.strftime('%d/%m/%Y')} au {prestation.date_fin.strftime('%d/%m/%Y')}. \n{client_info}"
+
+
+def notifier_transporteurs_lot(affectations, type_notification='assignation', commit=True):
+    """
+    Envoie en une fois les notifications de plusieurs prestations.
+    
+    Les transporteurs sont vérifiés en une seule requête et toutes les
+    notifications sont ajoutées à la même transaction.
+    
+    Args:
+        affectations: Liste de couples (prestation, transporteurs), les transporteurs
+            étant des IDs ou des objets User
+        type_notification: Type de notification ('assignation', 'modification', 'annulation')
+        commit: False pour laisser l'appelant valider la transaction
+    
     Returns:
         bool: True si les notifications ont été envoyées avec succès, False sinon
     """
     try:
-        # Vérifier si la liste est vide
-        if not transporteurs:
+        affectations = [
+            (prestation, [t.id if isinstance(t, User) else t for t in transporteurs])
+            for prestation, transporteurs in affectations if transporteurs
+        ]
+        if not affectations:
             return True
-            
-        # Convertir la liste en liste d'IDs si ce sont des objets User
-        transporteur_ids = []
-        if isinstance(transporteurs[0], User):
-            transporteur_ids = [t.id for t in transporteurs]
-        else:
-            transporteur_ids = transporteurs
         
-        for transporteur_id in transporteur_ids:
-            # Vérifier que le transporteur existe
-            transporteur = User.query.filter_by(id=transporteur_id, role='transporteur').first()
-            if not transporteur:
-                continue
-                
-            # Créer le message approprié selon le type de notification
-            client_info = f"Client: {prestation.client_principal.nom} {prestation.client_principal.prenom}" if prestation.client_principal else ""
-            
-            if type_notification == 'assignation':
-                message = f"Vous avez été assigné à une nouvelle prestation du {prestation.date_debut.strftime('%d/%m/%Y')} au {prestation.date_fin.strftime('%d/%m/%Y')}. \n{client_info}\nAdresse de départ: {prestation.adresse_depart}. \nAdresse d'arrivée: {prestation.adresse_arrivee}."
-            elif type_notification == 'modification':
-                message = f"Une prestation à laquelle vous êtes assigné a été modifiée. \nDates: du {prestation.date_debut.strftime('%d/%m/%Y')} au {prestation.date_fin.strftime('%d/%m/%Y')}. \n{client_info}"
-            elif type_notification == 'annulation':
-                message = f"Une prestation à laquelle vous étiez assigné a été annulée. \nDates: du {prestation.date_debut.strftime('%d/%m/%Y')} au {prestation.date_fin.strftime('%d/%m/%Y')}. \n{client_info}"
-            else:
-                message = f"Mise à jour concernant une prestation. \nDates: du {prestation.date_debut.strftime('%d/%m/%Y')} au {prestation.date_fin.strftime('%d/%m/%Y')}. \n{client_info}"
-            
-            # Créer la notification
-            notification = Notification(
-                message=message,
-                type='info',
-                role_destinataire='transporteur',
-                user_id=transporteur_id,
-                prestation_id=prestation.id,
-                date_creation=datetime.utcnow(),
-                statut='non_lue'
+        # Vérifier en une requête que les transporteurs existent
+        tous_ids = {t_id for _, ids in affectations for t_id in ids}
+        ids_valides = {
+            t_id for (t_id,) in db.session.query(User.id).filter(
+                User.id.in_(tous_ids), User.role == 'transporteur'
             )
-            
-            db.session.add(notification)
+        }
         
-        db.session.commit()
+        maintenant = datetime.utcnow()
+        for prestation, transporteur_ids in affectations:
+            message = _message_notification(prestation, type_notification)
+            for transporteur_id in transporteur_ids:
+                if transporteur_id not in ids_valides:
+                    continue
+                
+                # Créer la notification
+                db.session.add(Notification(
+                    message=message,
+                    type='info',
+                    role_destinataire='transporteur',
+                    user_id=transporteur_id,
+                    prestation_id=prestation.id,
+                    date_creation=maintenant,
+                    statut='non_lue'
+                ))
+        
+        if commit:
+            db.session.commit()
         return True
     except Exception as e:
+        if not commit:
+            raise
         db.session.rollback()
         flash(f"Erreur lors de l'envoi des notifications: {str(e)}", "danger")
         return False
@@ -303,210 +309,3 @@ def marquer_notification_comme_lue(notification_id, user_id):
         db.session.rollback()
         flash(f"Erreur lors du marquage de la notification comme lue: {str(e)}", "danger")
         return False
-
-def accepter_prestation(prestation_id, transporteur_id, commentaire=None):
-    """
-    Permet à un transporteur d'accepter une prestation.
-    
-    Args:
-        prestation_id: ID de la prestation à accepter
-        transporteur_id: ID du transporteur qui accepte la prestation
-        commentaire: Commentaire optionnel du transporteur
-    
-    Returns:
-        bool: True si la prestation a été acceptée avec succès, False sinon
-    """
-    try:
-        prestation = Prestation.query.get(prestation_id)
-        if not prestation:
-            flash("Prestation introuvable.", "danger")
-            return False
-            
-        # Vérifier que le transporteur est bien assigné à cette prestation
-        transporteur_assigne = False
-        for transporteur in prestation.transporteurs:
-            if transporteur.id == transporteur_id:
-                transporteur_assigne = True
-                break
-                
-        if not transporteur_assigne:
-            flash("Vous n'êtes pas assigné à cette prestation.", "danger")
-            return False
-            
-        # Mettre à jour le statut de l'association prestation-transporteur
-        # Utiliser une requête SQL directe pour mettre à jour la table d'association
-        try:
-            from sqlalchemy import text
-            query = text("""
-                UPDATE prestation_transporteurs 
-                SET statut = 'accepte', date_reponse = :date_reponse, commentaire = :commentaire 
-                WHERE prestation_id = :prestation_id AND user_id = :user_id
-            """)
-            
-            db.session.execute(query, {
-                'date_reponse': datetime.utcnow(),
-                'commentaire': commentaire,
-                'prestation_id': prestation_id,
-                'user_id': transporteur_id
-            })
-        except Exception as e:
-            print(f"Erreur lors de la mise à jour de l'association: {str(e)}")
-            
-        # Garder la compatibilité avec le code existant
-        prestation.status_transporteur = 'accepte'
-        prestation.date_reponse = datetime.utcnow()
-        
-        # Ajouter un commentaire si fourni
-        if commentaire:
-            if prestation.observations:
-                prestation.observations += f"\n\nAccepté par transporteur (ID: {transporteur_id}) le {datetime.utcnow().strftime('%d/%m/%Y %H:%M')} :\n{commentaire}"
-            else:
-                prestation.observations = f"Accepté par transporteur (ID: {transporteur_id}) le {datetime.utcnow().strftime('%d/%m/%Y %H:%M')} :\n{commentaire}"
-        
-        db.session.commit()
-        
-        # Mettre à jour le statut des notifications existantes pour ce transporteur
-        notifications_existantes = Notification.query.filter_by(
-            prestation_id=prestation_id,
-            user_id=transporteur_id,
-            role_destinataire='transporteur'
-        ).all()
-        
-        for notif in notifications_existantes:
-            notif.statut = 'acceptee'
-            notif.lu = True
-        
-        # Créer une notification pour informer l'administrateur
-        notification_admin = Notification(
-            message=f"Le transporteur a accepté la prestation #{prestation_id}.",
-            type='success',
-            role_destinataire='admin',
-            prestation_id=prestation_id,
-            date_creation=datetime.utcnow(),
-            statut='non_lue'
-        )
-        
-        # Créer une notification de confirmation pour le transporteur
-        notification_transporteur = Notification(
-            message=f"Vous avez accepté la prestation #{prestation_id}. Merci pour votre confirmation.",
-            type='success',
-            role_destinataire='transporteur',
-            user_id=transporteur_id,
-            prestation_id=prestation_id,
-            date_creation=datetime.utcnow(),
-            statut='non_lue'
-        )
-        
-        db.session.add(notification_admin)
-        db.session.add(notification_transporteur)
-        db.session.commit()
-        
-        return True
-    except Exception as e:
-        db.session.rollback()
-        flash(f"Erreur lors de l'acceptation de la prestation: {str(e)}", "danger")
-        return False
-
-def refuser_prestation(prestation_id, transporteur_id, raison=None):
-    """
-    Permet à un transporteur de refuser une prestation.
-    
-    Args:
-        prestation_id: ID de la prestation à refuser
-        transporteur_id: ID du transporteur qui refuse la prestation
-        raison: Raison du refus
-    
-    Returns:
-        bool: True si la prestation a été refusée avec succès, False sinon
-    """
-    try:
-        prestation = Prestation.query.get(prestation_id)
-        if not prestation:
-            flash("Prestation introuvable.", "danger")
-            return False
-            
-        # Vérifier que le transporteur est bien assigné à cette prestation
-        transporteur_assigne = False
-        for transporteur in prestation.transporteurs:
-            if transporteur.id == transporteur_id:
-                transporteur_assigne = True
-                break
-                
-        if not transporteur_assigne:
-            flash("Vous n'êtes pas assigné à cette prestation.", "danger")
-            return False
-            
-        # Mettre à jour le statut de l'association prestation-transporteur
-        # Utiliser une requête SQL directe pour mettre à jour la table d'association
-        try:
-            from sqlalchemy import text
-            query = text("""
-                UPDATE prestation_transporteurs 
-                SET statut = 'refuse', date_reponse = :date_reponse, commentaire = :commentaire 
-                WHERE prestation_id = :prestation_id AND user_id = :user_id
-            """)
-            
-            db.session.execute(query, {
-                'date_reponse': datetime.utcnow(),
-                'commentaire': raison,
-                'prestation_id': prestation_id,
-                'user_id': transporteur_id
-            })
-        except Exception as e:
-            print(f"Erreur lors de la mise à jour de l'association: {str(e)}")
-            
-        # Garder la compatibilité avec le code existant
-        prestation.status_transporteur = 'refuse'
-        prestation.date_reponse = datetime.utcnow()
-        prestation.raison_refus = raison
-        
-        # Ajouter la raison du refus aux observations
-        if raison:
-            if prestation.observations:
-                prestation.observations += f"\n\nRefusé par transporteur (ID: {transporteur_id}) le {datetime.utcnow().strftime('%d/%m/%Y %H:%M')} :\n{raison}"
-            else:
-                prestation.observations = f"Refusé par transporteur (ID: {transporteur_id}) le {datetime.utcnow().strftime('%d/%m/%Y %H:%M')} :\n{raison}"
-        
-        db.session.commit()
-        
-        # Mettre à jour le statut des notifications existantes pour ce transporteur
-        notifications_existantes = Notification.query.filter_by(
-            prestation_id=prestation_id,
-            user_id=transporteur_id,
-            role_destinataire='transporteur'
-        ).all()
-        
-        for notif in notifications_existantes:
-            notif.statut = 'refusee'
-            notif.lu = True
-        
-        # Créer une notification pour informer l'administrateur
-        notification_admin = Notification(
-            message=f"Le transporteur a refusé la prestation #{prestation_id}. Raison: {raison if raison else 'Non spécifiée'}",
-            type='warning',
-            role_destinataire='admin',
-            prestation_id=prestation_id,
-            date_creation=datetime.utcnow(),
-            statut='non_lue'
-        )
-        
-        # Créer une notification de confirmation pour le transporteur
-        notification_transporteur = Notification(
-            message=f"Vous avez refusé la prestation #{prestation_id}.",
-            type='warning',
-            role_destinataire='transporteur',
-            user_id=transporteur_id,
-            prestation_id=prestation_id,
-            date_creation=datetime.utcnow(),
-            statut='non_lue'
-        )
-        
-        db.session.add(notification_admin)
-        db.session.add(notification_transporteur)
-        db.session.commit()
-        
-        return True
-    except Exception as e:
-        db.session.rollback()
-        flash(f"Erreur lors du refus de la prestation: {str(e)}", "danger")
-        return False
@@ -0,0 +1,364 @@
+"""
+Affectation automatique des transporteurs aux prestations en attente.
+
+Le solveur prend toutes les prestations 'En attente' sans transporteur d'une
+période (ou dont tous les transporteurs ont refusé) et propose un plan
+d'affectation. C'est une heuristique, pas l'optimum global :
+- les prestations sont regroupées en paquets qui se chevauchent toutes (un
+  transporteur ne peut en prendre qu'une par paquet) ;
+- chaque paquet est résolu par un flot de coût minimum (couplage biparti de
+  poids maximum) entre prestations et transporteurs libres et compatibles ;
+- les paquets sont traités l'un après l'autre par date de début, et les
+  affectations retenues sont reportées dans le calendrier pour les paquets
+  suivants (enchaînement glouton : un choix optimal pour un paquet peut priver
+  un paquet suivant d'un transporteur qui lui était mieux adapté).
+
+La disponibilité est lue dans le calendrier à la demi-journée (creneaux.py),
+la compatibilité dans type_demenagement_vehicule ; à gain égal, la charge déjà
+planifiée départage les transporteurs (répartition).
+
+Le plan proposé peut ensuite être appliqué en une seule transaction, avec les
+notifications des transporteurs envoyées en un lot.
+"""
+from collections import deque, namedtuple
+from datetime import datetime
+
+from sqlalchemy import exists
+
+from extensions import db
+from models import Prestation, User, prestation_transporteurs, type_demenagement_vehicule
+from utils_modules.creneaux import creneau_debut, creneau_fin, get_calendrier_flotte, masque
+from utils_modules.reponses import affectation_active
+
+# Gain d'une affectation : prioritaire sur la charge pour maximiser le nombre de prestations couvertes
+GAIN_AFFECTATION = 1000000
+# Pénalité par affectation déjà planifiée (répartition)
+PENALITE_CHARGE = 1
+
+Affectation = namedtuple('Affectation', ['prestation_id', 'transporteur_id'])
+
+
+def _sans_transporteur_actif():
+    """Condition : la prestation n'a aucun transporteur, ou seulement des refus."""
+    return ~exists().where(
+        prestation_transporteurs.c.prestation_id == Prestation.id,
+        affectation_active()
+    )
+
+
+def _refus(prestation_ids):
+    """Retourne les paires (prestation_id, transporteur_id) refusées, en une requête."""
+    if not prestation_ids:
+        return set()
+    return set(db.session.query(
+        prestation_transporteurs.c.prestation_id,
+        prestation_transporteurs.c.user_id
+    ).filter(
+        prestation_transporteurs.c.prestation_id.in_(prestation_ids),
+        prestation_transporteurs.c.statut == 'refuse'
+    ))
+
+
+def prestations_a_affecter(debut, fin):
+    """
+    Retourne les prestations en attente sans transporteur actif (aucun, ou
+    seulement des refus) qui touchent la période.
+
+    Args:
+        debut: Début de la période (datetime)
+        fin: Fin de la période (datetime)
+    """
+    return Prestation.query.filter(
+        Prestation.statut == 'En attente',
+        Prestation.archive.isnot(True),
+        _sans_transporteur_actif(),
+        Prestation.date_debut <= fin,
+        Prestation.date_fin >= debut
+    ).order_by(Prestation.date_debut, Prestation.id).all()
+
+
+def vehicules_compatibles():
+    """Retourne {type_demenagement_id: {type_vehicule_id, ...}} en une requête."""
+    compatibles = {}
+    for type_demenagement_id, type_vehicule_id in db.session.query(
+        type_demenagement_vehicule.c.type_demenagement_id,
+        type_demenagement_vehicule.c.type_vehicule_id
+    ):
+        compatibles.setdefault(type_demenagement_id, set()).add(type_vehicule_id)
+    return compatibles
+
+
+def _est_compatible(prestation, transporteur, compatibles):
+    """
+    Un transporteur convient si son type de véhicule fait partie des véhicules
+    recommandés pour le type de déménagement (aucune contrainte si le type de
+    déménagement n'a pas de véhicule recommandé).
+    """
+    types_vehicule = compatibles.get(prestation.type_demenagement_id)
+    if not types_vehicule:
+        return True
+    return transporteur.type_vehicule_id in types_vehicule
+
+
+def _paquets_chevauchants(prestations):
+    """
+    Découpe les prestations (triées par début) en paquets qui se chevauchent
+    toutes : chaque paquet contient un même créneau, donc un transporteur ne
+    peut y être affecté qu'une fois.
+    """
+    paquets = []
+    paquet = []
+    fin_min = None
+    for prestation in sorted(prestations, key=lambda p: (creneau_debut(p.date_debut), p.id)):
+        i0 = creneau_debut(prestation.date_debut)
+        i1 = creneau_fin(prestation.date_fin)
+        if paquet and i0 <= fin_min:
+            paquet.append(prestation)
+            fin_min = min(fin_min, i1)
+        else:
+            if paquet:
+                paquets.append(paquet)
+            paquet = [prestation]
+            fin_min = i1
+    if paquet:
+        paquets.append(paquet)
+    return paquets
+
+
+def couplage_cout_minimum(nb_gauche, nb_droite, aretes):
+    """
+    Couplage biparti de coût minimum par flot (plus courts chemins successifs).
+
+    Seules les arêtes de coût négatif sont utiles : l'algorithme s'arrête dès
+    qu'un chemin améliorant ne diminue plus le coût total.
+
+    Args:
+        nb_gauche: Nombre de sommets à gauche (prestations)
+        nb_droite: Nombre de sommets à droite (transporteurs)
+        aretes: Liste de (gauche, droite, coût)
+
+    Returns:
+        dict: {gauche: droite} pour les sommets couplés
+    """
+    source = nb_gauche + nb_droite
+    puits = source + 1
+    nb_sommets = puits + 1
+    # Chaque arc : [destination, capacité, coût, index de l'arc inverse]
+    graphe = [[] for _ in range(nb_sommets)]
+
+    def ajouter_arc(u, v, cout):
+        graphe[u].append([v, 1, cout, len(graphe[v])])
+        graphe[v].append([u, 0, -cout, len(graphe[u]) - 1])
+
+    for g in range(nb_gauche):
+        ajouter_arc(source, g, 0)
+    for d in range(nb_droite):
+        ajouter_arc(nb_gauche + d, puits, 0)
+    for g, d, cout in aretes:
+        ajouter_arc(g, nb_gauche + d, cout)
+
+    while True:
+        # Plus court chemin (Bellman-Ford avec file, les coûts résiduels pouvant être négatifs)
+        distance = [float('inf')] * nb_sommets
+        precedent = [None] * nb_sommets
+        dans_file = [False] * nb_sommets
+        distance[source] = 0
+        file_attente = deque([source])
+        while file_attente:
+            u = file_attente.popleft()
+            dans_file[u] = False
+            for index, (v, capacite, cout, _) in enumerate(graphe[u]):
+                if capacite and distance[u] + cout < distance[v]:
+                    distance[v] = distance[u] + cout
+                    precedent[v] = (u, index)
+                    if not dans_file[v]:
+                        dans_file[v] = True
+                        file_attente.append(v)
+
+        if distance[puits] >= 0:
+            break
+
+        v = puits
+        while v != source:
+            u, index = precedent[v]
+            arc = graphe[u][index]
+            arc[1] -= 1
+            graphe[v][arc[3]][1] += 1
+            v = u
+
+    couplage = {}
+    for g in range(nb_gauche):
+        for v, capacite, _, _ in graphe[g]:
+            if nb_gauche <= v < source and capacite == 0:
+                couplage[g] = v - nb_gauche
+    return couplage
+
+
+def proposer_plan(debut, fin):
+    """
+    Calcule un plan d'affectation pour les prestations en attente de la période.
+
+    Heuristique : le couplage est de coût minimum dans chaque paquet de
+    prestations chevauchantes, mais les paquets sont enchaînés de façon
+    gloutonne, donc le plan n'est pas garanti optimal sur toute la période.
+
+    Args:
+        debut: Début de la période (datetime)
+        fin: Fin de la période (datetime)
+
+    Returns:
+        dict: {'affectations': [Affectation, ...], 'non_affectees': [prestation_id, ...]}
+    """
+    prestations = prestations_a_affecter(debut, fin)
+    if not prestations:
+        return {'affectations': [], 'non_affectees': []}
+
+    transporteurs = User.query.filter_by(role='transporteur', statut='actif').order_by(User.id).all()
+    compatibles = vehicules_compatibles()
+    calendrier = get_calendrier_flotte()
+    # Un transporteur qui a refusé une prestation ne lui est pas reproposé
+    refus = _refus([p.id for p in prestations])
+
+    # Créneaux déjà pris par le plan en cours de construction, et nombre d'affectations
+    planifie = {t.id: 0 for t in transporteurs}
+    charge = {t.id: 0 for t in transporteurs}
+
+    affectations = []
+    non_affectees = []
+    for paquet in _paquets_chevauchants(prestations):
+        aretes = []
+        for g, prestation in enumerate(paquet):
+            periode = masque(prestation.date_debut, prestation.date_fin)
+            for d, transporteur in enumerate(transporteurs):
+                if planifie[transporteur.id] & periode or (prestation.id, transporteur.id) in refus:
+                    continue
+                if not _est_compatible(prestation, transporteur, compatibles):
+                    continue
+                if not calendrier.est_libre(transporteur.id, prestation.date_debut, prestation.date_fin):
+                    continue
+                gain = GAIN_AFFECTATION - PENALITE_CHARGE * charge[transporteur.id]
+                aretes.append((g, d, -gain))
+
+        couplage = couplage_cout_minimum(len(paquet), len(transporteurs), aretes)
+        for g, prestation in enumerate(paquet):
+            if g not in couplage:
+                non_affectees.append(prestation.id)
+                continue
+            transporteur = transporteurs[couplage[g]]
+            planifie[transporteur.id] |= masque(prestation.date_debut, prestation.date_fin)
+            charge[transporteur.id] += 1
+            affectations.append(Affectation(prestation.id, transporteur.id))
+
+    return {'affectations': affectations, 'non_affectees': non_affectees}
+
+
+def appliquer_plan(affectations, notifier=True):
+    """
+    Applique un plan d'affectation en une seule transaction.
+
+    Chaque affectation est revérifiée (prestation toujours en attente et sans
+    transporteur actif, transporteur actif, libre et qui ne l'a pas refusée, y
+    compris vis-à-vis des autres affectations du plan) : celles qui ne sont
+    plus valides sont ignorées.
+
+    Args:
+        affectations: Itérable de (prestation_id, transporteur_id)
+        notifier: Envoyer les notifications d'assignation (un seul lot)
+
+    Returns:
+        dict: {'appliquees': [(prestation_id, transporteur_id), ...], 'ignorees': [...]}
+
+    Raises:
+        ValueError: si un identifiant est absent ou non entier (rien n'est écrit)
+    """
+    from utils import notifier_transporteurs_lot
+
+    try:
+        affectations = [(int(p_id), int(t_id)) for p_id, t_id in affectations]
+    except (TypeError, ValueError):
+        raise ValueError("Identifiants de prestation ou de transporteur invalides.")
+    if not affectations:
+        return {'appliquees': [], 'ignorees': []}
+
+    prestations = {
+        p.id: p for p in Prestation.query.filter(
+            Prestation.id.in_({p_id for p_id, _ in affectations}),
+            Prestation.statut == 'En attente',
+            _sans_transporteur_actif()
+        )
+    }
+    transporteurs = {
+        t.id: t for t in User.query.filter(
+            User.id.in_({t_id for _, t_id in affectations}),
+            User.role == 'transporteur',
+            User.statut == 'actif'
+        )
+    }
+    calendrier = get_calendrier_flotte()
+    refus = _refus(list(prestations))
+
+    appliquees = []
+    ignorees = []
+    planifie = {}
+    deja_affectees = set()
+    lots = []
+    try:
+        for prestation_id, transporteur_id in affectations:
+            prestation = prestations.get(prestation_id)
+            transporteur = transporteurs.get(transporteur_id)
+            if (not prestation or not transporteur or prestation_id in deja_affectees
+                    or (prestation_id, transporteur_id) in refus):
+                ignorees.append((prestation_id, transporteur_id))
+                continue
+            periode = masque(prestation.date_debut, prestation.date_fin)
+            if planifie.get(transporteur_id, 0) & periode or not calendrier.est_libre(
+                transporteur_id, prestation.date_debut, prestation.date_fin
+            ):
+                ignorees.append((prestation_id, transporteur_id))
+                continue
+
+            prestation.transporteurs.append(transporteur)
+            prestation.date_modification = datetime.utcnow()
+            planifie[transporteur_id] = planifie.get(transporteur_id, 0) | periode
+            deja_affectees.add(prestation_id)
+            appliquees.append((prestation_id, transporteur_id))
+            lots.append((prestation, [transporteur_id]))
+
+        if notifier:
+            notifier_transporteurs_lot(lots, commit=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return {'appliquees': appliquees, 'ignorees': ignorees}
+
+
+def affecter_transporteurs(prestation, transporteur_ids):
+    """
+    Remplace les transporteurs d'une prestation par ceux sélectionnés, par différence.
+
+    Les utilisateurs sélectionnés sont chargés en une requête ; seuls les
+    transporteurs retirés et ajoutés modifient prestation_transporteurs, la
+    réponse (statut, date_reponse, commentaire) des autres est conservée.
+    Rien n'est validé : l'appelant enregistre la transaction.
+
+    Args:
+        prestation: Prestation à modifier (nouvelle ou existante)
+        transporteur_ids: Identifiants sélectionnés (les non-transporteurs sont ignorés)
+
+    Returns:
+        list: Transporteurs ajoutés (User), à notifier
+    """
+    ids = list(dict.fromkeys(int(t_id) for t_id in transporteur_ids if t_id))
+    selectionnes = {
+        t.id: t for t in User.query.filter(User.id.in_(ids), User.role == 'transporteur')
+    } if ids else {}
+    actuels = {t.id: t for t in prestation.transporteurs}
+
+    for t_id, transporteur in actuels.items():
+        if t_id not in selectionnes:
+            prestation.transporteurs.remove(transporteur)
+    ajoutes = [selectionnes[t_id] for t_id in ids if t_id in selectionnes and t_id not in actuels]
+    prestation.transporteurs.extend(ajoutes)
+    return ajoutes
@@ -0,0 +1,404 @@
+"""
+Cubes d'analyse en mémoire (factures et prestations).
+
+Chaque cube garde ses lignes en colonnes compactes (module array) :
+- les dimensions texte (statut, type de déménagement, société...) sont
+  encodées par dictionnaire en entiers ;
+- la date de référence est stockée en index de mois (année * 12 + mois - 1) ;
+- les mesures (montants) sont des flottants.
+
+Les regroupements (ex : chiffre d'affaires par mois x type x commercial)
+combinent les codes des dimensions en une seule clé entière et cumulent les
+mesures en une passe. Si NumPy est installé, cette passe est vectorisée sur
+les colonnes sans copie (np.frombuffer) ; sinon elle est faite en Python.
+
+Le cube est rafraîchi de façon incrémentale : les lignes d'id supérieur au
+dernier chargé sont ajoutées et celles modifiées depuis la dernière
+date_modification connue sont mises à jour en place. Une suppression est
+détectée par comparaison du nombre de lignes et provoque un rechargement
+complet. Un changement de dimension porté par une autre table (type du
+client, société de la prestation d'une facture sans société) n'est repris
+qu'au prochain rechargement complet ou à la prochaine modification de la
+ligne.
+"""
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import func, or_
+
+from extensions import db
+from models import Client, Facture, Prestation, User
+
+try:
+    import numpy as np
+except ImportError:  # NumPy est optionnel : regroupements en Python pur
+    np = None
+
+CACHE_TTL_DEFAUT = 60  # secondes
+
+# Dimensions calculées à partir de la date de référence
+DIMENSIONS_DATE = ('mois', 'annee')
+
+DefinitionCube = namedtuple('DefinitionCube', ['nom', 'modele', 'colonnes', 'dimensions', 'mesures', 'jointures'])
+
+CUBES = {
+    'factures': DefinitionCube(
+        nom='factures',
+        modele=Facture,
+        colonnes=lambda: {
+            'date': Facture.date_emission,
+            'statut': Facture.statut,
+            'commercial': Facture.commercial_id,
+            'societe': func.coalesce(Facture.societe, Prestation.societe),
+            'type_client': Client.type_client,
+            'montant_ttc': Facture.montant_ttc,
+            'montant_ht': Facture.montant_ht,
+        },
+        dimensions=('statut', 'commercial', 'societe', 'type_client'),
+        mesures=('montant_ttc', 'montant_ht'),
+        jointures=lambda requete: requete.outerjoin(
+            Prestation, Facture.prestation_id == Prestation.id
+        ).outerjoin(Client, Facture.client_id == Client.id)
+    ),
+    'prestations': DefinitionCube(
+        nom='prestations',
+        modele=Prestation,
+        colonnes=lambda: {
+            'date': Prestation.date_debut,
+            'type_demenagement': Prestation.type_demenagement,
+            'statut': Prestation.statut,
+            'commercial': Prestation.commercial_id,
+            'societe': Prestation.societe,
+            'montant': Prestation.montant,
+        },
+        dimensions=('type_demenagement', 'statut', 'commercial', 'societe'),
+        mesures=('montant',),
+        jointures=lambda requete: requete
+    ),
+}
+
+
+class ErreurAnalyse(ValueError):
+    """Paramètre d'analyse invalide (dimension, mesure ou filtre inconnu)."""
+
+
+def index_mois(date):
+    """Index de mois d'une date (année * 12 + mois - 1)."""
+    return date.year * 12 + date.month - 1
+
+
+def libelle_mois(index):
+    """Libellé 'YYYY-MM' d'un index de mois."""
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+
+def parser_mois(valeur):
+    """
+    Convertit 'YYYY-MM' en index de mois.
+
+    Raises:
+        ErreurAnalyse: si le format n'est pas reconnu
+    """
+    try:
+        annee, mois = valeur.split('-')
+        annee, mois = int(annee), int(mois)
+    except ValueError:
+        raise ErreurAnalyse(f"Mois invalide : {valeur} (format attendu YYYY-MM)")
+    if not 1 <= mois <= 12:
+        raise ErreurAnalyse(f"Mois invalide : {valeur} (format attendu YYYY-MM)")
+    return annee * 12 + mois - 1
+
+
+class Dictionnaire:
+    """Encodage des valeurs d'une dimension en entiers consécutifs."""
+
+    def __init__(self):
+        self.valeurs = []
+        self._codes = {}
+
+    def code(self, valeur):
+        code = self._codes.get(valeur)
+        if code is None:
+            code = len(self.valeurs)
+            self._codes[valeur] = code
+            self.valeurs.append(valeur)
+        return code
+
+    def chercher(self, valeur):
+        return self._codes.get(valeur)
+
+    def __len__(self):
+        return len(self.valeurs)
+
+
+class Cube:
+    """Lignes d'un modèle en colonnes, avec regroupements et rafraîchissement incrémental."""
+
+    def __init__(self, definition):
+        self.definition = definition
+        self._verrou = threading.Lock()
+        self.date_rafraichissement = None
+        self._vider()
+
+    def _vider(self):
+        self.ids = array('q')
+        self.positions = {}
+        self.mois = array('q')
+        self.codes = {dimension: array('q') for dimension in self.definition.dimensions}
+        self.dictionnaires = {dimension: Dictionnaire() for dimension in self.definition.dimensions}
+        self.valeurs = {mesure: array('d') for mesure in self.definition.mesures}
+        self.dernier_id = 0
+        self.derniere_modification = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _requete(self):
+        modele = self.definition.modele
+        colonnes = self.definition.colonnes()
+        requete = db.session.query(
+            modele.id.label('id'),
+            modele.date_modification.label('date_modification'),
+            *(colonne.label(nom) for nom, colonne in colonnes.items())
+        )
+        return self.definition.jointures(requete.select_from(modele))
+
+    def _ecrire(self, ligne):
+        """Ajoute la ligne ou la met à jour en place si son id est déjà chargé."""
+        mois = index_mois(ligne.date) if ligne.date else -1
+        position = self.positions.get(ligne.id)
+        if position is None:
+            self.positions[ligne.id] = len(self.ids)
+            self.ids.append(ligne.id)
+            self.mois.append(mois)
+            for dimension in self.definition.dimensions:
+                self.codes[dimension].append(self.dictionnaires[dimension].code(getattr(ligne, dimension)))
+            for mesure in self.definition.mesures:
+                self.valeurs[mesure].append(getattr(ligne, mesure) or 0.0)
+            self.dernier_id = max(self.dernier_id, ligne.id)
+        else:
+            self.mois[position] = mois
+            for dimension in self.definition.dimensions:
+                self.codes[dimension][position] = self.dictionnaires[dimension].code(getattr(ligne, dimension))
+            for mesure in self.definition.mesures:
+                self.valeurs[mesure][position] = getattr(ligne, mesure) or 0.0
+        if ligne.date_modification and (
+            self.derniere_modification is None or ligne.date_modification > self.derniere_modification
+        ):
+            self.derniere_modification = ligne.date_modification
+
+    def rafraichir(self, complet=False):
+        """
+        Charge les lignes nouvelles ou modifiées depuis le dernier rafraîchissement.
+
+        Returns:
+            int: Nombre de lignes lues
+        """
+        modele = self.definition.modele
+        with self._verrou:
+            if not complet and len(self.ids):
+                # Une suppression fait baisser le nombre de lignes : rechargement complet
+                if db.session.query(func.count(modele.id)).filter(modele.id <= self.dernier_id).scalar() != len(self.ids):
+                    complet = True
+
+            requete = self._requete()
+            if complet or not len(self.ids):
+                self._vider()
+            else:
+                conditions = [modele.id > self.dernier_id]
+                if self.derniere_modification is not None:
+                    # >= : les lignes modifiées dans la même seconde que la précédente lecture sont relues
+                    conditions.append(modele.date_modification >= self.derniere_modification)
+                else:
+                    conditions.append(modele.date_modification.isnot(None))
+                requete = requete.filter(or_(*conditions))
+
+            nb_lignes = 0
+            for ligne in requete.order_by(modele.id).yield_per(2000):
+                self._ecrire(ligne)
+                nb_lignes += 1
+            self.date_rafraichissement = time.monotonic()
+            return nb_lignes
+
+    def _selection(self, filtres, periode):
+        """Codes autorisés par dimension, d'après les filtres exprimés en libellés."""
+        selection = {}
+        for dimension, libelles in (filtres or {}).items():
+            if dimension not in self.definition.dimensions:
+                raise ErreurAnalyse(f"Dimension de filtre inconnue : {dimension}")
+            dictionnaire = self.dictionnaires[dimension]
+            if dimension == 'commercial':
+                libelles = [int(libelle) if str(libelle).isdigit() else None for libelle in libelles]
+            selection[dimension] = {
+                code for code in (dictionnaire.chercher(libelle) for libelle in libelles) if code is not None
+            }
+        depuis, jusqu_a = periode or (None, None)
+        return selection, depuis, jusqu_a
+
+    def agreger(self, dimensions, mesure=None, filtres=None, periode=None):
+        """
+        Regroupe les lignes selon les dimensions.
+
+        Args:
+            dimensions: Dimensions de regroupement (du cube, ou 'mois'/'annee')
+            mesure: Mesure cumulée (None : comptage seul)
+            filtres: {dimension: [valeurs autorisées]}
+            periode: (index de mois de début, index de mois de fin), bornes incluses ou None
+
+        Returns:
+            list: tuples (codes des dimensions, nombre, total)
+        """
+        for dimension in dimensions:
+            if dimension not in self.definition.dimensions and dimension not in DIMENSIONS_DATE:
+                raise ErreurAnalyse(f"Dimension inconnue : {dimension}")
+        if mesure is not None and mesure not in self.definition.mesures:
+            raise ErreurAnalyse(f"Mesure inconnue : {mesure}")
+
+        with self._verrou:
+            selection, depuis, jusqu_a = self._selection(filtres, periode)
+            if np is not None and len(self.ids):
+                return self._agreger_numpy(dimensions, mesure, selection, depuis, jusqu_a)
+            return self._agreger_python(dimensions, mesure, selection, depuis, jusqu_a)
+
+    def _agreger_python(self, dimensions, mesure, selection, depuis, jusqu_a):
+        resultats = {}
+        colonnes_filtre = [(self.codes[dimension], codes) for dimension, codes in selection.items()]
+        valeurs = self.valeurs[mesure] if mesure else None
+        for position, mois in enumerate(self.mois):
+            if (depuis is not None and mois < depuis) or (jusqu_a is not None and mois > jusqu_a):
+                continue
+            if any(colonne[position] not in codes for colonne, codes in colonnes_filtre):
+                continue
+            cle = tuple(
+                mois if dimension == 'mois' else mois // 12 if dimension == 'annee' else self.codes[dimension][position]
+                for dimension in dimensions
+            )
+            nombre, total = resultats.get(cle, (0, 0.0))
+            resultats[cle] = (nombre + 1, total + (valeurs[position] if valeurs is not None else 0.0))
+        return [(cle, nombre, total) for cle, (nombre, total) in resultats.items()]
+
+    def _agreger_numpy(self, dimensions, mesure, selection, depuis, jusqu_a):
+        # Vues sans copie sur les colonnes (libérées avant toute nouvelle écriture, sous verrou)
+        mois = np.frombuffer(self.mois, dtype=np.int64)
+        masque = np.ones(len(mois), dtype=bool)
+        if depuis is not None:
+            masque &= mois >= depuis
+        if jusqu_a is not None:
+            masque &= mois <= jusqu_a
+        for dimension, codes in selection.items():
+            masque &= np.isin(np.frombuffer(self.codes[dimension], dtype=np.int64), list(codes))
+
+        # Clé combinée en base mixte : une seule passe de regroupement
+        cle = np.zeros(int(masque.sum()), dtype=np.int64)
+        bases = []
+        for dimension in dimensions:
+            if dimension in DIMENSIONS_DATE:
+                colonne = mois[masque] if dimension == 'mois' else mois[masque] // 12
+                decalage = int(colonne.min()) if len(colonne) else 0
+                taille = int(colonne.max()) - decalage + 1 if len(colonne) else 1
+                colonne = colonne - decalage
+            else:
+                colonne = np.frombuffer(self.codes[dimension], dtype=np.int64)[masque]
+                decalage, taille = 0, max(len(self.dictionnaires[dimension]), 1)
+            cle = cle * taille + colonne
+            bases.append((taille, decalage))
+
+        cles, inverse = np.unique(cle, return_inverse=True)
+        nombres = np.bincount(inverse, minlength=len(cles))
+        if mesure:
+            totaux = np.bincount(
+                inverse, weights=np.frombuffer(self.valeurs[mesure], dtype=np.float64)[masque], minlength=len(cles)
+            )
+        else:
+            totaux = np.zeros(len(cles))
+
+        resultats = []
+        for cle_combinee, nombre, total in zip(cles.tolist(), nombres.tolist(), totaux.tolist()):
+            codes = []
+            for taille, decalage in reversed(bases):
+                codes.append(cle_combinee % taille + decalage)
+                cle_combinee //= taille
+            resultats.append((tuple(reversed(codes)), nombre, total))
+        return resultats
+
+    def libelle(self, dimension, code):
+        """Valeur d'origine d'un code (index de mois et année restent numériques)."""
+        if dimension == 'mois':
+            return libelle_mois(code) if code >= 0 else None
+        if dimension == 'annee':
+            return code if code >= 0 else None
+        return self.dictionnaires[dimension].valeurs[code]
+
+
+_cubes = {}
+_verrou = threading.Lock()
+
+
+def get_cube(nom):
+    """
+    Retourne le cube demandé, rafraîchi de façon incrémentale s'il date de plus
+    de ANALYSE_CUBE_TTL secondes.
+
+    Raises:
+        ErreurAnalyse: si le cube n'existe pas
+    """
+    if nom not in CUBES:
+        raise ErreurAnalyse(f"Cube inconnu : {nom}")
+    with _verrou:
+        cube = _cubes.get(nom)
+        if cube is None:
+            cube = _cubes[nom] = Cube(CUBES[nom])
+
+    ttl = current_app.config.get('ANALYSE_CUBE_TTL', CACHE_TTL_DEFAUT)
+    if cube.date_rafraichissement is None or time.monotonic() - cube.date_rafraichissement >= ttl:
+        cube.rafraichir()
+    return cube
+
+
+def analyser(nom_cube, dimensions, mesure=None, filtres=None, depuis=None, jusqu_a=None):
+    """
+    Ventilation d'un cube selon des dimensions.
+
+    Args:
+        nom_cube: 'factures' ou 'prestations'
+        dimensions: liste de dimensions (voir CUBES, plus 'mois' et 'annee')
+        mesure: mesure cumulée dans 'total' (None : comptage seul)
+        filtres: {dimension: [valeurs]} ; pour 'commercial', les ids
+        depuis, jusqu_a: mois 'YYYY-MM' bornant la période (inclus)
+
+    Returns:
+        list: un dict par combinaison (valeurs des dimensions, 'nombre', 'total'),
+        triées par valeurs de dimensions ; les commerciaux sont libellés
+        'Prénom Nom'
+    """
+    cube = get_cube(nom_cube)
+    periode = (
+        parser_mois(depuis) if depuis else None,
+        parser_mois(jusqu_a) if jusqu_a else None
+    )
+    resultats = cube.agreger(dimensions, mesure, filtres, periode)
+
+    lignes = []
+    for codes, nombre, total in resultats:
+        ligne = {dimension: cube.libelle(dimension, code) for dimension, code in zip(dimensions, codes)}
+        ligne['nombre'] = nombre
+        ligne['total'] = round(total, 2)
+        lignes.append(ligne)
+
+    if 'commercial' in dimensions:
+        ids = {ligne['commercial'] for ligne in lignes if ligne['commercial'] is not None}
+        noms = {
+            user_id: f'{prenom} {nom}' for user_id, prenom, nom in
+            db.session.query(User.id, User.prenom, User.nom).filter(User.id.in_(ids))
+        } if ids else {}
+        for ligne in lignes:
+            ligne['commercial_id'] = ligne['commercial']
+            ligne['commercial'] = noms.get(ligne['commercial'])
+
+    lignes.sort(key=lambda ligne: tuple(
+        (ligne[dimension] is None, str(ligne[dimension])) for dimension in dimensions
+    ))
+    return lignes
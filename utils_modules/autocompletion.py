@@ -0,0 +1,172 @@
+"""
+Autocomplétion des champs de sélection (clients, transporteurs, prestations).
+
+Les formulaires ne chargent plus toutes les lignes d'une table pour remplir
+une liste déroulante : le navigateur interroge /api/autocompletion/<type>
+au fil de la saisie, et le serveur ne résout que les libellés des valeurs
+sélectionnées et vérifie que les identifiants soumis existent.
+
+La recherche porte sur le début des mots (préfixe) de colonnes indexées
+en minuscules (index lower(...) déclarés dans models.py, ajoutés aux bases
+existantes par migration_index_autocompletion.py). Chaque mot saisi doit
+être le début d'une des colonnes de recherche.
+"""
+from collections import namedtuple
+
+from sqlalchemy import and_, func, or_
+
+from extensions import db
+from models import Client, Prestation, User
+
+LIMITE_DEFAUT = 20
+LIMITE_MAX = 50
+
+Source = namedtuple('Source', ['modele', 'colonnes', 'ordre', 'filtre', 'libelle'])
+
+
+class ErreurAutocompletion(ValueError):
+    """Type d'autocomplétion inconnu."""
+
+
+def _filtre_clients(query, utilisateur, recherche, parametres):
+    # Les clients archivés restent valides pour les valeurs déjà enregistrées
+    if recherche:
+        query = query.filter(Client.archive.is_(False))
+    return query
+
+
+def _filtre_transporteurs(query, utilisateur, recherche, parametres):
+    return query.filter(User.role == 'transporteur', User.statut == 'actif')
+
+
+def _filtre_prestations(query, utilisateur, recherche, parametres):
+    # Mêmes règles de visibilité que la liste des prestations
+    if utilisateur is not None:
+        if utilisateur.role == 'transporteur':
+            query = query.filter(Prestation.transporteurs.any(id=utilisateur.id))
+        elif utilisateur.role == 'commercial' and not utilisateur.is_admin() and utilisateur.id != 1:
+            query = query.filter(Prestation.commercial_id == utilisateur.id)
+    client_id = parametres.get('client_id')
+    if client_id:
+        query = query.filter(Prestation.client_id == client_id)
+    if recherche:
+        query = query.filter(Prestation.archive.is_(False))
+    return query
+
+
+def _libelle_prestation(prestation):
+    return (f"{prestation.type_demenagement} ({prestation.date_debut.strftime('%d/%m/%Y')}) - "
+            f"{prestation.adresse_depart} à {prestation.adresse_arrivee}")
+
+
+SOURCES = {
+    'client': Source(
+        modele=Client,
+        colonnes=(Client.nom, Client.prenom),
+        ordre=(Client.nom, Client.prenom, Client.id),
+        filtre=_filtre_clients,
+        libelle=lambda c: f"{c.nom} {c.prenom}"
+    ),
+    'transporteur': Source(
+        modele=User,
+        colonnes=(User.nom, User.prenom),
+        ordre=(User.nom, User.prenom, User.id),
+        filtre=_filtre_transporteurs,
+        libelle=lambda u: f"{u.nom} {u.prenom} ({u.vehicule or 'Aucun véhicule'})"
+    ),
+    'prestation': Source(
+        modele=Prestation,
+        colonnes=(Client.nom, Client.prenom),
+        ordre=(Prestation.date_debut.desc(), Prestation.id.desc()),
+        filtre=_filtre_prestations,
+        libelle=_libelle_prestation
+    ),
+}
+
+
+def _source(type_objet):
+    try:
+        return SOURCES[type_objet]
+    except KeyError:
+        raise ErreurAutocompletion(f"Type d'autocomplétion inconnu : {type_objet}")
+
+
+def _requete(source, utilisateur, recherche, parametres):
+    query = source.modele.query
+    if source.modele is Prestation:
+        query = query.join(Client, Prestation.client_id == Client.id).options(
+            db.contains_eager(Prestation.client_principal)
+        )
+    return source.filtre(query, utilisateur, recherche, parametres or {})
+
+
+def _condition_prefixe(colonne, prefixe):
+    """
+    lower(colonne) commence par prefixe : l'encadrement [prefixe, borne[
+    permet d'utiliser l'index lower(colonne), le LIKE garde la sémantique exacte.
+    """
+    expression = func.lower(colonne)
+    motif = prefixe.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    borne = prefixe[:-1] + chr(ord(prefixe[-1]) + 1)
+    return and_(expression >= prefixe, expression < borne, expression.like(motif, escape='\\'))
+
+
+def rechercher(type_objet, texte, utilisateur=None, limite=LIMITE_DEFAUT, offset=0, parametres=None):
+    """
+    Objets d'un type dont les colonnes de recherche commencent par les mots saisis.
+
+    Args:
+        type_objet: client, transporteur ou prestation
+        texte: Texte saisi (vide : premiers objets dans l'ordre de la source)
+        utilisateur: Utilisateur courant (règles de visibilité)
+        limite: Nombre de résultats (borné à LIMITE_MAX)
+        offset: Décalage, pour charger la suite des résultats
+        parametres: Filtres propres au type (client_id pour les prestations)
+
+    Returns:
+        tuple: (liste de {'id', 'libelle'}, True s'il reste des résultats)
+
+    Raises:
+        ErreurAutocompletion: si le type est inconnu
+    """
+    source = _source(type_objet)
+    limite = min(max(limite, 1), LIMITE_MAX)
+    query = _requete(source, utilisateur, True, parametres)
+
+    mots = texte.lower().split()
+    conditions = []
+    for mot in mots:
+        termes = [_condition_prefixe(colonne, mot) for colonne in source.colonnes]
+        if mot.isdigit():
+            termes.append(source.modele.id == int(mot))
+        conditions.append(or_(*termes))
+    if conditions:
+        query = query.filter(and_(*conditions))
+
+    objets = query.order_by(*source.ordre).offset(max(offset, 0)).limit(limite + 1).all()
+    return [{'id': o.id, 'libelle': source.libelle(o)} for o in objets[:limite]], len(objets) > limite
+
+
+def libelles(type_objet, ids, utilisateur=None, parametres=None):
+    """
+    Libellés d'objets déjà sélectionnés, en une requête.
+
+    Returns:
+        dict: {id: libelle} des objets existants et visibles
+    """
+    source = _source(type_objet)
+    ids = {i for i in ids if i}
+    if not ids:
+        return {}
+    query = _requete(source, utilisateur, False, parametres).filter(source.modele.id.in_(ids))
+    return {o.id: source.libelle(o) for o in query}
+
+
+def ids_valides(type_objet, ids, utilisateur=None, parametres=None):
+    """Identifiants parmi `ids` qui désignent des objets existants et visibles."""
+    source = _source(type_objet)
+    ids = {i for i in ids if i}
+    if not ids:
+        return set()
+    query = _requete(source, utilisateur, False, parametres).filter(source.modele.id.in_(ids))
+    return {objet_id for (objet_id,) in query.with_entities(source.modele.id)}
@@ -0,0 +1,242 @@
+"""
+Construction du flux d'événements du calendrier (FullCalendar).
+
+Le flux est limité à la fenêtre affichée (paramètres start/end envoyés par
+FullCalendar) et peut fonctionner en mode delta (paramètre since) : seuls les
+événements créés ou modifiés depuis la date donnée sont renvoyés, avec la
+liste des événements à retirer du calendrier de l'utilisateur :
+- suppressions et désaffectations, tracées dans SuppressionCalendrier (un
+  transporteur ne reçoit que les retraits de son propre calendrier) ;
+- prestations de l'utilisateur modifiées et sorties de la fenêtre affichée.
+La liste est ainsi bornée par le calendrier de l'utilisateur, et non par
+le volume d'écritures de toute la flotte.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, inspect, or_
+from sqlalchemy.orm import Session, joinedload, undefer
+
+from extensions import db
+from models import Prestation, Stockage, SuppressionCalendrier, User
+from utils_modules.evenements import projeter_observations
+
+COULEURS_STATUT = {
+    'En attente': '#ffc107',
+    'Confirmée': '#17a2b8',
+    'En cours': '#007bff',
+    'Terminée': '#28a745',
+    'Annulée': '#dc3545',
+    'Refusée': '#6c757d'
+}
+COULEUR_STOCKAGE = '#4caf50'
+PREFIXE_STOCKAGE = 'stock-'
+# Durée affichée pour un stockage sans date de fin
+DUREE_STOCKAGE_OUVERT = timedelta(days=30)
+
+
+def parser_date_calendrier(valeur):
+    """
+    Convertit une date envoyée par FullCalendar ('2025-04-27', '2025-04-27T00:00:00'
+    ou avec fuseau '2025-04-27T00:00:00+02:00') en datetime naïf.
+
+    Raises:
+        ValueError: si le format n'est pas reconnu
+    """
+    valeur = valeur.strip().replace(' ', '+').replace('Z', '+00:00')
+    date = datetime.fromisoformat(valeur)
+    return date.replace(tzinfo=None)
+
+
+def evenement_prestation(prestation, observations=None):
+    """
+    Convertit une prestation en événement FullCalendar. `observations` est le
+    texte projeté avec le journal (projeter_observations), à défaut le texte saisi.
+    """
+    color = COULEURS_STATUT.get(prestation.statut, '#6c757d')
+
+    client_title = 'Sans client'
+    if prestation.client_principal:
+        client_title = f'{prestation.client_principal.nom} {prestation.client_principal.prenom}'
+
+    return {
+        'id': prestation.id,
+        'title': f'{prestation.type_demenagement} - {client_title}',
+        'start': prestation.date_debut.isoformat(),
+        'end': prestation.date_fin.isoformat(),
+        'allDay': True,
+        'backgroundColor': color,
+        'borderColor': color,
+        'textColor': '#fff' if prestation.statut not in ['En attente'] else '#000',
+        'extendedProps': {
+            'type': 'prestation',
+            'statut': prestation.statut,
+            'client': client_title,
+            'adresse_depart': prestation.adresse_depart,
+            'adresse_arrivee': prestation.adresse_arrivee,
+            'type_demenagement': prestation.type_demenagement,
+            'observations': (prestation.observations if observations is None else observations) or ''
+        }
+    }
+
+
+def evenement_stockage(stockage, maintenant):
+    """Convertit un stockage en événement FullCalendar (un mois affiché si pas de date de fin)."""
+    client_title = 'Sans client'
+    if stockage.client:
+        client_title = f'{stockage.client.nom} {stockage.client.prenom}'
+
+    debut = stockage.date_debut or maintenant
+    return {
+        'id': f'{PREFIXE_STOCKAGE}{stockage.id}',  # Préfixe pour différencier des prestations
+        'title': f'Stockage - {stockage.reference} - {client_title}',
+        'start': debut.isoformat(),
+        'end': (stockage.date_fin or maintenant + DUREE_STOCKAGE_OUVERT).isoformat(),
+        'allDay': True,
+        'backgroundColor': COULEUR_STOCKAGE,
+        'borderColor': COULEUR_STOCKAGE,
+        'textColor': '#fff',
+        'extendedProps': {
+            'type': 'stockage',
+            'client': client_title,
+            'adresse': stockage.emplacement,
+            'observations': stockage.observations or '',
+            'statut': stockage.statut
+        }
+    }
+
+
+def requete_prestations(utilisateur, debut=None, fin=None):
+    """
+    Prestations visibles par l'utilisateur dans la fenêtre, client chargé dans la même requête.
+    Les observations (colonne différée) sont chargées : le calendrier les affiche
+    (complétées par le journal des événements) et les cherche.
+    """
+    query = Prestation.query.options(joinedload(Prestation.client_principal), undefer(Prestation.observations))
+    if utilisateur.role == 'transporteur':
+        query = query.filter(Prestation.transporteurs.any(id=utilisateur.id))
+    if fin is not None:
+        query = query.filter(Prestation.date_debut < fin)
+    if debut is not None:
+        query = query.filter(Prestation.date_fin >= debut)
+    return query
+
+
+def requete_stockages(utilisateur, debut=None, fin=None):
+    """Stockages visibles par l'utilisateur dans la fenêtre (les stockages sans fin restent affichés)."""
+    query = Stockage.query.options(joinedload(Stockage.client))
+    if utilisateur.role == 'client':
+        query = query.filter(Stockage.client_id == utilisateur.id)
+    if fin is not None:
+        query = query.filter(Stockage.date_debut < fin)
+    if debut is not None:
+        query = query.filter(or_(Stockage.date_fin.is_(None), Stockage.date_fin >= debut))
+    return query
+
+
+def evenements_periode(utilisateur, debut=None, fin=None):
+    """Retourne les événements (prestations puis stockages) de la fenêtre [debut, fin[."""
+    maintenant = datetime.now()
+    prestations = requete_prestations(utilisateur, debut, fin).all()
+    observations = projeter_observations(prestations)
+    evenements = [evenement_prestation(p, observations[p.id]) for p in prestations]
+    evenements.extend(evenement_stockage(s, maintenant) for s in requete_stockages(utilisateur, debut, fin))
+    return evenements
+
+
+def evenements_depuis(utilisateur, depuis, debut=None, fin=None):
+    """
+    Mode delta : événements créés ou modifiés depuis `depuis` et identifiants
+    des événements à retirer du calendrier.
+
+    Returns:
+        tuple: (evenements, ids_supprimes)
+    """
+    maintenant = datetime.now()
+    modifie_prestation = func.coalesce(Prestation.date_modification, Prestation.date_creation) > depuis
+    modifie_stockage = func.coalesce(Stockage.date_modification, Stockage.date_creation) > depuis
+
+    prestations = requete_prestations(utilisateur, debut, fin).filter(modifie_prestation).all()
+    stockages = requete_stockages(utilisateur, debut, fin).filter(modifie_stockage).all()
+    observations = projeter_observations(prestations)
+    evenements = [evenement_prestation(p, observations[p.id]) for p in prestations]
+    evenements.extend(evenement_stockage(s, maintenant) for s in stockages)
+
+    # Événements de l'utilisateur modifiés et sortis de la fenêtre : à retirer
+    supprimes = []
+    if debut is not None or fin is not None:
+        hors_fenetre = []
+        if fin is not None:
+            hors_fenetre.append(Prestation.date_debut >= fin)
+        if debut is not None:
+            hors_fenetre.append(Prestation.date_fin < debut)
+        supprimes.extend(
+            str(p_id) for (p_id,) in requete_prestations(utilisateur).with_entities(Prestation.id).filter(
+                modifie_prestation, or_(*hors_fenetre)
+            )
+        )
+        hors_fenetre = []
+        if fin is not None:
+            hors_fenetre.append(Stockage.date_debut >= fin)
+        if debut is not None:
+            hors_fenetre.append(Stockage.date_fin < debut)
+        supprimes.extend(
+            f'{PREFIXE_STOCKAGE}{s_id}' for (s_id,) in requete_stockages(utilisateur).with_entities(Stockage.id).filter(
+                modifie_stockage, or_(*hors_fenetre)
+            )
+        )
+
+    # Suppressions et désaffectations : un transporteur ne reçoit que celles de son calendrier
+    if utilisateur.role == 'transporteur':
+        retraits = or_(SuppressionCalendrier.type_objet == 'stockage',
+                       SuppressionCalendrier.transporteur_id == utilisateur.id)
+    else:
+        retraits = SuppressionCalendrier.transporteur_id.is_(None)
+    for type_objet, objet_id in SuppressionCalendrier.query.with_entities(
+        SuppressionCalendrier.type_objet, SuppressionCalendrier.objet_id
+    ).filter(SuppressionCalendrier.date_suppression > depuis, retraits):
+        supprimes.append(f'{PREFIXE_STOCKAGE}{objet_id}' if type_objet == 'stockage' else str(objet_id))
+
+    return evenements, list(dict.fromkeys(supprimes))
+
+
+def tracer_retraits(prestation_ids, transporteur_id):
+    """
+    Trace en une requête le retrait de prestations du calendrier d'un
+    transporteur, pour les écritures hors de l'ORM (réaffectation en masse).
+    """
+    lignes = [{
+        'type_objet': 'prestation', 'objet_id': prestation_id,
+        'transporteur_id': transporteur_id, 'date_suppression': datetime.utcnow()
+    } for prestation_id in prestation_ids]
+    if lignes:
+        db.session.execute(SuppressionCalendrier.__table__.insert(), lignes)
+
+
+@event.listens_for(Session, 'before_flush')
+def _tracer_suppressions(session, flush_context, instances):
+    """
+    Trace pour les clients du mode delta les prestations et stockages supprimés,
+    et les prestations retirées du calendrier d'un transporteur.
+    """
+    # (prestation_id, transporteur_id) retirés d'un calendrier de transporteur
+    retraits = set()
+    for obj in list(session.deleted):
+        if isinstance(obj, Prestation):
+            session.add(SuppressionCalendrier(type_objet='prestation', objet_id=obj.id))
+            historique = inspect(obj).attrs.transporteurs.load_history()
+            retraits.update((obj.id, t.id) for t in list(historique.unchanged or ()) + list(historique.deleted or ()))
+        elif isinstance(obj, Stockage):
+            session.add(SuppressionCalendrier(type_objet='stockage', objet_id=obj.id))
+
+    # Désaffectations, depuis la prestation ou depuis le transporteur
+    for obj in list(session.dirty):
+        if isinstance(obj, Prestation):
+            retraits.update((obj.id, t.id) for t in inspect(obj).attrs.transporteurs.history.deleted or ())
+        elif isinstance(obj, User):
+            retraits.update(
+                (p.id, obj.id) for p in inspect(obj).attrs.prestations.history.deleted or () if p.id is not None
+            )
+
+    for prestation_id, transporteur_id in retraits:
+        session.add(SuppressionCalendrier(type_objet='prestation', objet_id=prestation_id,
+                                          transporteur_id=transporteur_id))
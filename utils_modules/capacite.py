@@ -0,0 +1,149 @@
+"""
+Rapport de capacité : demande en prestations et transporteurs disponibles,
+par jour et par type de véhicule.
+
+- Demande : chaque prestation (non archivée, non annulée) compte, chaque jour
+  qu'elle couvre, pour chacun des types de véhicule recommandés pour son type
+  de déménagement (type_demenagement_vehicule) ; sans recommandation, elle
+  compte dans la ligne « Non spécifié ».
+- Offre : transporteurs actifs possédant le type de véhicule
+  (User.type_vehicule_id), dont on retire ceux déjà affectés ce jour-là.
+- Écart : transporteurs - demande (négatif en cas de pénurie).
+
+Le rapport se calcule en un nombre fixe de requêtes quelle que soit la durée
+de la période, avec des tableaux de différences (+1 au premier jour, -1 au
+lendemain du dernier) par type de véhicule.
+"""
+import csv
+import io
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from extensions import db
+from models import Prestation, TypeVehicule, User
+from utils_modules.affectation import vehicules_compatibles
+from utils_modules.disponibilite import charger_reservations
+
+LIBELLE_SANS_TYPE = 'Non spécifié'
+
+COLONNES_CSV = ['date', 'type_vehicule_id', 'type_vehicule', 'demande', 'transporteurs', 'occupes', 'disponibles', 'ecart']
+
+LigneCapacite = namedtuple('LigneCapacite', COLONNES_CSV)
+
+
+def _ajouter_intervalle(evenements, premier_jour, nb_jours, debut, fin):
+    """Ajoute les jours [debut, fin] (dates) au tableau de différences, borné à la période."""
+    i0 = max((debut - premier_jour).days, 0)
+    i1 = min((fin - premier_jour).days, nb_jours - 1)
+    if i1 < i0:
+        return
+    evenements[i0] += 1
+    evenements[i1 + 1] -= 1
+
+
+def _cumuler(evenements, nb_jours):
+    """Transforme un tableau de différences en valeurs par jour."""
+    valeurs = []
+    total = 0
+    for jour in range(nb_jours):
+        total += evenements[jour]
+        valeurs.append(total)
+    return valeurs
+
+
+def rapport_capacite(debut, fin):
+    """
+    Calcule le rapport de capacité de la période [debut, fin] (jours inclus).
+
+    Args:
+        debut: Premier jour (datetime)
+        fin: Dernier jour (datetime)
+
+    Returns:
+        list: LigneCapacite triées par date puis par type de véhicule
+    """
+    premier_jour = debut.date()
+    nb_jours = (fin.date() - premier_jour).days + 1
+    fin_journee = datetime.combine(fin.date(), datetime.max.time())
+
+    types = [(t.id, t.nom) for t in TypeVehicule.query.order_by(TypeVehicule.nom).all()]
+    types.append((None, LIBELLE_SANS_TYPE))
+
+    # Offre : transporteurs actifs par type de véhicule
+    type_par_transporteur = dict(db.session.query(User.id, User.type_vehicule_id).filter(
+        User.role == 'transporteur', User.statut == 'actif'
+    ))
+    transporteurs_par_type = {}
+    for type_vehicule_id in type_par_transporteur.values():
+        transporteurs_par_type[type_vehicule_id] = transporteurs_par_type.get(type_vehicule_id, 0) + 1
+
+    # Transporteurs occupés : réservations fusionnées par transporteur pour ne le compter qu'une fois par jour
+    occupes = {type_id: [0] * (nb_jours + 1) for type_id, _ in types}
+    reservations_par_transporteur = {}
+    for reservation in charger_reservations(debut=debut, fin=fin_journee):
+        if reservation.transporteur_id in type_par_transporteur:
+            reservations_par_transporteur.setdefault(reservation.transporteur_id, []).append(
+                (reservation.debut.date(), reservation.fin.date())
+            )
+    for transporteur_id, intervalles in reservations_par_transporteur.items():
+        evenements = occupes.setdefault(type_par_transporteur[transporteur_id], [0] * (nb_jours + 1))
+        intervalles.sort()
+        courant_debut, courant_fin = intervalles[0]
+        for jour_debut, jour_fin in intervalles[1:]:
+            if jour_debut <= courant_fin + timedelta(days=1):
+                courant_fin = max(courant_fin, jour_fin)
+                continue
+            _ajouter_intervalle(evenements, premier_jour, nb_jours, courant_debut, courant_fin)
+            courant_debut, courant_fin = jour_debut, jour_fin
+        _ajouter_intervalle(evenements, premier_jour, nb_jours, courant_debut, courant_fin)
+
+    # Demande : prestations de la période réparties sur les types de véhicule recommandés
+    compatibles = vehicules_compatibles()
+    demande = {type_id: [0] * (nb_jours + 1) for type_id, _ in types}
+    prestations = db.session.query(
+        Prestation.type_demenagement_id, Prestation.date_debut, Prestation.date_fin
+    ).filter(
+        Prestation.archive.isnot(True),
+        Prestation.statut != 'Annulée',
+        Prestation.date_debut <= fin_journee,
+        Prestation.date_fin >= debut
+    )
+    for type_demenagement_id, date_debut, date_fin in prestations:
+        for type_vehicule_id in compatibles.get(type_demenagement_id) or (None,):
+            evenements = demande.setdefault(type_vehicule_id, [0] * (nb_jours + 1))
+            _ajouter_intervalle(evenements, premier_jour, nb_jours, date_debut.date(), date_fin.date())
+
+    colonnes = {}
+    for type_id, _ in types:
+        colonnes[type_id] = (
+            _cumuler(demande.get(type_id, [0] * (nb_jours + 1)), nb_jours),
+            _cumuler(occupes.get(type_id, [0] * (nb_jours + 1)), nb_jours)
+        )
+
+    lignes = []
+    for jour in range(nb_jours):
+        date_jour = (premier_jour + timedelta(days=jour)).isoformat()
+        for type_id, nom in types:
+            demande_jour, occupes_jour = colonnes[type_id][0][jour], colonnes[type_id][1][jour]
+            total = transporteurs_par_type.get(type_id, 0)
+            if type_id is None and not (demande_jour or total):
+                continue
+            disponibles = total - occupes_jour
+            lignes.append(LigneCapacite(
+                date_jour, type_id, nom, demande_jour, total, occupes_jour, disponibles, total - demande_jour
+            ))
+    return lignes
+
+
+def generer_csv(lignes, separateur=';', colonnes=COLONNES_CSV):
+    """Générateur de lignes CSV (en-tête compris) pour une réponse en streaming."""
+    tampon = io.StringIO()
+    ecrivain = csv.writer(tampon, delimiter=separateur)
+    ecrivain.writerow(colonnes)
+    for ligne in lignes:
+        ecrivain.writerow(['' if valeur is None else valeur for valeur in ligne])
+        if tampon.tell() > 8192:
+            yield tampon.getvalue()
+            tampon.seek(0)
+            tampon.truncate(0)
+    yield tampon.getvalue()
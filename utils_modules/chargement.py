@@ -0,0 +1,43 @@
+"""
+Profils de chargement des colonnes de texte volumineuses.
+
+Les colonnes de texte long sont différées dans models.py (observations des
+prestations, texte enrichi des documents, instantanés JSON des versions,
+adresse et tags des clients, message des notifications) : les listes ne
+les lisent jamais. Les vues de détail, formulaires d'édition et exports
+qui les affichent les demandent explicitement avec les options ci-dessous,
+dans la requête principale, au lieu d'un chargement différé par objet.
+
+    Prestation.query.options(*textes_longs(Prestation)).get_or_404(id)
+    Facture.query.options(*textes_longs(Client, relation=Facture.client))
+"""
+from extensions import db
+from models import Client, Document, Notification, Prestation, PrestationVersion
+
+# Colonnes différées de chaque modèle
+TEXTES_LONGS = {
+    Prestation: ('observations',),
+    Document: ('observations_supplementaires',),
+    PrestationVersion: ('donnees',),
+    Client: ('adresse', 'tags'),
+    Notification: ('message',),
+}
+
+
+def textes_longs(modele, *colonnes, relation=None):
+    """
+    Options de requête chargeant des colonnes différées d'un modèle.
+
+    Args:
+        modele: Modèle dont les colonnes sont chargées
+        colonnes: Noms des colonnes (toutes les colonnes différées par défaut)
+        relation: Relation vers le modèle, chargée par jointure (ex : Facture.client)
+
+    Returns:
+        list: Options à passer à Query.options()
+    """
+    noms = colonnes or TEXTES_LONGS[modele]
+    attributs = [getattr(modele, nom) for nom in noms]
+    if relation is not None:
+        return [db.joinedload(relation).undefer(attribut) for attribut in attributs]
+    return [db.undefer(attribut) for attribut in attributs]
@@ -0,0 +1,105 @@
+"""
+Annuaire des clients : filtres SQL communs aux listes de clients et
+compteurs de prestations, factures et documents par client.
+
+Les compteurs d'une page sont calculés en une requête (sous-requête
+UNION ALL groupée par client) limitée aux clients affichés, au lieu d'un
+accès aux relations de chaque client dans les templates.
+"""
+from sqlalchemy import func, literal, or_, select, union_all
+
+from extensions import db
+from models import Client, Document, Facture, Prestation
+from utils_modules.recherche import ids_correspondants
+
+COMPTEURS_VIDES = {'prestations': 0, 'factures': 0, 'documents': 0}
+
+
+def filtrer_clients(query, texte='', archives=None, type_client=None):
+    """
+    Applique les filtres de l'annuaire à une requête sur Client.
+
+    Args:
+        texte: Recherche (index plein texte si disponible, sinon sous-chaîne)
+        archives: False pour les clients actifs, True pour les archivés, None pour tous
+        type_client: Type de client (particulier, professionnel), insensible à la casse
+    """
+    if archives is not None:
+        query = query.filter(Client.archive.is_(archives))
+    if type_client:
+        query = query.filter(func.lower(Client.type_client) == type_client.lower())
+    if texte:
+        ids = ids_correspondants('client', texte)
+        if ids is not None:
+            query = query.filter(Client.id.in_(ids))
+        else:
+            search = f"%{texte}%"
+            query = query.filter(or_(
+                Client.nom.ilike(search),
+                Client.prenom.ilike(search),
+                Client.telephone.ilike(search),
+                Client.email.ilike(search),
+                Client.type_client.ilike(search),
+                Client.tags.ilike(search),
+                Client.code_postal.ilike(search),
+                Client.ville.ilike(search),
+                Client.pays.ilike(search)
+            ))
+    return query
+
+
+def compteurs_clients(ids):
+    """
+    Nombre de prestations (client principal), factures et documents des clients.
+
+    Returns:
+        dict: {client_id: {'prestations': n, 'factures': n, 'documents': n}},
+        avec des compteurs à zéro pour les clients sans objet lié
+    """
+    resultats = {client_id: dict(COMPTEURS_VIDES) for client_id in ids}
+    if not resultats:
+        return resultats
+
+    def lignes(colonne, indice):
+        valeurs = [literal(1 if i == indice else 0) for i in range(3)]
+        return select(
+            colonne.label('client_id'),
+            valeurs[0].label('prestations'),
+            valeurs[1].label('factures'),
+            valeurs[2].label('documents')
+        ).where(colonne.in_(list(resultats)))
+
+    sous_requete = union_all(
+        lignes(Prestation.client_id, 0),
+        lignes(Facture.client_id, 1),
+        lignes(Document.client_id, 2)
+    ).subquery()
+    for client_id, prestations, factures, documents in db.session.query(
+        sous_requete.c.client_id,
+        func.sum(sous_requete.c.prestations),
+        func.sum(sous_requete.c.factures),
+        func.sum(sous_requete.c.documents)
+    ).group_by(sous_requete.c.client_id):
+        resultats[client_id] = {
+            'prestations': int(prestations),
+            'factures': int(factures),
+            'documents': int(documents)
+        }
+    return resultats
+
+
+def client_en_dict(client, compteurs=None):
+    """Représentation JSON d'un client de l'annuaire."""
+    return {
+        'id': client.id,
+        'nom': client.nom,
+        'prenom': client.prenom,
+        'type_client': client.type_client or '',
+        'code_postal': client.code_postal or '',
+        'ville': client.ville or '',
+        'telephone': client.telephone or '',
+        'email': client.email or '',
+        'archive': bool(client.archive),
+        'date_creation': client.date_creation.isoformat(),
+        'compteurs': compteurs or dict(COMPTEURS_VIDES)
+    }
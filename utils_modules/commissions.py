@@ -0,0 +1,289 @@
+"""
+Relevés mensuels des commerciaux : factures émises, payées et impayées,
+commissions et prestations converties en facture.
+
+Un relevé couvre un mois et un commercial :
+- factures : celles du commercial émises dans le mois (date_emission) ;
+- commission d'une facture : commission_montant, à défaut montant HT x
+  commission_pourcentage ; elle est due quand la facture est payée, en
+  attente tant qu'elle ne l'est pas (les factures annulées sont exclues) ;
+- prestations : celles du commercial créées dans le mois, dont converties
+  celles qui ont au moins une facture.
+
+Les relevés d'une période sont calculés en deux requêtes groupées par
+commercial et par mois (factures, prestations). Les mois clos (antérieurs
+au mois en cours) sont mis en cache ; une écriture sur une facture ou une
+prestation invalide les mois concernés dans le processus qui l'a faite, et
+COMMISSIONS_CACHE_TTL borne le retard des autres processus (workers).
+"""
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import case, event, exists, extract, func, inspect
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Facture, Prestation, User
+from utils_modules.analyse import index_mois, libelle_mois
+
+COLONNES_RELEVE = [
+    'mois', 'commercial_id', 'commercial',
+    'factures_emises', 'montant_ht', 'montant_ttc',
+    'factures_payees', 'montant_paye', 'factures_impayees', 'montant_impaye',
+    'commission_due', 'commission_en_attente',
+    'prestations_creees', 'prestations_converties', 'taux_conversion'
+]
+
+LigneReleve = namedtuple('LigneReleve', COLONNES_RELEVE)
+
+STATUT_PAYEE = 'Payée'
+STATUT_ANNULEE = 'Annulée'
+
+# {index de mois clos: (horodatage du calcul, {commercial_id: dict des compteurs})}
+_cache = {}
+_verrou = threading.Lock()
+# Factures et prestations dont le mois est à invalider, résolu à la lecture suivante
+_a_invalider = {Facture: set(), Prestation: set()}
+
+
+def _debut_mois(index):
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _compteurs_vides():
+    return {colonne: 0 for colonne in COLONNES_RELEVE[3:-1]}
+
+
+def _calculer(premier_mois, dernier_mois, commercial_id=None):
+    """
+    Compteurs des mois [premier_mois, dernier_mois] (index de mois) par commercial,
+    en une requête groupée sur les factures et une sur les prestations.
+
+    Returns:
+        dict: {index de mois: {commercial_id: compteurs}}
+    """
+    debut = _debut_mois(premier_mois)
+    fin = _debut_mois(dernier_mois + 1)
+    resultats = {mois: {} for mois in range(premier_mois, dernier_mois + 1)}
+
+    commission = func.coalesce(
+        Facture.commission_montant,
+        Facture.montant_ht * func.coalesce(Facture.commission_pourcentage, 0) / 100,
+        0
+    )
+    payee = Facture.statut == STATUT_PAYEE
+    impayee = Facture.statut.notin_([STATUT_PAYEE, STATUT_ANNULEE]) | Facture.statut.is_(None)
+    annee_facture = extract('year', Facture.date_emission)
+    mois_facture = extract('month', Facture.date_emission)
+
+    requete = db.session.query(
+        Facture.commercial_id, annee_facture, mois_facture,
+        func.count(Facture.id),
+        func.coalesce(func.sum(Facture.montant_ht), 0),
+        func.coalesce(func.sum(Facture.montant_ttc), 0),
+        func.coalesce(func.sum(case((payee, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((payee, Facture.montant_ttc), else_=0)), 0),
+        func.coalesce(func.sum(case((impayee, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((impayee, Facture.montant_ttc), else_=0)), 0),
+        func.coalesce(func.sum(case((payee, commission), else_=0)), 0),
+        func.coalesce(func.sum(case((impayee, commission), else_=0)), 0)
+    ).filter(
+        Facture.commercial_id.isnot(None),
+        Facture.date_emission >= debut,
+        Facture.date_emission < fin
+    )
+    if commercial_id is not None:
+        requete = requete.filter(Facture.commercial_id == commercial_id)
+
+    for (commercial, annee, mois, emises, montant_ht, montant_ttc, payees, montant_paye,
+         impayees, montant_impaye, commission_due, commission_en_attente) in requete.group_by(
+            Facture.commercial_id, annee_facture, mois_facture):
+        compteurs = resultats[int(annee) * 12 + int(mois) - 1].setdefault(commercial, _compteurs_vides())
+        compteurs.update({
+            'factures_emises': emises,
+            'montant_ht': float(montant_ht),
+            'montant_ttc': float(montant_ttc),
+            'factures_payees': int(payees),
+            'montant_paye': float(montant_paye),
+            'factures_impayees': int(impayees),
+            'montant_impaye': float(montant_impaye),
+            'commission_due': float(commission_due),
+            'commission_en_attente': float(commission_en_attente)
+        })
+
+    facturee = exists().where(Facture.prestation_id == Prestation.id)
+    annee_prestation = extract('year', Prestation.date_creation)
+    mois_prestation = extract('month', Prestation.date_creation)
+    requete = db.session.query(
+        Prestation.commercial_id, annee_prestation, mois_prestation,
+        func.count(Prestation.id),
+        func.coalesce(func.sum(case((facturee, 1), else_=0)), 0)
+    ).filter(
+        Prestation.commercial_id.isnot(None),
+        Prestation.date_creation >= debut,
+        Prestation.date_creation < fin
+    )
+    if commercial_id is not None:
+        requete = requete.filter(Prestation.commercial_id == commercial_id)
+
+    for commercial, annee, mois, creees, converties in requete.group_by(
+            Prestation.commercial_id, annee_prestation, mois_prestation):
+        compteurs = resultats[int(annee) * 12 + int(mois) - 1].setdefault(commercial, _compteurs_vides())
+        compteurs['prestations_creees'] = creees
+        compteurs['prestations_converties'] = int(converties)
+
+    return resultats
+
+
+def _resoudre_invalidations():
+    """Invalide les mois des factures et prestations écrites dont la date n'était pas chargée."""
+    for modele, attribut in ((Facture, Facture.date_emission), (Prestation, Prestation.date_creation)):
+        ids = _a_invalider[modele]
+        if not ids:
+            continue
+        for (date_valeur,) in db.session.query(attribut).filter(modele.id.in_(list(ids))):
+            _cache.pop(index_mois(date_valeur), None)
+        ids.clear()
+
+
+def releves(premier_mois, dernier_mois, commercial_id=None):
+    """
+    Relevés des mois [premier_mois, dernier_mois] (index de mois, voir
+    utils_modules.analyse.index_mois), triés par mois puis par commercial.
+
+    Args:
+        commercial_id: Limite les relevés à un commercial (None : tous)
+
+    Returns:
+        list: LigneReleve des commerciaux ayant une activité dans le mois
+    """
+    mois_en_cours = index_mois(datetime.utcnow())
+    ttl = current_app.config.get('COMMISSIONS_CACHE_TTL', 300)
+    par_mois = {}
+
+    with _verrou:
+        _resoudre_invalidations()
+        maintenant = time.monotonic()
+        for mois in range(premier_mois, dernier_mois + 1):
+            entree = _cache.get(mois)
+            if entree is not None and maintenant - entree[0] < ttl:
+                par_mois[mois] = entree[1]
+
+    manquants = [mois for mois in range(premier_mois, dernier_mois + 1) if mois not in par_mois]
+    if manquants:
+        # Le cache porte sur tous les commerciaux : un relevé individuel d'un mois clos le remplit aussi
+        calcul_complet = any(mois < mois_en_cours for mois in manquants)
+        calcules = _calculer(manquants[0], manquants[-1], None if calcul_complet else commercial_id)
+        with _verrou:
+            maintenant = time.monotonic()
+            for mois in manquants:
+                par_mois[mois] = calcules[mois]
+                if mois < mois_en_cours and calcul_complet:
+                    _cache[mois] = (maintenant, calcules[mois])
+
+    commerciaux = {cid for compteurs in par_mois.values() for cid in compteurs}
+    if commercial_id is not None:
+        commerciaux &= {commercial_id}
+    noms = {
+        user_id: f'{prenom} {nom}' for user_id, prenom, nom in
+        db.session.query(User.id, User.prenom, User.nom).filter(User.id.in_(commerciaux))
+    } if commerciaux else {}
+
+    lignes = []
+    for mois in range(premier_mois, dernier_mois + 1):
+        for cid in sorted(par_mois[mois], key=lambda cid: (noms.get(cid, ''), cid)):
+            if commercial_id is not None and cid != commercial_id:
+                continue
+            compteurs = par_mois[mois][cid]
+            taux = (
+                round(100 * compteurs['prestations_converties'] / compteurs['prestations_creees'], 1)
+                if compteurs['prestations_creees'] else None
+            )
+            lignes.append(LigneReleve(
+                mois=libelle_mois(mois),
+                commercial_id=cid,
+                commercial=noms.get(cid),
+                taux_conversion=taux,
+                **{cle: round(valeur, 2) if isinstance(valeur, float) else valeur for cle, valeur in compteurs.items()}
+            ))
+    return lignes
+
+
+def invalider_releves():
+    """Vide le cache des mois clos."""
+    with _verrou:
+        _cache.clear()
+        for ids in _a_invalider.values():
+            ids.clear()
+
+
+def _valeurs(obj, attribut):
+    """Valeurs ancienne et nouvelle d'un attribut, ou None si elles ne sont pas chargées."""
+    historique = inspect(obj).attrs[attribut].history
+    valeurs = list(historique.added) + list(historique.unchanged) + list(historique.deleted)
+    if not valeurs and attribut not in obj.__dict__:
+        return None
+    return [valeur for valeur in valeurs if valeur is not None]
+
+
+def _prestations_liees(session, facture):
+    """
+    Prestations dont la conversion change avec l'écriture de la facture, ou
+    None si l'ancienne prestation n'est pas connue.
+    """
+    historique = inspect(facture).attrs.prestation_id.history
+    if facture in session.new:
+        return set(historique.added) - {None}
+    if facture in session.deleted:
+        valeurs = _valeurs(facture, 'prestation_id')
+        return None if valeurs is None else set(valeurs)
+    if not historique.has_changes():
+        return set()
+    if not historique.deleted and not historique.unchanged:
+        return None  # valeur remplacée sans avoir été chargée
+    return (set(historique.added) | set(historique.deleted)) - {None}
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalider_apres_flush(session, flush_context):
+    """
+    Invalide les mois clos touchés par les factures et prestations écrites : mois
+    d'émission de la facture et mois de création de sa prestation (conversion),
+    mois de création de la prestation.
+    """
+    if not _cache:
+        return
+    mois_touches = set()
+    a_invalider = {Facture: set(), Prestation: set()}
+    tout = False
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Facture):
+            dates = _valeurs(obj, 'date_emission')
+            prestations = _prestations_liees(session, obj)
+            if prestations is None:
+                tout = True
+                break
+            a_invalider[Prestation].update(prestations)
+        elif isinstance(obj, Prestation):
+            dates = _valeurs(obj, 'date_creation')
+        else:
+            continue
+        if dates is None:
+            if obj in session.deleted:
+                tout = True  # ligne supprimée : sa date ne peut plus être relue
+                break
+            a_invalider[type(obj)].add(obj.id)
+            continue
+        mois_touches.update(index_mois(date_valeur) for date_valeur in dates)
+
+    with _verrou:
+        if tout:
+            _cache.clear()
+            return
+        for mois in mois_touches:
+            _cache.pop(mois, None)
+        for modele, ids in a_invalider.items():
+            _a_invalider[modele].update(ids)
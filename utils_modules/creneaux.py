@@ -0,0 +1,312 @@
+"""
+Calendrier libre/occupé des transporteurs à la demi-journée.
+
+Chaque transporteur dispose d'un bitset compact (bytearray) : un bit par
+demi-journée (matin, après-midi) depuis ORIGINE. Sur un an, cela représente
+moins de 100 octets par transporteur. Vérifier un chevauchement revient à un
+ET binaire entre le bitset du transporteur et le masque de la période demandée.
+
+Conventions horaires (compatibles avec les prestations existantes saisies à la
+journée, donc à minuit) :
+- un début avant 12h occupe le matin, à partir de 12h l'après-midi ;
+- une fin à minuit occupe la journée entière, une fin jusqu'à 12h le matin
+  seulement, au-delà l'après-midi.
+
+Les bitsets sont mis en cache par processus et mis à jour de façon
+incrémentale : seuls les transporteurs touchés par une transaction validée
+(dates d'une prestation ou affectations modifiées) sont recalculés, en une
+requête. Ils sont notés au flush et marqués à recalculer après le commit,
+pour qu'un recalcul concurrent ne relise pas les anciennes données.
+"""
+import threading
+import time
+from datetime import date, datetime, time as heure, timedelta
+
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Prestation, User, prestation_transporteurs
+from utils_modules.reponses import affectation_active
+
+# Premier jour représenté dans les bitsets : 1er janvier de l'année précédente
+ORIGINE = date(date.today().year - 1, 1, 1)
+
+MIDI = heure(12, 0)
+# Heure d'une fin l'après-midi
+FIN_JOURNEE = heure(23, 59, 59)
+
+DEMI_JOURNEE_MATIN = 'matin'
+DEMI_JOURNEE_APRES_MIDI = 'apres_midi'
+
+
+def creneau_debut(valeur):
+    """Index de la première demi-journée occupée par une date de début."""
+    jour = (valeur.date() - ORIGINE).days
+    return 2 * jour + (1 if valeur.time() >= MIDI else 0)
+
+
+def creneau_fin(valeur):
+    """Index de la dernière demi-journée occupée par une date de fin."""
+    jour = (valeur.date() - ORIGINE).days
+    moment = valeur.time()
+    if moment == heure(0, 0) or moment > MIDI:
+        return 2 * jour + 1
+    return 2 * jour
+
+
+def debut_creneau(index):
+    """Date de début d'une demi-journée (inverse de creneau_debut) : minuit ou 13h."""
+    jour = ORIGINE + timedelta(days=index // 2)
+    return datetime.combine(jour, heure(13, 0) if index % 2 else heure(0, 0))
+
+
+def masque(debut, fin):
+    """Retourne le masque (entier) des demi-journées couvertes par [debut, fin]."""
+    i0 = max(creneau_debut(debut), 0)
+    i1 = creneau_fin(fin)
+    if i1 < i0:
+        return 0
+    return ((1 << (i1 - i0 + 1)) - 1) << i0
+
+
+def appliquer_demi_journee(valeur, demi_journee, fin=False):
+    """
+    Positionne l'heure d'une date saisie à la journée selon la demi-journée choisie.
+
+    Args:
+        valeur: date ou datetime saisi dans le formulaire
+        demi_journee: DEMI_JOURNEE_MATIN, DEMI_JOURNEE_APRES_MIDI ou vide
+        fin: True pour une date de fin
+
+    Returns:
+        datetime: minuit (journée entière), 12h (fin le matin), 13h (début
+        l'après-midi) ou 23h59m59s (fin l'après-midi : la fin reste après un
+        début l'après-midi du même jour)
+    """
+    if valeur is None:
+        return None
+    jour = valeur.date() if isinstance(valeur, datetime) else valeur
+    if fin and demi_journee == DEMI_JOURNEE_MATIN:
+        return datetime.combine(jour, MIDI)
+    if fin and demi_journee == DEMI_JOURNEE_APRES_MIDI:
+        return datetime.combine(jour, FIN_JOURNEE)
+    if not fin and demi_journee == DEMI_JOURNEE_APRES_MIDI:
+        return datetime.combine(jour, heure(13, 0))
+    return datetime.combine(jour, heure(0, 0))
+
+
+def demi_journee_de(valeur, fin=False):
+    """
+    Retourne la demi-journée correspondant à l'heure d'une date (inverse
+    d'appliquer_demi_journee) : vide pour minuit (journée entière).
+    """
+    if valeur is None or not isinstance(valeur, datetime) or valeur.time() == heure(0, 0):
+        return ''
+    if fin:
+        return DEMI_JOURNEE_MATIN if creneau_fin(valeur) % 2 == 0 else DEMI_JOURNEE_APRES_MIDI
+    return DEMI_JOURNEE_APRES_MIDI if creneau_debut(valeur) % 2 == 1 else DEMI_JOURNEE_MATIN
+
+
+def periode_valide(debut, fin):
+    """
+    Vérifie que la fin n'est pas avant le début, à la demi-journée près : un
+    début l'après-midi et une fin à minuit (journée entière) le même jour
+    occupent l'après-midi.
+    """
+    return creneau_fin(fin) >= creneau_debut(debut)
+
+
+def parser_date_creneau(valeur):
+    """
+    Convertit une date reçue par l'API, à la journée ('%Y-%m-%d') ou à
+    l'heure près ('%Y-%m-%dT%H:%M', format des champs datetime-local).
+
+    Raises:
+        ValueError: si le format n'est pas reconnu
+    """
+    for fmt in ('%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(valeur, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Format de date invalide: {valeur}")
+
+
+def periode_demandee(debut, fin, demi_journee_debut=None, demi_journee_fin=None):
+    """
+    Convertit la période d'une requête de disponibilité (voir parser_date_creneau),
+    avec les demi-journées facultatives ('matin', 'apres_midi').
+
+    Raises:
+        ValueError: si une date n'est pas dans un format reconnu
+    """
+    date_debut = parser_date_creneau(debut)
+    date_fin = parser_date_creneau(fin)
+    if demi_journee_debut:
+        date_debut = appliquer_demi_journee(date_debut, demi_journee_debut)
+    if demi_journee_fin:
+        date_fin = appliquer_demi_journee(date_fin, demi_journee_fin, fin=True)
+    return date_debut, date_fin
+
+
+class CalendrierFlotte:
+    """Bitsets libre/occupé de tous les transporteurs."""
+
+    def __init__(self):
+        self._bits = {}
+        # Créneaux réservés par transporteur : (prestation_id, premier, dernier)
+        self._creneaux = {}
+
+    def charger(self, transporteur_ids=None):
+        """
+        (Re)calcule les bitsets en une seule requête.
+
+        Args:
+            transporteur_ids: Transporteurs à recalculer (tous si None)
+        """
+        query = db.session.query(
+            prestation_transporteurs.c.user_id,
+            prestation_transporteurs.c.prestation_id,
+            Prestation.date_debut,
+            Prestation.date_fin
+        ).join(Prestation, Prestation.id == prestation_transporteurs.c.prestation_id).filter(
+            affectation_active(),
+            Prestation.date_fin >= datetime.combine(ORIGINE, heure(0, 0))
+        )
+        if transporteur_ids is not None:
+            transporteur_ids = set(transporteur_ids)
+            if not transporteur_ids:
+                return
+            query = query.filter(prestation_transporteurs.c.user_id.in_(transporteur_ids))
+            for transporteur_id in transporteur_ids:
+                self._bits.pop(transporteur_id, None)
+                self._creneaux.pop(transporteur_id, None)
+        else:
+            self._bits.clear()
+            self._creneaux.clear()
+
+        valeurs = {}
+        for user_id, prestation_id, debut, fin in query.all():
+            if not debut or not fin:
+                continue
+            i0 = max(creneau_debut(debut), 0)
+            i1 = creneau_fin(fin)
+            if i1 < i0:
+                continue
+            valeurs[user_id] = valeurs.get(user_id, 0) | (((1 << (i1 - i0 + 1)) - 1) << i0)
+            self._creneaux.setdefault(user_id, []).append((prestation_id, i0, i1))
+
+        for user_id, valeur in valeurs.items():
+            self._bits[user_id] = bytearray(valeur.to_bytes((valeur.bit_length() + 7) // 8, 'little'))
+
+    def bitset(self, transporteur_id):
+        """Retourne le bitset (bytes) d'un transporteur."""
+        return bytes(self._bits.get(transporteur_id, b''))
+
+    def taille_octets(self):
+        """Taille totale des bitsets de la flotte, en octets."""
+        return sum(len(bits) for bits in self._bits.values())
+
+    def est_libre(self, transporteur_id, debut, fin, exclure_prestation_id=None):
+        """Vérifie si un transporteur est libre sur toutes les demi-journées de [debut, fin]."""
+        bits = self._bits.get(transporteur_id)
+        if not bits:
+            return True
+        periode = masque(debut, fin)
+        if not int.from_bytes(bits, 'little') & periode:
+            return True
+        try:
+            exclure = int(exclure_prestation_id)
+        except (TypeError, ValueError):
+            return False
+        # Conflit possible uniquement avec la prestation exclue : recalculer sans elle
+        reste = 0
+        for prestation_id, i0, i1 in self._creneaux.get(transporteur_id, []):
+            if prestation_id != exclure:
+                reste |= ((1 << (i1 - i0 + 1)) - 1) << i0
+        return not reste & periode
+
+    def transporteurs_occupes(self, transporteur_ids, debut, fin, exclure_prestation_id=None):
+        """Retourne l'ensemble des transporteurs occupés sur au moins une demi-journée de la période."""
+        return {
+            t_id for t_id in transporteur_ids
+            if not self.est_libre(t_id, debut, fin, exclure_prestation_id)
+        }
+
+
+_cache = {}
+_perimes = set()
+_verrou = threading.Lock()
+
+
+def get_calendrier_flotte():
+    """
+    Retourne le calendrier de la flotte en cache, en ne recalculant que les
+    transporteurs modifiés depuis le dernier appel.
+    """
+    ttl = current_app.config.get('DISPONIBILITE_CACHE_TTL', 60)
+    with _verrou:
+        entree = _cache.get('flotte')
+        if entree is None or time.monotonic() - entree[0] >= ttl:
+            calendrier = CalendrierFlotte()
+            calendrier.charger()
+            _cache['flotte'] = (time.monotonic(), calendrier)
+            _perimes.clear()
+            return calendrier
+
+        calendrier = entree[1]
+        if _perimes:
+            calendrier.charger(set(_perimes))
+            _perimes.clear()
+        return calendrier
+
+
+def marquer_perimes(transporteur_ids):
+    """Note des transporteurs à recalculer après une écriture hors de l'ORM (affectations en masse)."""
+    if _cache:
+        _perimes.update(transporteur_ids)
+
+
+def _transporteurs_concernes(session, obj):
+    """Retourne les IDs des transporteurs dont le bitset dépend de l'objet modifié."""
+    etat = inspect(obj)
+    if isinstance(obj, User):
+        historique = etat.attrs.prestations.history
+        return {obj.id} if historique.has_changes() else set()
+
+    historique = etat.attrs.transporteurs.history
+    ids = {u.id for u in (historique.added or ()) if u.id}
+    ids.update(u.id for u in (historique.deleted or ()) if u.id)
+    dates_modifiees = (
+        etat.attrs.date_debut.history.has_changes()
+        or etat.attrs.date_fin.history.has_changes()
+    )
+    if obj in session.new or obj in session.deleted or dates_modifiees:
+        ids.update(u.id for u in (historique.unchanged or ()) if u.id)
+    return ids
+
+
+@event.listens_for(Session, 'after_flush')
+def _noter_apres_flush(session, flush_context):
+    """Note dans la session les transporteurs touchés par une écriture de prestation."""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Prestation, User)):
+            ids = _transporteurs_concernes(session, obj)
+            if ids:
+                session.info.setdefault('creneaux_perimes', set()).update(ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _marquer_perimes_apres_commit(session):
+    """Marque à recalculer les transporteurs touchés par la transaction validée."""
+    ids = session.info.pop('creneaux_perimes', None)
+    if ids:
+        marquer_perimes(ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _oublier_apres_rollback(session):
+    """Les écritures annulées ne changent pas les calendriers."""
+    session.info.pop('creneaux_perimes', None)
@@ -0,0 +1,366 @@
+"""
+Moteur de disponibilité des transporteurs.
+
+Les réservations (prestation_transporteurs jointe aux dates de Prestation) sont
+chargées en une seule requête puis rangées dans un index d'intervalles :
+les réservations sont triées par date de début et un arbre de segments garde
+la date de fin maximale de chaque sous-tableau. La question « qui est occupé
+entre A et B » se résout alors en O(log n + k) au lieu de parcourir toutes
+les prestations.
+
+Les bornes sont comparées à la demi-journée près, avec les conventions de
+creneaux.py (creneau_debut / creneau_fin) : l'index répond comme le calendrier
+de la flotte, une fin à minuit occupe la journée entière et une date saisie à
+la journée couvre le matin et l'après-midi.
+
+L'index est mis en cache par processus. Il est invalidé quand une transaction
+qui a écrit une Prestation ou les affectations d'un transporteur est validée
+(après le commit, pour qu'une reconstruction concurrente ne relise pas les
+anciennes données). Les autres workers ne sont pas prévenus : ils
+reconstruisent leur index au plus tard après DISPONIBILITE_CACHE_TTL
+secondes, qui borne donc le retard d'une réponse de disponibilité sur une
+réservation faite ailleurs.
+"""
+import threading
+import time
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Prestation, User, prestation_transporteurs
+from utils_modules.creneaux import creneau_debut, creneau_fin, debut_creneau
+from utils_modules.reponses import affectation_active
+
+# Durée de vie par défaut de l'index en secondes (retard maximal entre workers)
+CACHE_TTL_DEFAUT = 10
+
+# Sources de réservations possibles :
+# - 'prestation_transporteurs' : table d'association User <-> Prestation
+# - 'transporteur_id' : ancienne colonne Prestation.transporteur_id (modèle Transporteur)
+SOURCE_ASSOCIATION = 'prestation_transporteurs'
+SOURCE_TRANSPORTEUR_ID = 'transporteur_id'
+
+# Codes des cellules de la matrice transporteur × jour
+CELLULE_LIBRE = '0'
+CELLULE_RESERVEE = '1'
+CELLULE_MULTIPLE = '2'
+
+Reservation = namedtuple('Reservation', ['prestation_id', 'transporteur_id', 'debut', 'fin', 'type_demenagement'])
+
+
+class IndexDisponibilite:
+    """
+    Index d'intervalles statique sur les réservations des transporteurs.
+
+    Une réservation chevauche une période si leurs demi-journées se
+    recouvrent : premier créneau <= dernier créneau demandé et dernier
+    créneau >= premier créneau demandé (bornes incluses).
+    """
+
+    def __init__(self, reservations):
+        # (premier créneau, dernier créneau, réservation), sans les périodes inversées
+        creneaux = sorted(
+            (c for c in ((creneau_debut(r.debut), creneau_fin(r.fin), r) for r in reservations) if c[1] >= c[0]),
+            key=lambda c: (c[0], c[1])
+        )
+        self._reservations = [r for _, _, r in creneaux]
+        self._debuts = [i0 for i0, _, _ in creneaux]
+
+        # Arbre de segments (tableau implicite) des derniers créneaux maximaux
+        self._taille = 1
+        while self._taille < len(self._reservations):
+            self._taille *= 2
+        self._max_fin = [float('-inf')] * (2 * self._taille)
+        for i, (_, i1, _) in enumerate(creneaux):
+            self._max_fin[self._taille + i] = i1
+        for noeud in range(self._taille - 1, 0, -1):
+            self._max_fin[noeud] = max(self._max_fin[2 * noeud], self._max_fin[2 * noeud + 1])
+
+        # Réservations de chaque transporteur avec leurs créneaux, triées par date de début
+        self._par_transporteur = {}
+        for i0, i1, reservation in creneaux:
+            self._par_transporteur.setdefault(reservation.transporteur_id, []).append((i0, i1, reservation))
+
+    def __len__(self):
+        return len(self._reservations)
+
+    def chevauchements(self, debut, fin, exclure_prestation_id=None):
+        """
+        Retourne les réservations qui chevauchent la période [debut, fin].
+
+        Args:
+            debut: Début de la période (datetime)
+            fin: Fin de la période (datetime)
+            exclure_prestation_id: Prestation à ignorer (mode édition)
+
+        Returns:
+            list: Réservations triées par date de début
+        """
+        premier, dernier = creneau_debut(debut), creneau_fin(fin)
+        # Seules les réservations qui commencent avant la fin demandée sont candidates
+        borne = bisect_right(self._debuts, dernier)
+        if borne == 0:
+            return []
+
+        exclure = _normaliser_id(exclure_prestation_id)
+        resultats = []
+        pile = [(1, 0, self._taille)]
+        while pile:
+            noeud, gauche, droite = pile.pop()
+            # Sous-arbre hors du préfixe ou sans réservation se terminant après le début demandé
+            if gauche >= borne or self._max_fin[noeud] < premier:
+                continue
+            if noeud >= self._taille:
+                reservation = self._reservations[gauche]
+                if reservation.prestation_id != exclure:
+                    resultats.append(reservation)
+                continue
+            milieu = (gauche + droite) // 2
+            # Empiler la droite d'abord pour restituer l'ordre chronologique
+            pile.append((2 * noeud + 1, milieu, droite))
+            pile.append((2 * noeud, gauche, milieu))
+        return resultats
+
+    def transporteurs_occupes(self, debut, fin, exclure_prestation_id=None):
+        """Retourne l'ensemble des IDs de transporteurs occupés sur la période."""
+        return {r.transporteur_id for r in self.chevauchements(debut, fin, exclure_prestation_id)}
+
+    def reservations_par_transporteur(self, debut, fin, exclure_prestation_id=None):
+        """Regroupe par transporteur les réservations qui chevauchent la période."""
+        groupes = {}
+        for reservation in self.chevauchements(debut, fin, exclure_prestation_id):
+            groupes.setdefault(reservation.transporteur_id, []).append(reservation)
+        return groupes
+
+    def reservations_transporteur(self, transporteur_id):
+        """Retourne toutes les réservations d'un transporteur, triées par date de début."""
+        return [r for _, _, r in self._par_transporteur.get(transporteur_id, [])]
+
+    def est_disponible(self, transporteur_id, debut, fin, exclure_prestation_id=None):
+        """Vérifie si un transporteur n'a aucune réservation sur les demi-journées de la période."""
+        exclure = _normaliser_id(exclure_prestation_id)
+        premier, dernier = creneau_debut(debut), creneau_fin(fin)
+        return not any(
+            i0 <= dernier and i1 >= premier and r.prestation_id != exclure
+            for i0, i1, r in self._par_transporteur.get(transporteur_id, [])
+        )
+
+    def prochaine_disponibilite(self, transporteur_id, apres, duree=timedelta(0),
+                                exclure_prestation_id=None):
+        """
+        Trouve le premier créneau libre d'une durée donnée à partir d'une date.
+
+        Balaye les réservations du transporteur triées par date de début : tant
+        qu'une réservation chevauche le créneau candidat, le candidat est repoussé
+        à la demi-journée qui suit sa fin. Les trous entre deux réservations sont
+        donc pris en compte.
+
+        Args:
+            transporteur_id: ID du transporteur
+            apres: Date à partir de laquelle chercher (datetime)
+            duree: Écart entre début et fin du créneau recherché (timedelta,
+                0 pour une prestation sur une seule journée)
+            exclure_prestation_id: Prestation à ignorer (mode édition)
+
+        Returns:
+            datetime: Début du premier créneau libre (minuit, ou 13h s'il
+            commence l'après-midi)
+        """
+        exclure = _normaliser_id(exclure_prestation_id)
+        candidat = creneau_debut(apres)
+        # Nombre de demi-journées couvertes par le créneau recherché, moins une
+        longueur = creneau_fin(apres + duree) - candidat
+        for i0, i1, reservation in self._par_transporteur.get(transporteur_id, []):
+            if i1 < candidat or reservation.prestation_id == exclure:
+                continue
+            if i0 > candidat + longueur:
+                break
+            candidat = i1 + 1
+        return debut_creneau(candidat)
+
+    def prochaines_disponibilites(self, transporteur_ids, apres, duree=timedelta(0),
+                                  exclure_prestation_id=None):
+        """Calcule prochaine_disponibilite pour plusieurs transporteurs en une passe."""
+        return {
+            transporteur_id: self.prochaine_disponibilite(
+                transporteur_id, apres, duree, exclure_prestation_id
+            )
+            for transporteur_id in transporteur_ids
+        }
+
+
+def _normaliser_id(valeur):
+    """
+    Convertit un ID reçu d'un formulaire ou d'un JSON en entier (None si absent
+    ou non numérique, par exemple 'null' ou 'undefined' envoyés par le client).
+    """
+    try:
+        return int(valeur)
+    except (TypeError, ValueError):
+        return None
+
+
+def charger_reservations(source=SOURCE_ASSOCIATION, debut=None, fin=None):
+    """
+    Charge les réservations de transporteurs en une seule requête.
+
+    Args:
+        source: SOURCE_ASSOCIATION (utilisateurs transporteurs) ou
+            SOURCE_TRANSPORTEUR_ID (ancien modèle Transporteur)
+        debut: Si fourni avec fin, ne charge que les réservations qui
+            chevauchent [debut, fin]
+        fin: Fin de la période (voir debut)
+
+    Returns:
+        list: Liste de Reservation
+    """
+    if source == SOURCE_TRANSPORTEUR_ID:
+        query = db.session.query(
+            Prestation.id,
+            Prestation.transporteur_id,
+            Prestation.date_debut,
+            Prestation.date_fin,
+            Prestation.type_demenagement
+        ).filter(Prestation.transporteur_id.isnot(None))
+    else:
+        query = db.session.query(
+            prestation_transporteurs.c.prestation_id,
+            prestation_transporteurs.c.user_id,
+            Prestation.date_debut,
+            Prestation.date_fin,
+            Prestation.type_demenagement
+        ).join(Prestation, Prestation.id == prestation_transporteurs.c.prestation_id).filter(
+            affectation_active()
+        )
+
+    if debut is not None and fin is not None:
+        query = query.filter(Prestation.date_debut <= fin, Prestation.date_fin >= debut)
+
+    return [Reservation(*ligne) for ligne in query.all() if ligne[2] and ligne[3]]
+
+
+def matrice_disponibilite(transporteur_ids, debut, fin):
+    """
+    Construit la matrice transporteur × jour de la période [debut, fin].
+
+    Les réservations de la période sont chargées en une seule requête, puis un
+    balayage par transporteur (événements +1 au premier jour, -1 au lendemain
+    du dernier jour) donne le nombre de réservations actives chaque jour.
+
+    Args:
+        transporteur_ids: IDs des transporteurs (lignes de la matrice)
+        debut: Premier jour de la période (datetime)
+        fin: Dernier jour de la période (datetime)
+
+    Returns:
+        dict: {transporteur_id: {'cellules': str, 'reservations': list}} où
+            cellules contient un code par jour (CELLULE_LIBRE, CELLULE_RESERVEE,
+            CELLULE_MULTIPLE) et reservations des triplets
+            [prestation_id, premier_jour, dernier_jour] (indices dans la période)
+    """
+    premier_jour = debut.date()
+    nb_jours = (fin.date() - premier_jour).days + 1
+    lignes = {t_id: [] for t_id in transporteur_ids}
+
+    # Fin de la période incluse : une prestation qui commence dans la journée compte
+    fin_journee = datetime.combine(fin.date(), datetime.max.time())
+    for reservation in charger_reservations(debut=debut, fin=fin_journee):
+        if reservation.transporteur_id in lignes:
+            lignes[reservation.transporteur_id].append(reservation)
+
+    matrice = {}
+    for transporteur_id, reservations in lignes.items():
+        evenements = [0] * (nb_jours + 1)
+        segments = []
+        for reservation in reservations:
+            i0 = max((reservation.debut.date() - premier_jour).days, 0)
+            i1 = min((reservation.fin.date() - premier_jour).days, nb_jours - 1)
+            if i1 < i0:
+                continue
+            evenements[i0] += 1
+            evenements[i1 + 1] -= 1
+            segments.append([reservation.prestation_id, i0, i1])
+
+        cellules = []
+        actives = 0
+        for jour in range(nb_jours):
+            actives += evenements[jour]
+            cellules.append(CELLULE_LIBRE if actives == 0 else CELLULE_RESERVEE if actives == 1 else CELLULE_MULTIPLE)
+
+        segments.sort(key=lambda segment: (segment[1], segment[0]))
+        matrice[transporteur_id] = {'cellules': ''.join(cellules), 'reservations': segments}
+    return matrice
+
+
+_cache = {}
+_verrou = threading.Lock()
+# Incrémenté à chaque invalidation : un index construit pendant une invalidation n'est pas gardé
+_generation = 0
+
+
+def get_index_disponibilite(source=SOURCE_ASSOCIATION):
+    """
+    Retourne l'index de disponibilité en cache, en le reconstruisant si nécessaire.
+
+    Args:
+        source: Source des réservations (voir charger_reservations)
+
+    Returns:
+        IndexDisponibilite
+    """
+    ttl = current_app.config.get('DISPONIBILITE_CACHE_TTL', CACHE_TTL_DEFAUT)
+    maintenant = time.monotonic()
+
+    entree = _cache.get(source)
+    if entree and maintenant - entree[0] < ttl:
+        return entree[1]
+
+    with _verrou:
+        entree = _cache.get(source)
+        if entree and maintenant - entree[0] < ttl:
+            return entree[1]
+        generation = _generation
+        index = IndexDisponibilite(charger_reservations(source))
+        if generation == _generation:
+            _cache[source] = (time.monotonic(), index)
+        return index
+
+
+def invalider_index_disponibilite():
+    """Vide le cache de l'index ; il sera reconstruit à la prochaine demande."""
+    global _generation
+    _generation += 1
+    _cache.clear()
+
+
+@event.listens_for(Session, 'after_flush')
+def _marquer_apres_flush(session, flush_context):
+    """Note dans la session qu'une prestation ou les affectations d'un transporteur ont changé."""
+    if session.info.get('disponibilite_perimee'):
+        return
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        # Un User n'est concerné que si sa collection de prestations a été modifiée
+        # (les mises à jour de derniere_connexion ne doivent pas vider le cache)
+        if isinstance(obj, Prestation) or (
+            isinstance(obj, User) and inspect(obj).attrs.prestations.history.has_changes()
+        ):
+            session.info['disponibilite_perimee'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalider_apres_commit(session):
+    """Invalide l'index une fois les réservations modifiées visibles des autres connexions."""
+    if session.info.pop('disponibilite_perimee', False):
+        invalider_index_disponibilite()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _oublier_apres_rollback(session):
+    """Les écritures annulées ne changent pas les réservations."""
+    session.info.pop('disponibilite_perimee', None)
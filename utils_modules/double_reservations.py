@@ -0,0 +1,166 @@
+"""
+Détection des doubles réservations de transporteurs sur toute la flotte.
+
+Une double réservation est un transporteur affecté à deux prestations non
+archivées qui partagent au moins une demi-journée (mêmes conventions que le
+calendrier de creneaux.py). Les affectations faites sans vérification de
+disponibilité (par exemple /api/transporteurs/notifier) peuvent en créer.
+
+L'analyse lit toutes les affectations en une requête triée par transporteur
+puis par début, et balaie chaque transporteur avec un tas des réservations en
+cours : O(n log n + k) pour n affectations et k conflits, au lieu d'une
+comparaison deux à deux.
+
+Le mode incrémental ne vérifie que les transporteurs des prestations créées
+ou modifiées depuis une date donnée, et ne retient que les conflits qui
+impliquent l'une de ces prestations.
+"""
+import heapq
+import json
+import os
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Prestation, prestation_transporteurs
+from utils_modules.creneaux import creneau_debut, creneau_fin
+from utils_modules.reponses import affectation_active
+
+FICHIER_DERNIERE_ANALYSE = 'double_reservations.json'
+
+Conflit = namedtuple('Conflit', [
+    'transporteur_id', 'prestation_id', 'autre_prestation_id', 'debut', 'fin'
+])
+
+
+def _requete_affectations():
+    """Affectations non refusées des prestations non archivées, triées pour le balayage."""
+    return db.session.query(
+        prestation_transporteurs.c.user_id,
+        Prestation.id,
+        Prestation.date_debut,
+        Prestation.date_fin
+    ).join(Prestation, Prestation.id == prestation_transporteurs.c.prestation_id).filter(
+        affectation_active(),
+        Prestation.archive.isnot(True),
+        Prestation.date_debut.isnot(None),
+        Prestation.date_fin.isnot(None)
+    ).order_by(
+        prestation_transporteurs.c.user_id, Prestation.date_debut, Prestation.date_fin, Prestation.id
+    )
+
+
+def balayer(affectations, prestations_cibles=None):
+    """
+    Balaye des affectations triées par (transporteur, début) et retourne les conflits.
+
+    Args:
+        affectations: Itérable de (transporteur_id, prestation_id, date_debut, date_fin)
+        prestations_cibles: Si renseigné, ne garder que les conflits impliquant ces prestations
+
+    Returns:
+        list: Conflit pour chaque paire de prestations qui se chevauchent chez un même transporteur
+    """
+    conflits = []
+    transporteur_courant = None
+    en_cours = []  # tas de (dernier créneau, prestation_id, date_debut, date_fin)
+    for transporteur_id, prestation_id, date_debut, date_fin in affectations:
+        if transporteur_id != transporteur_courant:
+            transporteur_courant = transporteur_id
+            en_cours = []
+
+        i0 = creneau_debut(date_debut)
+        i1 = creneau_fin(date_fin)
+        # Retirer les réservations terminées avant le début de celle-ci
+        while en_cours and en_cours[0][0] < i0:
+            heapq.heappop(en_cours)
+
+        # Toutes les réservations restantes chevauchent la réservation courante
+        for _, autre_id, autre_debut, autre_fin in en_cours:
+            if autre_id == prestation_id:
+                continue
+            if prestations_cibles is not None and prestation_id not in prestations_cibles \
+                    and autre_id not in prestations_cibles:
+                continue
+            conflits.append(Conflit(
+                transporteur_id, autre_id, prestation_id,
+                max(date_debut, autre_debut), min(date_fin, autre_fin)
+            ))
+
+        heapq.heappush(en_cours, (i1, prestation_id, date_debut, date_fin))
+    return conflits
+
+
+def detecter_doubles_reservations(depuis=None):
+    """
+    Recherche les doubles réservations de la flotte.
+
+    Args:
+        depuis: datetime ; si renseigné, mode incrémental limité aux prestations
+            créées ou modifiées après cette date
+
+    Returns:
+        list: Conflit triés par transporteur puis par date
+    """
+    query = _requete_affectations()
+    prestations_cibles = None
+    if depuis is not None:
+        modifiees = db.session.query(
+            prestation_transporteurs.c.user_id, Prestation.id
+        ).join(Prestation, Prestation.id == prestation_transporteurs.c.prestation_id).filter(
+            affectation_active(),
+            func.coalesce(Prestation.date_modification, Prestation.date_creation) > depuis
+        ).all()
+        if not modifiees:
+            return []
+        prestations_cibles = {prestation_id for _, prestation_id in modifiees}
+        query = query.filter(
+            prestation_transporteurs.c.user_id.in_({user_id for user_id, _ in modifiees})
+        )
+
+    return balayer(query.yield_per(5000), prestations_cibles)
+
+
+def _chemin_derniere_analyse():
+    return os.path.join(current_app.instance_path, FICHIER_DERNIERE_ANALYSE)
+
+
+def lire_derniere_analyse():
+    """Date de la dernière analyse enregistrée (None si aucune)."""
+    try:
+        with open(_chemin_derniere_analyse(), encoding='utf-8') as fichier:
+            return datetime.fromisoformat(json.load(fichier)['derniere_analyse'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def enregistrer_derniere_analyse(date_analyse):
+    """Enregistre la date de l'analyse pour le prochain passage incrémental."""
+    os.makedirs(current_app.instance_path, exist_ok=True)
+    with open(_chemin_derniere_analyse(), 'w', encoding='utf-8') as fichier:
+        json.dump({'derniere_analyse': date_analyse.isoformat()}, fichier)
+
+
+@event.listens_for(Session, 'before_flush')
+def _horodater_prestations_modifiees(session, flush_context, instances):
+    """
+    Met à jour date_modification quand les dates, l'archivage ou les
+    transporteurs d'une prestation changent, pour que le mode incrémental les
+    retrouve (les changements d'affectation seuls ne modifient pas la ligne
+    prestation).
+    """
+    for obj in session.dirty:
+        if not isinstance(obj, Prestation):
+            continue
+        etat = inspect(obj)
+        if etat.attrs.date_modification.history.has_changes():
+            continue
+        if (etat.attrs.transporteurs.history.has_changes()
+                or etat.attrs.archive.history.has_changes()
+                or etat.attrs.date_debut.history.has_changes()
+                or etat.attrs.date_fin.history.has_changes()):
+            obj.date_modification = datetime.utcnow()
@@ -0,0 +1,155 @@
+"""
+Journal des événements des prestations (table prestation_event).
+
+Les réponses des transporteurs et les assignations étaient ajoutées au
+texte `observations` de la prestation, réécrit en entier à chaque réponse.
+Elles sont désormais des lignes du journal (type, auteur, date, données
+JSON), insérées par lot au flush, dans la transaction de la modification :
+la chronologie est paginée et les événements se cherchent par type et par
+période sans analyser de texte.
+
+Les templates qui affichent `observations` utilisent projeter_observations(),
+qui ajoute au texte saisi (et aux anciennes réponses qu'il contient) les
+événements du journal, mis en forme comme avant.
+"""
+import json
+from datetime import datetime
+
+from extensions import db
+from models import PrestationEvenement, User
+from utils_modules.pagination import paginer_keyset
+
+TYPES = ('acceptation', 'refus', 'assignation')
+
+
+def journaliser(prestation_id, type_evenement, acteur_id=None, **donnees):
+    """
+    Ajoute un événement à la session ; il est inséré au prochain flush, en un
+    seul INSERT avec les autres événements de la transaction.
+
+    Args:
+        prestation_id: Prestation concernée
+        type_evenement: Type (voir TYPES)
+        acteur_id: Utilisateur à l'origine de l'événement
+        donnees: Données propres au type (commentaire, raison, transporteur_id...)
+    """
+    donnees = {cle: valeur for cle, valeur in donnees.items() if valeur is not None}
+    evenement = PrestationEvenement(
+        prestation_id=prestation_id,
+        type=type_evenement,
+        acteur_id=acteur_id,
+        date=datetime.utcnow(),
+        donnees=json.dumps(donnees, ensure_ascii=False) if donnees else None
+    )
+    db.session.add(evenement)
+    return evenement
+
+
+def journaliser_lot(evenements):
+    """
+    Insère des événements en une requête (executemany), par exemple pour une
+    opération en masse.
+
+    Args:
+        evenements: Itérable de (prestation_id, type, acteur_id, données dict ou None)
+
+    Returns:
+        int: Nombre d'événements insérés
+    """
+    maintenant = datetime.utcnow()
+    lignes = [{
+        'prestation_id': prestation_id,
+        'type': type_evenement,
+        'acteur_id': acteur_id,
+        'date': maintenant,
+        'donnees': json.dumps(donnees, ensure_ascii=False) if donnees else None
+    } for prestation_id, type_evenement, acteur_id, donnees in evenements]
+    if lignes:
+        db.session.execute(PrestationEvenement.__table__.insert(), lignes)
+    return len(lignes)
+
+
+def requete_evenements(prestation_id=None, types=None, depuis=None, jusqu_a=None):
+    """
+    Événements filtrés, auteur chargé dans la même requête.
+
+    Args:
+        prestation_id: Événements d'une prestation
+        types: Liste de types (ex : ['refus'])
+        depuis, jusqu_a: Bornes de date (datetime, jusqu_a exclue)
+    """
+    query = PrestationEvenement.query.options(db.joinedload(PrestationEvenement.acteur))
+    if prestation_id is not None:
+        query = query.filter(PrestationEvenement.prestation_id == prestation_id)
+    if types:
+        query = query.filter(PrestationEvenement.type.in_(types))
+    if depuis is not None:
+        query = query.filter(PrestationEvenement.date >= depuis)
+    if jusqu_a is not None:
+        query = query.filter(PrestationEvenement.date < jusqu_a)
+    return query
+
+
+def page_evenements(query, apres=None, avant=None, par_page=50):
+    """Page de la chronologie, les plus récents d'abord (curseur sur (date, id))."""
+    return paginer_keyset(query, PrestationEvenement.date, PrestationEvenement.id,
+                          apres=apres, avant=avant, par_page=par_page)
+
+
+def _nom(utilisateur):
+    return f"{utilisateur.prenom} {utilisateur.nom}" if utilisateur else 'inconnu'
+
+
+def texte_evenement(evenement, acteur=None):
+    """Ligne d'observations d'un événement, au format des anciennes observations."""
+    donnees = json.loads(evenement.donnees) if evenement.donnees else {}
+    date = evenement.date.strftime('%d/%m/%Y %H:%M')
+    if evenement.type == 'acceptation':
+        texte = f"Accepté par transporteur {_nom(acteur)} le {date}"
+        commentaire = donnees.get('commentaire')
+        return f"{texte} :\n{commentaire}" if commentaire else texte
+    if evenement.type == 'refus':
+        texte = f"Refusé par transporteur {_nom(acteur)} le {date}"
+        raison = donnees.get('raison')
+        return f"{texte} :\n{raison}" if raison else texte
+    if evenement.type == 'assignation':
+        return f"[{date}] Transporteur {donnees.get('transporteur', '')} assigné par {_nom(acteur)}"
+    return f"[{date}] {evenement.type}"
+
+
+def evenement_en_dict(evenement):
+    """Représentation JSON d'un événement (auteur chargé)."""
+    return {
+        'id': evenement.id,
+        'prestation_id': evenement.prestation_id,
+        'type': evenement.type,
+        'acteur_id': evenement.acteur_id,
+        'acteur': _nom(evenement.acteur) if evenement.acteur_id else None,
+        'date': evenement.date.isoformat(),
+        'donnees': json.loads(evenement.donnees) if evenement.donnees else {},
+        'texte': texte_evenement(evenement, evenement.acteur)
+    }
+
+
+def projeter_observations(prestations):
+    """
+    Observations telles que les affichaient les templates : texte saisi puis
+    événements du journal, pour plusieurs prestations en une requête.
+
+    Args:
+        prestations: Prestations dont `observations` est chargé (colonne différée)
+
+    Returns:
+        dict: {prestation_id: texte}
+    """
+    textes = {p.id: [p.observations] if p.observations else [] for p in prestations}
+    if not textes:
+        return {}
+    lignes = db.session.query(PrestationEvenement, User).outerjoin(
+        User, PrestationEvenement.acteur_id == User.id
+    ).filter(
+        PrestationEvenement.prestation_id.in_(list(textes))
+    ).order_by(PrestationEvenement.prestation_id, PrestationEvenement.date, PrestationEvenement.id)
+    for evenement, acteur in lignes:
+        textes[evenement.prestation_id].append(texte_evenement(evenement, acteur))
+    return {prestation_id: '\n\n'.join(parties) for prestation_id, parties in textes.items()}
@@ -0,0 +1,206 @@
+"""
+Flux iCalendar (.ics) des prestations d'un transporteur.
+
+Les applications de calendrier interrogent ces flux toutes les quelques
+minutes. Pour qu'un appel sans changement ne coûte presque rien :
+- l'ETag est calculé à partir d'une seule requête légère (identifiant,
+  version et statut du transporteur de chaque affectation), ce qui permet de
+  répondre 304 sans rien générer ;
+- le bloc VEVENT de chaque prestation est mis en cache avec sa version
+  (date de modification) et invalidé quand la prestation est modifiée ; seul
+  le statut propre au transporteur est ajouté à chaque génération.
+"""
+import hashlib
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, joinedload
+
+from extensions import db
+from models import Prestation, prestation_transporteurs
+
+PRODID = '-//Cavalier//Prestations transporteur//FR'
+TAILLE_MAX_CACHE = 5000
+
+# Statut de l'événement selon la réponse du transporteur
+STATUTS_VEVENT = {
+    'accepte': 'CONFIRMED',
+    'en_attente': 'TENTATIVE',
+    'refuse': 'CANCELLED'
+}
+
+_cache = {}
+_verrou = threading.Lock()
+
+
+def echapper(texte):
+    """Échappe un texte pour une valeur iCalendar (RFC 5545 §3.3.11)."""
+    return (
+        (texte or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+
+def plier(ligne):
+    """Plie une ligne à 75 octets (RFC 5545 §3.1) et ajoute la fin de ligne CRLF."""
+    octets = ligne.encode('utf-8')
+    if len(octets) <= 75:
+        return ligne + '\r\n'
+    morceaux = []
+    courant = ''
+    taille = 0
+    limite = 75
+    for caractere in ligne:
+        taille_caractere = len(caractere.encode('utf-8'))
+        if taille + taille_caractere > limite:
+            morceaux.append(courant)
+            courant = ''
+            taille = 0
+            limite = 74  # l'espace de continuation compte
+        courant += caractere
+        taille += taille_caractere
+    morceaux.append(courant)
+    return '\r\n '.join(morceaux) + '\r\n'
+
+
+def _dates_vevent(date_debut, date_fin):
+    """
+    Lignes DTSTART/DTEND : journées entières si les deux dates sont à minuit
+    (DTEND exclusif, au lendemain du dernier jour), sinon heures locales, une
+    fin à minuit couvrant alors toute la dernière journée.
+    """
+    if date_debut.time() == date_fin.time() == datetime.min.time():
+        return (
+            f'DTSTART;VALUE=DATE:{date_debut:%Y%m%d}',
+            f'DTEND;VALUE=DATE:{date_fin + timedelta(days=1):%Y%m%d}'
+        )
+    if date_fin.time() == datetime.min.time():
+        date_fin += timedelta(days=1)
+    return f'DTSTART:{date_debut:%Y%m%dT%H%M%S}', f'DTEND:{date_fin:%Y%m%dT%H%M%S}'
+
+
+def _version(date_modification, date_creation):
+    return date_modification or date_creation
+
+
+def rendre_vevent(prestation):
+    """Lignes communes du VEVENT d'une prestation (sans le statut du transporteur ni END)."""
+    client = prestation.client_principal
+    nom_client = f'{client.nom} {client.prenom}' if client else 'Sans client'
+    version = _version(prestation.date_modification, prestation.date_creation)
+    dtstart, dtend = _dates_vevent(prestation.date_debut, prestation.date_fin)
+
+    description = (
+        f"Client: {nom_client}\n"
+        f"Départ: {prestation.adresse_depart}\n"
+        f"Arrivée: {prestation.adresse_arrivee}\n"
+        f"Statut: {prestation.statut}"
+    )
+    lignes = [
+        'BEGIN:VEVENT',
+        f'UID:prestation-{prestation.id}@cavalier',
+        f'DTSTAMP:{version:%Y%m%dT%H%M%SZ}',
+        f'LAST-MODIFIED:{version:%Y%m%dT%H%M%SZ}',
+        dtstart,
+        dtend,
+        f'SUMMARY:{echapper(f"{prestation.type_demenagement} - {nom_client}")}',
+        f'LOCATION:{echapper(prestation.adresse_depart)}',
+        f'DESCRIPTION:{echapper(description)}',
+    ]
+    return ''.join(plier(ligne) for ligne in lignes)
+
+
+def _affectations(transporteur_id, depuis):
+    """Affectations du transporteur : (prestation_id, statut transporteur, version) triées."""
+    return db.session.query(
+        Prestation.id,
+        prestation_transporteurs.c.statut,
+        func.coalesce(Prestation.date_modification, Prestation.date_creation)
+    ).join(
+        prestation_transporteurs, prestation_transporteurs.c.prestation_id == Prestation.id
+    ).filter(
+        prestation_transporteurs.c.user_id == transporteur_id,
+        Prestation.archive.isnot(True),
+        Prestation.date_fin >= depuis
+    ).order_by(Prestation.date_debut, Prestation.id).all()
+
+
+def etag_flux(affectations):
+    """ETag du flux à partir des affectations (sans générer les événements)."""
+    empreinte = hashlib.sha1()
+    for prestation_id, statut, version in affectations:
+        empreinte.update(f'{prestation_id}:{statut}:{version}|'.encode('utf-8'))
+    return empreinte.hexdigest()
+
+
+def preparer_flux(transporteur, historique_jours=90):
+    """
+    Retourne l'ETag et une fonction générant le flux .ics du transporteur.
+
+    Le flux n'est généré que si l'appelant en a besoin (ETag différent).
+
+    Returns:
+        tuple: (etag, generer) où generer() retourne le texte du calendrier
+    """
+    depuis = datetime.now() - timedelta(days=historique_jours)
+    affectations = _affectations(transporteur.id, depuis)
+    etag = etag_flux(affectations)
+
+    def generer():
+        blocs = _blocs_vevent(affectations)
+        parties = [
+            'BEGIN:VCALENDAR\r\n',
+            'VERSION:2.0\r\n',
+            plier(f'PRODID:{PRODID}'),
+            'CALSCALE:GREGORIAN\r\n',
+            plier(f'X-WR-CALNAME:{echapper(f"Prestations {transporteur.prenom} {transporteur.nom}")}'),
+        ]
+        for prestation_id, statut, _ in affectations:
+            if prestation_id not in blocs:
+                continue  # supprimée entre les deux requêtes
+            parties.append(blocs[prestation_id])
+            parties.append(f'STATUS:{STATUTS_VEVENT.get(statut, "TENTATIVE")}\r\n')
+            parties.append('END:VEVENT\r\n')
+        parties.append('END:VCALENDAR\r\n')
+        return ''.join(parties)
+
+    return etag, generer
+
+
+def _blocs_vevent(affectations):
+    """Blocs VEVENT en cache, les prestations manquantes ou modifiées étant rendues en une requête."""
+    blocs = {}
+    manquantes = []
+    with _verrou:
+        for prestation_id, _, version in affectations:
+            entree = _cache.get(prestation_id)
+            if entree is not None and entree[0] == version:
+                blocs[prestation_id] = entree[1]
+            else:
+                manquantes.append(prestation_id)
+
+    if manquantes:
+        prestations = Prestation.query.options(joinedload(Prestation.client_principal)).filter(
+            Prestation.id.in_(manquantes)
+        ).all()
+        rendus = {
+            p.id: (_version(p.date_modification, p.date_creation), rendre_vevent(p)) for p in prestations
+        }
+        with _verrou:
+            if len(_cache) + len(rendus) > TAILLE_MAX_CACHE:
+                _cache.clear()
+            _cache.update(rendus)
+        blocs.update({prestation_id: bloc for prestation_id, (_, bloc) in rendus.items()})
+    return blocs
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalider_vevents(session, flush_context):
+    """Retire du cache les prestations modifiées ou supprimées."""
+    if not _cache:
+        return
+    with _verrou:
+        for obj in list(session.dirty) + list(session.deleted):
+            if isinstance(obj, Prestation):
+                _cache.pop(obj.id, None)
@@ -0,0 +1,114 @@
+"""
+Pagination par curseur (keyset) pour les listes longues.
+
+Au lieu de OFFSET, dont le coût croît avec le numéro de page, chaque page
+part de la dernière ligne affichée : le curseur encode la valeur de la
+colonne de tri et l'id de cette ligne (l'id départage les valeurs égales),
+et la page suivante filtre « (tri, id) strictement après le curseur ».
+Avec un index sur la colonne de tri, une page profonde coûte autant que la
+première.
+
+Le nombre total de lignes n'est calculé que sur la première page, plafonné
+(COUNT sur une sous-requête limitée) ; il est ensuite transmis dans les
+liens de navigation.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import and_, func, or_
+
+from extensions import db
+
+PLAFOND_COMPTAGE = 1000
+PAR_PAGE_MAX = 100
+
+PageCurseur = namedtuple('PageCurseur', ['items', 'curseur_suivant', 'curseur_precedent', 'par_page'])
+
+
+def encoder_curseur(valeur, objet_id):
+    """Curseur texte d'une ligne : '<valeur de tri ISO>_<id>'."""
+    return f'{valeur.isoformat()}_{objet_id}'
+
+
+def decoder_curseur(curseur):
+    """
+    Valeur de tri (datetime) et id d'un curseur.
+
+    Raises:
+        ValueError: si le curseur est invalide
+    """
+    valeur, _, objet_id = (curseur or '').rpartition('_')
+    return datetime.fromisoformat(valeur), int(objet_id)
+
+
+def _apres(colonne, colonne_id, valeur, objet_id, descendant):
+    """Lignes strictement après (valeur, id) dans l'ordre de tri."""
+    if descendant:
+        return or_(colonne < valeur, and_(colonne == valeur, colonne_id < objet_id))
+    return or_(colonne > valeur, and_(colonne == valeur, colonne_id > objet_id))
+
+
+def paginer_keyset(query, colonne, colonne_id, apres=None, avant=None, par_page=20, descendant=True):
+    """
+    Page de `query` triée sur (colonne, colonne_id).
+
+    Args:
+        query: Requête filtrée, sans ORDER BY
+        colonne: Colonne de tri (non nulle)
+        colonne_id: Clé primaire, pour départager les valeurs égales
+        apres: Curseur de la dernière ligne de la page précédente (page suivante)
+        avant: Curseur de la première ligne de la page suivante (page précédente)
+        par_page: Nombre de lignes par page (borné à PAR_PAGE_MAX)
+        descendant: Ordre décroissant (les plus récents d'abord)
+
+    Returns:
+        PageCurseur: items et curseurs des pages voisines (None s'il n'y en a pas)
+
+    Raises:
+        ValueError: si un curseur est invalide
+    """
+    par_page = min(max(par_page, 1), PAR_PAGE_MAX)
+    if avant:
+        # Page précédente : on parcourt dans l'ordre inverse puis on remet les lignes dans l'ordre
+        valeur, objet_id = decoder_curseur(avant)
+        query = query.filter(_apres(colonne, colonne_id, valeur, objet_id, not descendant))
+        ordre = (colonne.asc(), colonne_id.asc()) if descendant else (colonne.desc(), colonne_id.desc())
+    else:
+        if apres:
+            valeur, objet_id = decoder_curseur(apres)
+            query = query.filter(_apres(colonne, colonne_id, valeur, objet_id, descendant))
+        ordre = (colonne.desc(), colonne_id.desc()) if descendant else (colonne.asc(), colonne_id.asc())
+
+    # Une ligne de plus pour savoir s'il existe une page au-delà
+    lignes = query.order_by(*ordre).limit(par_page + 1).all()
+    encore = len(lignes) > par_page
+    lignes = lignes[:par_page]
+    if avant:
+        lignes.reverse()
+
+    def curseur(ligne):
+        return encoder_curseur(getattr(ligne, colonne.key), getattr(ligne, colonne_id.key))
+
+    if not lignes:
+        return PageCurseur([], None, None, par_page)
+    if avant:
+        suivant = curseur(lignes[-1])
+        precedent = curseur(lignes[0]) if encore else None
+    else:
+        suivant = curseur(lignes[-1]) if encore else None
+        precedent = curseur(lignes[0]) if apres else None
+    return PageCurseur(lignes, suivant, precedent, par_page)
+
+
+def compter_plafonne(query, colonne_id, plafond=PLAFOND_COMPTAGE):
+    """
+    Nombre de lignes de la requête, plafonné.
+
+    Returns:
+        tuple: (nombre, exact) ; exact vaut False si le plafond est atteint
+    """
+    sous_requete = query.with_entities(colonne_id).order_by(None).limit(plafond + 1).subquery()
+    nombre = db.session.query(func.count()).select_from(sous_requete).scalar()
+    if nombre > plafond:
+        return plafond, False
+    return nombre, True
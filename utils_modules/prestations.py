@@ -0,0 +1,332 @@
+"""
+Liste des prestations : filtres SQL communs à la liste (prestation.index) et
+aux opérations en masse (archivage, changement de statut, réaffectation).
+
+Une opération en masse porte sur une liste d'identifiants ou sur les filtres
+de la liste. Les droits sont une condition de la requête (un commercial ne
+modifie que ses prestations) : les prestations sélectionnées sont comptées,
+verrouillées et modifiées par des UPDATE ensemblistes, dans une seule
+transaction. Un mode simulation (dry_run) retourne le même rapport sans rien
+écrire.
+
+Ces UPDATE contournent les écouteurs de flush : l'historique des versions,
+les agrégats journaliers, le journal des événements et les caches touchés
+sont mis à jour explicitement.
+"""
+from collections import defaultdict
+from datetime import datetime
+from types import SimpleNamespace
+
+from sqlalchemy import and_, case, delete, func, or_, select, true, update
+
+from extensions import db
+from models import Client, Prestation, User, prestation_transporteurs
+from utils import notifier_transporteurs_lot
+from utils_modules.calendrier import tracer_retraits
+from utils_modules.creneaux import get_calendrier_flotte, marquer_perimes
+from utils_modules.disponibilite import invalider_index_disponibilite
+from utils_modules.evenements import journaliser_lot
+from utils_modules.recherche import ids_correspondants
+from utils_modules.statistiques import invalider_statistiques
+from utils_modules.stats_journalieres import CHAMPS_SUIVIS, appliquer_deltas, contributions
+from utils_modules.versions import enregistrer_versions
+
+OPERATIONS = ('archiver', 'statut', 'reaffecter')
+STATUTS = ('En attente', 'Confirmée', 'En cours', 'Terminée', 'Annulée')
+# Nombre d'identifiants renvoyés dans le rapport
+APERCU = 100
+
+
+class ErreurOperation(ValueError):
+    """Paramètre d'une opération en masse invalide (sélection, statut, transporteur)."""
+
+
+def conditions_filtre(texte='', archives=False):
+    """
+    Conditions SQL des filtres de la liste des prestations.
+
+    Args:
+        texte: Recherche (index plein texte si disponible, sinon sous-chaîne)
+        archives: True pour inclure les prestations archivées
+    """
+    conditions = []
+    if not archives:
+        conditions.append(Prestation.archive.is_(False))
+    if texte:
+        # Index plein texte si disponible (le nom du client y est indexé avec la prestation)
+        ids = ids_correspondants('prestation', texte)
+        if ids is not None:
+            conditions.append(Prestation.id.in_(ids))
+        else:
+            search = f"%{texte}%"
+            clients = select(Client.id).where(or_(Client.nom.ilike(search), Client.prenom.ilike(search)))
+            conditions.append(or_(
+                Prestation.adresse_depart.ilike(search),
+                Prestation.adresse_arrivee.ilike(search),
+                Prestation.type_demenagement.ilike(search),
+                Prestation.tags.ilike(search),
+                Prestation.client_id.in_(clients)
+            ))
+    return conditions
+
+
+def condition_visibilite(utilisateur):
+    """Prestations visibles dans la liste par l'utilisateur (None : toutes)."""
+    if utilisateur.role == 'transporteur':
+        return Prestation.transporteurs.any(id=utilisateur.id)
+    if utilisateur.role == 'commercial' and not utilisateur.is_admin() and utilisateur.id != 1:
+        return Prestation.commercial_id == utilisateur.id
+    return None
+
+
+def condition_portee(utilisateur):
+    """Prestations modifiables en masse par l'utilisateur (None : aucune)."""
+    if utilisateur.is_admin():
+        return true()
+    if utilisateur.role == 'commercial':
+        return Prestation.commercial_id == utilisateur.id
+    return None
+
+
+def conditions_selection(ids=None, filtre=None):
+    """
+    Conditions SQL d'une sélection : liste d'identifiants, ou filtres de la
+    liste ({'query': texte, 'archives': bool}).
+
+    Raises:
+        ErreurOperation: ni identifiants ni filtre, ou identifiants invalides
+    """
+    if ids is not None:
+        try:
+            ids = {int(i) for i in ids}
+        except (TypeError, ValueError):
+            raise ErreurOperation("Identifiants de prestation invalides")
+        return [Prestation.id.in_(ids)]
+    if filtre is not None:
+        return conditions_filtre(filtre.get('query') or '', bool(filtre.get('archives')))
+    raise ErreurOperation("Sélection manquante : indiquer des identifiants (ids) ou un filtre")
+
+
+def _compter(selection, portee, a_modifier):
+    """Sélectionnées, hors de la portée de l'utilisateur et déjà dans l'état voulu, en une requête."""
+    total, autorisees, modifiables = db.session.execute(
+        select(
+            func.count(Prestation.id),
+            func.coalesce(func.sum(case((portee, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((and_(portee, a_modifier), 1), else_=0)), 0)
+        ).where(*selection)
+    ).one()
+    return {
+        'selectionnees': total,
+        'non_autorisees': total - autorisees,
+        'inchangees': autorisees - modifiables
+    }
+
+
+def _lignes(colonnes, conditions):
+    """Lignes à modifier, verrouillées jusqu'à la fin de la transaction (sauf SQLite)."""
+    return db.session.execute(
+        select(Prestation.id, *colonnes).where(*conditions).order_by(Prestation.id).with_for_update()
+    ).all()
+
+
+def _affectations(prestation_ids, exclure_refus=False):
+    """Transporteurs affectés : {prestation_id: [user_id, ...]} triés."""
+    requete = select(prestation_transporteurs.c.prestation_id, prestation_transporteurs.c.user_id).where(
+        prestation_transporteurs.c.prestation_id.in_(prestation_ids)
+    ).order_by(prestation_transporteurs.c.user_id)
+    if exclure_refus:
+        requete = requete.where(or_(prestation_transporteurs.c.statut.is_(None),
+                                    prestation_transporteurs.c.statut != 'refuse'))
+    affectations = defaultdict(list)
+    for prestation_id, user_id in db.session.execute(requete):
+        affectations[prestation_id].append(user_id)
+    return affectations
+
+
+def _notifier(affectations, type_notification):
+    """Notifications des transporteurs {prestation_id: [user_id]} (ajoutées à la transaction)."""
+    if not affectations:
+        return 0
+    prestations = Prestation.query.options(db.joinedload(Prestation.client_principal)).filter(
+        Prestation.id.in_(list(affectations))
+    ).all()
+    notifier_transporteurs_lot([(p, affectations[p.id]) for p in prestations], type_notification, commit=False)
+    return sum(len(ids) for ids in affectations.values())
+
+
+def _archiver(rapport, conditions, portee, utilisateur, parametres, dry_run):
+    archive = bool(parametres.get('archive', True))
+    a_modifier = Prestation.archive.isnot(archive)
+    rapport.update(_compter(conditions, portee, a_modifier))
+    ids = [ligne.id for ligne in _lignes((), conditions + [portee, a_modifier])]
+    rapport.update(archive=archive, modifiees=len(ids), ids=ids[:APERCU], notifications=0)
+    if dry_run or not ids:
+        return
+
+    rapport['modifiees'] = db.session.execute(
+        update(Prestation).where(*conditions, portee, a_modifier).values(
+            archive=archive, date_modification=datetime.utcnow(), modificateur_id=utilisateur.id
+        ).execution_options(synchronize_session=False)
+    ).rowcount
+    enregistrer_versions(db.session.connection(), {i: {'archive': archive} for i in ids}, utilisateur.id)
+
+
+def _changer_statut(rapport, conditions, portee, utilisateur, parametres, dry_run):
+    statut = parametres.get('statut')
+    if statut not in STATUTS:
+        raise ErreurOperation(f"Statut invalide (statuts : {', '.join(STATUTS)})")
+    a_modifier = or_(Prestation.statut.is_(None), Prestation.statut != statut)
+    rapport.update(_compter(conditions, portee, a_modifier))
+
+    champs = CHAMPS_SUIVIS[Prestation]
+    lignes = _lignes([getattr(Prestation, champ) for champ in champs],
+                     conditions + [portee, a_modifier])
+    ids = [ligne.id for ligne in lignes]
+    repartition = defaultdict(int)
+    for ligne in lignes:
+        repartition[ligne.statut or ''] += 1
+    # Transporteurs prévenus : ceux qui n'ont pas refusé la prestation
+    destinataires = _affectations(ids, exclure_refus=True) if ids else {}
+    rapport.update(statut=statut, modifiees=len(ids), ids=ids[:APERCU], repartition=dict(repartition),
+                   notifications=sum(len(t) for t in destinataires.values()))
+    if dry_run or not ids:
+        return
+
+    rapport['modifiees'] = db.session.execute(
+        update(Prestation).where(*conditions, portee, a_modifier).values(
+            statut=statut, date_modification=datetime.utcnow(), modificateur_id=utilisateur.id
+        ).execution_options(synchronize_session=False)
+    ).rowcount
+
+    connexion = db.session.connection()
+    deltas = defaultdict(float)
+    for ligne in lignes:
+        avant = SimpleNamespace(**{champ: getattr(ligne, champ) for champ in champs})
+        apres = SimpleNamespace(**{**vars(avant), 'statut': statut})
+        for cle, valeur in contributions(Prestation, avant).items():
+            deltas[cle] -= valeur
+        for cle, valeur in contributions(Prestation, apres).items():
+            deltas[cle] += valeur
+    appliquer_deltas(connexion, deltas)
+    enregistrer_versions(connexion, {i: {'statut': statut} for i in ids}, utilisateur.id)
+    _notifier(destinataires, 'annulation' if statut == 'Annulée' else 'modification')
+
+
+def _reaffecter(rapport, conditions, portee, utilisateur, parametres, dry_run):
+    try:
+        de, vers = int(parametres.get('de')), int(parametres.get('vers'))
+    except (TypeError, ValueError):
+        raise ErreurOperation("Transporteurs manquants : indiquer de et vers")
+    if de == vers:
+        raise ErreurOperation("Les transporteurs de et vers doivent être différents")
+    nouveau = User.query.filter_by(id=vers, role='transporteur').first()
+    if nouveau is None:
+        raise ErreurOperation("Transporteur de destination introuvable")
+
+    a_modifier = Prestation.transporteurs.any(User.id == de)
+    rapport.update(_compter(conditions, portee, a_modifier))
+    lignes = _lignes(
+        [Prestation.date_debut, Prestation.date_fin, Prestation.transporteurs.any(User.id == vers).label('doublon')],
+        conditions + [portee, a_modifier]
+    )
+    ids = [ligne.id for ligne in lignes]
+    # Prestations où vers est déjà affecté : l'affectation de de est seulement retirée
+    doublons = [ligne.id for ligne in lignes if ligne.doublon]
+    deplacees = [ligne.id for ligne in lignes if not ligne.doublon]
+    calendrier = get_calendrier_flotte()
+    conflits = [
+        ligne.id for ligne in lignes
+        if not ligne.doublon and ligne.date_debut and ligne.date_fin
+        and not calendrier.est_libre(vers, ligne.date_debut, ligne.date_fin, exclure_prestation_id=ligne.id)
+    ]
+    rapport.update(de=de, vers=vers, modifiees=len(ids), ids=ids[:APERCU], doublons=len(doublons),
+                   conflits=conflits[:APERCU], notifications=len(deplacees))
+    if dry_run or not ids:
+        return
+
+    maintenant = datetime.utcnow()
+    if deplacees:
+        db.session.execute(
+            update(prestation_transporteurs).where(
+                prestation_transporteurs.c.user_id == de,
+                prestation_transporteurs.c.prestation_id.in_(deplacees)
+            ).values(user_id=vers, statut='en_attente', date_reponse=None, commentaire=None)
+        )
+    if doublons:
+        db.session.execute(
+            delete(prestation_transporteurs).where(
+                prestation_transporteurs.c.user_id == de,
+                prestation_transporteurs.c.prestation_id.in_(doublons)
+            )
+        )
+    # Les prestations quittent le calendrier de de (mode delta du calendrier)
+    tracer_retraits(ids, de)
+    # Date de modification : suivie par le calendrier, les flux iCalendar et les doubles réservations
+    rapport['modifiees'] = db.session.execute(
+        update(Prestation).where(Prestation.id.in_(ids)).values(
+            date_modification=maintenant, modificateur_id=utilisateur.id
+        ).execution_options(synchronize_session=False)
+    ).rowcount
+
+    transporteurs = _affectations(ids)
+    enregistrer_versions(db.session.connection(), {i: {'transporteurs': transporteurs[i]} for i in ids},
+                         utilisateur.id)
+    nom = f"{nouveau.prenom} {nouveau.nom}"
+    journaliser_lot([
+        (i, 'assignation', utilisateur.id, {'transporteur_id': vers, 'transporteur': nom, 'remplace_id': de})
+        for i in deplacees
+    ])
+    _notifier({i: [vers] for i in deplacees}, 'assignation')
+
+
+EXECUTEURS = {'archiver': _archiver, 'statut': _changer_statut, 'reaffecter': _reaffecter}
+
+
+def operation_masse(operation, utilisateur, ids=None, filtre=None, parametres=None, dry_run=False):
+    """
+    Exécute (ou simule) une opération sur une sélection de prestations et
+    valide la transaction une seule fois.
+
+    Args:
+        operation: 'archiver' (paramètre archive, True par défaut), 'statut'
+            (paramètre statut) ou 'reaffecter' (paramètres de et vers : les
+            affectations du transporteur de passent au transporteur vers)
+        utilisateur: Auteur ; admin (toutes les prestations) ou commercial (les siennes)
+        ids: Identifiants des prestations
+        filtre: Filtres de la liste, à défaut d'identifiants ({'query', 'archives'})
+        parametres: Paramètres de l'opération
+        dry_run: True pour retourner le rapport sans rien écrire
+
+    Returns:
+        dict: Rapport (selectionnees, non_autorisees, inchangees, modifiees,
+        ids, notifications et détails propres à l'opération)
+
+    Raises:
+        ErreurOperation: opération, sélection ou paramètres invalides
+        PermissionError: utilisateur sans droit de modification
+    """
+    if operation not in EXECUTEURS:
+        raise ErreurOperation(f"Opération inconnue (opérations : {', '.join(OPERATIONS)})")
+    portee = condition_portee(utilisateur)
+    if portee is None:
+        raise PermissionError("Vous n'êtes pas autorisé à modifier des prestations en masse")
+    conditions = conditions_selection(ids, filtre)
+
+    rapport = {'operation': operation, 'dry_run': bool(dry_run)}
+    try:
+        EXECUTEURS[operation](rapport, conditions, portee, utilisateur, parametres or {}, dry_run)
+        if dry_run:
+            db.session.rollback()
+            return rapport
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if rapport['modifiees']:
+        invalider_statistiques()
+        if operation == 'reaffecter':
+            invalider_index_disponibilite()
+            marquer_perimes({rapport['de'], rapport['vers']})
+    return rapport
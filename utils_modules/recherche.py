@@ -0,0 +1,300 @@
+"""
+Index de recherche plein texte des clients, prestations, documents et factures.
+
+Une seule table, recherche_index, contient un document (titre, contenu) par
+objet indexé ; sa clé entière encode le type et l'identifiant de l'objet
+(id * 4 + code du type), ce qui permet de supprimer ou remplacer un document
+par clé et de filtrer un type sans colonne supplémentaire.
+- SQLite : table virtuelle FTS5 (rowid = clé), index de préfixes, classement bm25 ;
+- PostgreSQL : colonne tsvector générée (titre pondéré A, contenu B) avec
+  index GIN, classement ts_rank.
+
+Les textes et les requêtes sont normalisés (minuscules, sans accents), la
+recherche porte sur des préfixes de mots : « dup par » trouve « Dupont, Paris ».
+
+L'index est tenu à jour à chaque flush (objets créés, modifiés ou supprimés ;
+le renommage d'un client réindexe ses prestations). Il est créé et rempli par
+migration_recherche.py ; tant qu'il n'existe pas, la synchronisation est
+ignorée et les listes retombent sur leurs filtres ilike.
+"""
+import re
+import time
+import unicodedata
+
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Client, Document, Facture, Prestation
+
+TABLE_INDEX = 'recherche_index'
+
+# Code de chaque type dans la clé (id * NB_TYPES + code)
+TYPES = {'client': 0, 'prestation': 1, 'document': 2, 'facture': 3}
+NB_TYPES = 4
+MODELES = {Client: 'client', Prestation: 'prestation', Document: 'document', Facture: 'facture'}
+
+# Attributs indexés de chaque modèle : une modification d'un autre attribut ne réindexe pas
+ATTRIBUTS_INDEXES = {
+    Client: ('nom', 'prenom', 'email', 'telephone', 'adresse', 'code_postal', 'ville', 'pays', 'type_client', 'tags'),
+    Prestation: ('type_demenagement', 'client_id', 'adresse_depart', 'adresse_arrivee', 'tags', 'observations', 'societe'),
+    Document: ('nom', 'notes', 'tags'),
+    Facture: ('numero',),
+}
+
+MAX_TERMES = 8
+TAILLE_LOT_DEFAUT = 500
+# Délai avant de revérifier l'existence d'un index absent (secondes)
+DELAI_VERIFICATION = 60
+
+_index_existe = {}
+
+
+def normaliser(texte):
+    """Minuscules sans accents (NFKD sans les marques combinantes)."""
+    if not texte:
+        return ''
+    decompose = unicodedata.normalize('NFKD', str(texte).lower())
+    return ''.join(caractere for caractere in decompose if not unicodedata.combining(caractere))
+
+
+def termes(requete):
+    """Mots de la requête, normalisés (au plus MAX_TERMES)."""
+    return re.findall(r'\w+', normaliser(requete))[:MAX_TERMES]
+
+
+def cle(type_objet, objet_id):
+    return objet_id * NB_TYPES + TYPES[type_objet]
+
+
+def _joindre(*valeurs):
+    return normaliser(' '.join(str(valeur) for valeur in valeurs if valeur))
+
+
+def index_disponible(connexion):
+    """Indique si la table d'index existe (résultat mémorisé, revérifié s'il est négatif)."""
+    url = str(connexion.engine.url)
+    entree = _index_existe.get(url)
+    if entree is not None and (entree[0] or time.monotonic() - entree[1] < DELAI_VERIFICATION):
+        return entree[0]
+    existe = inspect(connexion).has_table(TABLE_INDEX)
+    _index_existe[url] = (existe, time.monotonic())
+    return existe
+
+
+def creer_index(connexion):
+    """Crée la table d'index selon la base (FTS5 ou tsvector + GIN)."""
+    if connexion.dialect.name == 'postgresql':
+        connexion.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {TABLE_INDEX} ("
+            "cle BIGINT PRIMARY KEY, titre TEXT, contenu TEXT, "
+            "document tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('simple', coalesce(titre, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(contenu, '')), 'B')) STORED)"
+        ))
+        connexion.execute(text(
+            f"CREATE INDEX IF NOT EXISTS idx_{TABLE_INDEX}_document ON {TABLE_INDEX} USING GIN (document)"
+        ))
+    else:
+        connexion.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE_INDEX} USING fts5("
+            "titre, contenu, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        ))
+    _index_existe.pop(str(connexion.engine.url), None)
+
+
+def _documents(connexion, type_objet, ids):
+    """Documents (clé, titre, contenu) des objets d'un type, lus en une requête."""
+    if type_objet == 'client':
+        lignes = connexion.execute(select(
+            Client.id, Client.nom, Client.prenom, Client.email, Client.telephone, Client.adresse,
+            Client.code_postal, Client.ville, Client.pays, Client.type_client, Client.tags
+        ).where(Client.id.in_(ids)))
+        return [
+            (cle('client', l.id), _joindre(l.nom, l.prenom),
+             _joindre(l.email, l.telephone, l.adresse, l.code_postal, l.ville, l.pays, l.type_client, l.tags))
+            for l in lignes
+        ]
+    if type_objet == 'prestation':
+        lignes = connexion.execute(select(
+            Prestation.id, Prestation.type_demenagement, Client.nom, Client.prenom,
+            Prestation.adresse_depart, Prestation.adresse_arrivee, Prestation.tags,
+            Prestation.observations, Prestation.societe
+        ).outerjoin(Client, Prestation.client_id == Client.id).where(Prestation.id.in_(ids)))
+        return [
+            (cle('prestation', l.id), _joindre(l.type_demenagement, l.nom, l.prenom),
+             _joindre(l.adresse_depart, l.adresse_arrivee, l.tags, l.observations, l.societe))
+            for l in lignes
+        ]
+    if type_objet == 'document':
+        lignes = connexion.execute(select(Document.id, Document.nom, Document.notes, Document.tags).where(
+            Document.id.in_(ids)
+        ))
+        return [(cle('document', l.id), _joindre(l.nom), _joindre(l.notes, l.tags)) for l in lignes]
+    lignes = connexion.execute(select(Facture.id, Facture.numero).where(Facture.id.in_(ids)))
+    return [(cle('facture', l.id), _joindre(l.numero), '') for l in lignes]
+
+
+def _supprimer(connexion, cles):
+    colonne = 'cle' if connexion.dialect.name == 'postgresql' else 'rowid'
+    cles = list(cles)
+    for debut in range(0, len(cles), TAILLE_LOT_DEFAUT):
+        lot = cles[debut:debut + TAILLE_LOT_DEFAUT]
+        connexion.execute(
+            text(f"DELETE FROM {TABLE_INDEX} WHERE {colonne} IN ({', '.join(str(int(c)) for c in lot)})")
+        )
+
+
+def indexer(connexion, type_objet, ids):
+    """(Ré)indexe les objets d'un type ; ceux qui n'existent plus sont retirés."""
+    ids = list(ids)
+    for debut in range(0, len(ids), TAILLE_LOT_DEFAUT):
+        lot = ids[debut:debut + TAILLE_LOT_DEFAUT]
+        _supprimer(connexion, (cle(type_objet, objet_id) for objet_id in lot))
+        documents = _documents(connexion, type_objet, lot)
+        if not documents:
+            continue
+        colonne = 'cle' if connexion.dialect.name == 'postgresql' else 'rowid'
+        connexion.execute(
+            text(f"INSERT INTO {TABLE_INDEX} ({colonne}, titre, contenu) VALUES (:cle, :titre, :contenu)"),
+            [{'cle': c, 'titre': titre, 'contenu': contenu} for c, titre, contenu in documents]
+        )
+
+
+def reconstruire(taille_lot=TAILLE_LOT_DEFAUT, journal=None):
+    """
+    Vide puis remplit l'index, par lots d'identifiants de chaque type, dans la
+    transaction de l'appelant.
+
+    Returns:
+        int: Nombre d'objets indexés
+    """
+    connexion = db.session.connection()
+    connexion.execute(text(f"DELETE FROM {TABLE_INDEX}"))
+    total = 0
+    for modele, type_objet in MODELES.items():
+        dernier_id = 0
+        while True:
+            ids = [objet_id for (objet_id,) in connexion.execute(
+                select(modele.id).where(modele.id > dernier_id).order_by(modele.id).limit(taille_lot)
+            )]
+            if not ids:
+                break
+            indexer(connexion, type_objet, ids)
+            dernier_id = ids[-1]
+            total += len(ids)
+            if journal:
+                journal(f"{type_objet}: {total} objets indexés")
+    return total
+
+
+def _requete_index(connexion, mots, types=None):
+    """Requête SQL (texte, paramètres) des clés correspondant aux mots, les plus pertinentes en premier."""
+    colonne = 'cle' if connexion.dialect.name == 'postgresql' else 'rowid'
+    filtre_type = ''
+    if types is not None and set(types) != set(TYPES):
+        codes = ', '.join(str(TYPES[type_objet]) for type_objet in types)
+        filtre_type = f' AND {colonne} % {NB_TYPES} IN ({codes})'
+    if connexion.dialect.name == 'postgresql':
+        return (
+            f"SELECT cle, ts_rank(document, to_tsquery('simple', :requete)) AS score FROM {TABLE_INDEX} "
+            f"WHERE document @@ to_tsquery('simple', :requete){filtre_type} ORDER BY score DESC",
+            {'requete': ' & '.join(f'{mot}:*' for mot in mots)}
+        )
+    return (
+        f"SELECT rowid AS cle, -bm25({TABLE_INDEX}, 10.0, 1.0) AS score FROM {TABLE_INDEX} "
+        f"WHERE {TABLE_INDEX} MATCH :requete{filtre_type} ORDER BY score DESC",
+        {'requete': ' '.join(f'"{mot}"*' for mot in mots)}
+    )
+
+
+def ids_correspondants(type_objet, requete):
+    """
+    Identifiants des objets d'un type correspondant à la requête, ou None si
+    l'index n'est pas disponible (l'appelant garde alors son filtre ilike).
+
+    Returns:
+        list ou None
+    """
+    connexion = db.session.connection()
+    if not index_disponible(connexion):
+        return None
+    mots = termes(requete)
+    if not mots:
+        return []
+    sql, parametres = _requete_index(connexion, mots, [type_objet])
+    return [c // NB_TYPES for (c, _) in connexion.execute(text(sql), parametres)]
+
+
+def rechercher(requete, types=None, limite=20):
+    """
+    Recherche classée dans l'index.
+
+    Args:
+        requete: Texte saisi
+        types: Types d'objets retenus (None : tous)
+        limite: Nombre maximum de résultats
+
+    Returns:
+        list: (type_objet, objet_id, score) du plus au moins pertinent,
+        ou None si l'index n'est pas disponible
+    """
+    connexion = db.session.connection()
+    if not index_disponible(connexion):
+        return None
+    mots = termes(requete)
+    if not mots:
+        return []
+    sql, parametres = _requete_index(connexion, mots, types)
+    parametres['limite'] = limite
+    noms = {code: type_objet for type_objet, code in TYPES.items()}
+    return [
+        (noms[c % NB_TYPES], c // NB_TYPES, float(score))
+        for c, score in connexion.execute(text(f"{sql} LIMIT :limite"), parametres)
+    ]
+
+
+def _modifie(obj):
+    etat = inspect(obj)
+    return any(etat.attrs[attribut].history.has_changes() for attribut in ATTRIBUTS_INDEXES[type(obj)])
+
+
+@event.listens_for(Session, 'after_flush')
+def _synchroniser_index(session, flush_context):
+    """Réindexe les objets créés ou modifiés et retire les objets supprimés."""
+    a_indexer = {}
+    clients_renommes = set()
+    a_supprimer = set()
+    for obj in session.new:
+        type_objet = MODELES.get(type(obj))
+        if type_objet:
+            a_indexer.setdefault(type_objet, set()).add(obj.id)
+    for obj in session.dirty:
+        type_objet = MODELES.get(type(obj))
+        if type_objet and _modifie(obj):
+            a_indexer.setdefault(type_objet, set()).add(obj.id)
+            etat = inspect(obj)
+            if type_objet == 'client' and (
+                etat.attrs.nom.history.has_changes() or etat.attrs.prenom.history.has_changes()
+            ):
+                clients_renommes.add(obj.id)
+    for obj in session.deleted:
+        type_objet = MODELES.get(type(obj))
+        if type_objet:
+            a_supprimer.add(cle(type_objet, obj.id))
+    if not (a_indexer or a_supprimer):
+        return
+
+    connexion = session.connection()
+    if not index_disponible(connexion):
+        return
+    if clients_renommes:
+        a_indexer.setdefault('prestation', set()).update(
+            objet_id for (objet_id,) in connexion.execute(
+                select(Prestation.id).where(Prestation.client_id.in_(clients_renommes))
+            )
+        )
+    if a_supprimer:
+        _supprimer(connexion, a_supprimer)
+    for type_objet, ids in a_indexer.items():
+        indexer(connexion, type_objet, ids)
@@ -0,0 +1,190 @@
+"""
+Réponses des transporteurs aux prestations (acceptation, refus).
+
+L'affectation d'un transporteur (ligne de prestation_transporteurs) suit la
+machine à états en_attente -> accepte | refuse. Une transition est un UPDATE
+conditionnel (WHERE statut = 'en_attente') : de deux réponses simultanées
+(double clic, deux onglets), une seule modifie la ligne, l'autre est rejetée
+sans effet. Les effets de la transition (champs de suivi de la prestation,
+journal des événements, notifications) sont écrits dans la même transaction,
+validée une seule fois.
+
+Une affectation refusée est conservée (traçabilité de la réponse) mais ne
+réserve plus le transporteur : les requêtes de disponibilité et d'affectation
+filtrent avec affectation_active().
+"""
+from datetime import datetime
+
+from flask import flash
+from sqlalchemy import or_, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from extensions import db
+from models import Notification, Prestation, prestation_transporteurs
+from utils_modules.evenements import journaliser
+
+ETAT_INITIAL = 'en_attente'
+# États atteignables depuis l'état initial
+TRANSITIONS = ('accepte', 'refuse')
+
+
+class ErreurReponse(ValueError):
+    """
+    Réponse impossible. `code` : 'statut_invalide', 'introuvable',
+    'non_assigne' ou 'deja_repondu'.
+    """
+
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+
+def affectation_active():
+    """Condition sur prestation_transporteurs : affectations qui n'ont pas été refusées."""
+    return or_(prestation_transporteurs.c.statut.is_(None), prestation_transporteurs.c.statut != 'refuse')
+
+
+def _en_attente(colonne):
+    # Les affectations créées avant la colonne statut n'ont pas de valeur
+    return or_(colonne == ETAT_INITIAL, colonne.is_(None))
+
+
+def _motif_rejet(prestation_id, transporteur_id):
+    """Cause d'une transition qui n'a modifié aucune ligne."""
+    statut = db.session.execute(
+        select(prestation_transporteurs.c.statut).where(
+            prestation_transporteurs.c.prestation_id == prestation_id,
+            prestation_transporteurs.c.user_id == transporteur_id
+        )
+    ).first()
+    if statut is not None:
+        return ErreurReponse(f"Vous avez déjà répondu à cette prestation ({statut[0]}).", 'deja_repondu')
+    if db.session.get(Prestation, prestation_id) is None:
+        return ErreurReponse("Prestation introuvable.", 'introuvable')
+    return ErreurReponse("Vous n'êtes pas assigné à cette prestation.", 'non_assigne')
+
+
+def repondre(prestation_id, transporteur_id, statut, commentaire=None, acteur_id=None):
+    """
+    Enregistre la réponse d'un transporteur et valide la transaction.
+
+    Args:
+        prestation_id: Prestation concernée
+        transporteur_id: Transporteur assigné qui répond
+        statut: 'accepte' ou 'refuse'
+        commentaire: Commentaire (acceptation) ou raison (refus)
+        acteur_id: Auteur de la réponse (le transporteur par défaut ; admin ou commercial)
+
+    Returns:
+        Prestation: La prestation mise à jour
+
+    Raises:
+        ErreurReponse: statut invalide, prestation introuvable, transporteur
+            non assigné ou réponse déjà enregistrée (rien n'est écrit)
+    """
+    if statut not in TRANSITIONS:
+        raise ErreurReponse("Statut invalide", 'statut_invalide')
+    maintenant = datetime.utcnow()
+
+    # Transition : seule une affectation en attente peut changer d'état
+    resultat = db.session.execute(
+        prestation_transporteurs.update().where(
+            prestation_transporteurs.c.prestation_id == prestation_id,
+            prestation_transporteurs.c.user_id == transporteur_id,
+            _en_attente(prestation_transporteurs.c.statut)
+        ).values(statut=statut, date_reponse=maintenant, commentaire=commentaire)
+    )
+    if resultat.rowcount != 1:
+        erreur = _motif_rejet(prestation_id, transporteur_id)
+        db.session.rollback()
+        raise erreur
+
+    try:
+        # Champs de suivi de la prestation, modifiés par l'ORM pour que
+        # l'historique des versions et les statistiques suivent la réponse
+        prestation = db.session.get(Prestation, prestation_id)
+        prestation.status_transporteur = statut
+        prestation.date_reponse = maintenant
+        if acteur_id is not None:
+            prestation.modificateur_id = acteur_id
+        if statut == 'refuse':
+            prestation.raison_refus = commentaire
+            # Plus aucun transporteur disponible : la prestation est à réaffecter
+            restants = db.session.execute(
+                select(prestation_transporteurs.c.user_id).where(
+                    prestation_transporteurs.c.prestation_id == prestation_id,
+                    affectation_active()
+                ).limit(1)
+            ).first()
+            if restants is None:
+                prestation.statut = 'En attente'
+
+        # Notifications reçues par le transporteur pour cette prestation : traitées
+        Notification.query.filter_by(
+            prestation_id=prestation_id,
+            user_id=transporteur_id,
+            role_destinataire='transporteur'
+        ).update({'statut': 'acceptee' if statut == 'accepte' else 'refusee', 'lu': True},
+                 synchronize_session=False)
+
+        acteur = acteur_id or transporteur_id
+        if statut == 'accepte':
+            journaliser(prestation_id, 'acceptation', acteur, commentaire=commentaire or None)
+            message_admin = f"Le transporteur a accepté la prestation #{prestation_id}."
+            message_transporteur = f"Vous avez accepté la prestation #{prestation_id}. Merci pour votre confirmation."
+            type_notification = 'success'
+        else:
+            journaliser(prestation_id, 'refus', acteur, raison=commentaire or None)
+            message_admin = (f"Le transporteur a refusé la prestation #{prestation_id}. "
+                             f"Raison: {commentaire if commentaire else 'Non spécifiée'}")
+            message_transporteur = f"Vous avez refusé la prestation #{prestation_id}."
+            type_notification = 'warning'
+        db.session.add_all([
+            Notification(message=message_admin, type=type_notification, role_destinataire='admin',
+                         prestation_id=prestation_id, date_creation=maintenant, statut='non_lue'),
+            Notification(message=message_transporteur, type=type_notification, role_destinataire='transporteur',
+                         user_id=transporteur_id, prestation_id=prestation_id, date_creation=maintenant,
+                         statut='non_lue'),
+        ])
+
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+
+    if statut == 'refuse':
+        # La ligne est modifiée hors de l'ORM : libérer le transporteur dans le calendrier
+        from utils_modules.creneaux import marquer_perimes
+        marquer_perimes({transporteur_id})
+    return prestation
+
+
+def _repondre_avec_message(prestation_id, transporteur_id, statut, commentaire, action):
+    try:
+        repondre(prestation_id, transporteur_id, statut, commentaire)
+        return True
+    except ErreurReponse as e:
+        flash(str(e), "danger")
+    except SQLAlchemyError as e:
+        flash(f"Erreur lors {action} de la prestation: {str(e)}", "danger")
+    return False
+
+
+def accepter_prestation(prestation_id, transporteur_id, commentaire=None):
+    """
+    Permet à un transporteur d'accepter une prestation (message flash en cas d'échec).
+
+    Returns:
+        bool: True si la prestation a été acceptée avec succès, False sinon
+    """
+    return _repondre_avec_message(prestation_id, transporteur_id, 'accepte', commentaire, "de l'acceptation")
+
+
+def refuser_prestation(prestation_id, transporteur_id, raison=None):
+    """
+    Permet à un transporteur de refuser une prestation (message flash en cas d'échec).
+
+    Returns:
+        bool: True si la prestation a été refusée avec succès, False sinon
+    """
+    return _repondre_avec_message(prestation_id, transporteur_id, 'refuse', raison, "du refus")
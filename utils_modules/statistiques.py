@@ -0,0 +1,156 @@
+"""
+Statistiques du tableau de bord.
+
+Le tableau de bord est la page d'accueil de tous les utilisateurs après la
+connexion. Ses indicateurs sont calculés en trois requêtes :
+- les compteurs (clients, prestations, factures, chiffre d'affaires total) en
+  une seule requête, une sous-requête agrégée par table ;
+- le chiffre d'affaires mensuel de l'année en un seul GROUP BY sur le mois ;
+- la répartition des prestations par type de déménagement.
+
+Le résultat est mis en cache TABLEAU_DE_BORD_CACHE_TTL secondes et invalidé
+dès qu'un client, une prestation ou une facture est écrit. Seules des valeurs
+simples sont mises en cache : les listes d'objets récents (clients,
+prestations, factures) sont lues à chaque affichage par de petites requêtes
+limitées à 5 lignes.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import case, event, extract, func, true
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Client, Facture, Prestation
+
+CACHE_TTL_DEFAUT = 30  # secondes
+
+_cache = {}
+_verrou = threading.Lock()
+
+
+def _somme_si(condition):
+    """SUM(CASE WHEN condition THEN 1 ELSE 0 END), compatible SQLite et PostgreSQL."""
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def compteurs(aujourd_hui):
+    """
+    Compteurs du tableau de bord en une requête.
+
+    Args:
+        aujourd_hui: Date du jour (date)
+
+    Returns:
+        dict: total_clients, new_clients_month, total_prestations,
+        prestations_a_venir, prestations_en_cours, total_factures,
+        factures_impayees, total_revenue
+    """
+    debut_mois = datetime(aujourd_hui.year, aujourd_hui.month, 1)
+    debut_jour = datetime.combine(aujourd_hui, datetime.min.time())
+    fin_jour = debut_jour + timedelta(days=1)
+
+    clients = db.session.query(
+        _somme_si(Client.archive == False).label('total_clients'),
+        _somme_si(Client.date_creation >= debut_mois).label('new_clients_month')
+    ).subquery()
+
+    prestations = db.session.query(
+        func.count(Prestation.id).label('total_prestations'),
+        _somme_si(Prestation.date_debut >= fin_jour).label('prestations_a_venir'),
+        _somme_si(
+            (Prestation.date_debut < fin_jour) & (Prestation.date_fin >= debut_jour)
+        ).label('prestations_en_cours')
+    ).filter(Prestation.archive == False).subquery()
+
+    factures = db.session.query(
+        func.count(Facture.id).label('total_factures'),
+        _somme_si(Facture.statut == 'En attente').label('factures_impayees'),
+        func.coalesce(
+            func.sum(case((Facture.statut == 'Payée', Facture.montant_ttc), else_=0)), 0
+        ).label('total_revenue')
+    ).subquery()
+
+    # Chaque sous-requête retourne une seule ligne : la jointure sur TRUE les assemble
+    ligne = db.session.query(clients, prestations, factures).select_from(clients).join(
+        prestations, true()
+    ).join(factures, true()).one()
+
+    valeurs = dict(ligne._mapping)
+    valeurs['total_revenue'] = float(valeurs['total_revenue'])
+    return valeurs
+
+
+def chiffre_affaires_mensuel(annee):
+    """
+    Chiffre d'affaires (factures payées, TTC) de chaque mois de l'année, en un GROUP BY.
+
+    Returns:
+        list: 12 montants (float), de janvier à décembre
+    """
+    mois = extract('month', Facture.date_emission)
+    lignes = db.session.query(mois, func.sum(Facture.montant_ttc)).filter(
+        Facture.date_emission >= datetime(annee, 1, 1),
+        Facture.date_emission < datetime(annee + 1, 1, 1),
+        Facture.statut == 'Payée'
+    ).group_by(mois).all()
+
+    serie = [0.0] * 12
+    for numero_mois, montant in lignes:
+        serie[int(numero_mois) - 1] = float(montant or 0)
+    return serie
+
+
+def repartition_types_prestation():
+    """Nombre de prestations par type de déménagement : (libellés, valeurs)."""
+    lignes = db.session.query(
+        Prestation.type_demenagement, func.count(Prestation.id)
+    ).group_by(Prestation.type_demenagement).all()
+    return [libelle for libelle, _ in lignes], [nombre for _, nombre in lignes]
+
+
+def get_statistiques_tableau_de_bord():
+    """
+    Retourne les statistiques agrégées du tableau de bord, en cache.
+
+    Returns:
+        dict: compteurs (voir compteurs()), plus 'monthly_revenue' (12 montants
+        de l'année en cours), 'pie_labels' et 'pie_data'
+    """
+    ttl = current_app.config.get('TABLEAU_DE_BORD_CACHE_TTL', CACHE_TTL_DEFAUT)
+    aujourd_hui = datetime.utcnow().date()
+    maintenant = time.monotonic()
+
+    # Le jour fait partie de la clé : les compteurs « à venir » et « ce mois » en dépendent
+    entree = _cache.get(aujourd_hui)
+    if entree and maintenant - entree[0] < ttl:
+        return entree[1]
+
+    with _verrou:
+        entree = _cache.get(aujourd_hui)
+        if entree and maintenant - entree[0] < ttl:
+            return entree[1]
+        statistiques = compteurs(aujourd_hui)
+        statistiques['monthly_revenue'] = chiffre_affaires_mensuel(aujourd_hui.year)
+        statistiques['pie_labels'], statistiques['pie_data'] = repartition_types_prestation()
+        _cache.clear()
+        _cache[aujourd_hui] = (time.monotonic(), statistiques)
+        return statistiques
+
+
+def invalider_statistiques():
+    """Vide le cache ; les statistiques seront recalculées au prochain affichage."""
+    _cache.clear()
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalider_apres_flush(session, flush_context):
+    """Invalide les statistiques si un client, une prestation ou une facture a été écrit."""
+    if not _cache:
+        return
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Client, Prestation, Facture)):
+            invalider_statistiques()
+            return
@@ -0,0 +1,320 @@
+"""
+Agrégats journaliers (table stats_daily) maintenus de façon incrémentale.
+
+Chaque ligne porte la valeur d'un indicateur pour un jour :
+- clients_nouveaux : clients créés ce jour ;
+- prestations_creees:<statut>, prestations_debutees:<statut>,
+  prestations_terminees:<statut> : prestations par jour de création, de
+  début et de fin, ventilées selon leur statut actuel ;
+- factures_emises : factures émises ce jour ;
+- factures_payees, montant_paye : factures payées (et montant TTC) au jour du
+  paiement, ou d'émission si la date de paiement n'est pas renseignée ;
+- loyers_stockage : variation du loyer mensuel des stockages en cours
+  (+montant au premier jour, -montant au lendemain du dernier jour) ; la
+  somme cumulée donne le loyer mensuel en vigueur un jour donné.
+
+À chaque flush, la contribution de chaque objet modifié est retirée avec ses
+anciennes valeurs puis ajoutée avec les nouvelles, et seules les différences
+sont écrites, dans la même transaction. Les écritures qui contournent l'ORM
+(Query.update, SQL brut) ne sont pas suivies : reconstruire alors la table
+avec migration_stats_daily.py.
+"""
+import calendar
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Client, Facture, Prestation, StatJournaliere, Stockage
+
+# Attributs dont dépendent les indicateurs de chaque modèle
+CHAMPS_SUIVIS = {
+    Client: ('date_creation',),
+    Prestation: ('date_creation', 'date_debut', 'date_fin', 'statut'),
+    Facture: ('date_emission', 'statut', 'date_paiement', 'montant_ttc'),
+    Stockage: ('date_debut', 'date_fin', 'montant_mensuel'),
+}
+
+INDICATEURS_PRESTATION = ('prestations_creees', 'prestations_debutees', 'prestations_terminees')
+INDICATEURS_SIMPLES = ('clients_nouveaux', 'factures_emises', 'factures_payees', 'montant_paye')
+INDICATEUR_LOYERS = 'loyers_stockage'
+
+TAILLE_LOT_DEFAUT = 1000
+
+
+def _jour(valeur):
+    if valeur is None:
+        return None
+    return valeur.date() if isinstance(valeur, datetime) else valeur
+
+
+def contributions(modele, valeurs):
+    """
+    Contribution d'un objet aux agrégats.
+
+    Args:
+        modele: Classe du modèle (Client, Prestation, Facture ou Stockage)
+        valeurs: Objet exposant les attributs de CHAMPS_SUIVIS[modele]
+            (instance, ligne de requête ou SimpleNamespace)
+
+    Returns:
+        dict: {(jour, indicateur): valeur}
+    """
+    resultat = defaultdict(float)
+
+    if modele is Client:
+        if valeurs.date_creation:
+            resultat[(_jour(valeurs.date_creation), 'clients_nouveaux')] += 1
+
+    elif modele is Prestation:
+        statut = valeurs.statut or ''
+        for indicateur, date_valeur in zip(
+            INDICATEURS_PRESTATION, (valeurs.date_creation, valeurs.date_debut, valeurs.date_fin)
+        ):
+            if date_valeur:
+                resultat[(_jour(date_valeur), f'{indicateur}:{statut}')] += 1
+
+    elif modele is Facture:
+        if valeurs.date_emission:
+            resultat[(_jour(valeurs.date_emission), 'factures_emises')] += 1
+        jour_paiement = _jour(valeurs.date_paiement or valeurs.date_emission)
+        if valeurs.statut == 'Payée' and jour_paiement:
+            resultat[(jour_paiement, 'factures_payees')] += 1
+            resultat[(jour_paiement, 'montant_paye')] += valeurs.montant_ttc or 0
+
+    elif modele is Stockage:
+        if valeurs.date_debut and valeurs.montant_mensuel:
+            resultat[(_jour(valeurs.date_debut), INDICATEUR_LOYERS)] += valeurs.montant_mensuel
+            if valeurs.date_fin:
+                resultat[(_jour(valeurs.date_fin) + timedelta(days=1), INDICATEUR_LOYERS)] -= valeurs.montant_mensuel
+
+    return resultat
+
+
+def _ajouter(deltas, contribution, signe):
+    for cle, valeur in contribution.items():
+        deltas[cle] += signe * valeur
+
+
+def appliquer_deltas(connexion, deltas):
+    """Ajoute les deltas {(jour, indicateur): valeur} à stats_daily (upsert)."""
+    lignes = [
+        {'jour': jour, 'indicateur': indicateur, 'valeur': valeur}
+        for (jour, indicateur), valeur in deltas.items() if valeur
+    ]
+    if not lignes:
+        return
+
+    table = StatJournaliere.__table__
+    dialecte = connexion.dialect.name
+    if dialecte in ('sqlite', 'postgresql'):
+        module = sqlite if dialecte == 'sqlite' else postgresql
+        requete = module.insert(table)
+        requete = requete.on_conflict_do_update(
+            index_elements=[table.c.jour, table.c.indicateur],
+            set_={'valeur': table.c.valeur + requete.excluded.valeur}
+        )
+        connexion.execute(requete, lignes)
+        return
+
+    # Autres bases : mise à jour puis insertion des lignes absentes
+    for ligne in lignes:
+        resultat = connexion.execute(
+            table.update().where(
+                table.c.jour == ligne['jour'], table.c.indicateur == ligne['indicateur']
+            ).values(valeur=table.c.valeur + ligne['valeur'])
+        )
+        if resultat.rowcount == 0:
+            connexion.execute(table.insert().values(**ligne))
+
+
+def _valeurs_avant(objets_par_modele):
+    """
+    Valeurs des attributs suivis avant le flush, pour des objets modifiés ou supprimés.
+
+    Les anciennes valeurs viennent de l'historique des attributs ; celles qui
+    n'étaient pas chargées (objet expiré après un commit) sont relues en une
+    requête par modèle.
+    """
+    avant = {}
+    a_relire = defaultdict(list)
+    for modele, objets in objets_par_modele.items():
+        champs = CHAMPS_SUIVIS[modele]
+        for obj in objets:
+            etat = inspect(obj)
+            valeurs = {}
+            for champ in champs:
+                historique = etat.attrs[champ].history
+                if historique.deleted:
+                    valeurs[champ] = historique.deleted[0]
+                elif historique.unchanged:
+                    valeurs[champ] = historique.unchanged[0]
+            avant[obj] = valeurs
+            if len(valeurs) < len(champs):
+                a_relire[modele].append(obj)
+
+    for modele, objets in a_relire.items():
+        champs = CHAMPS_SUIVIS[modele]
+        colonnes = [getattr(modele, champ) for champ in champs]
+        lignes = {
+            ligne[0]: ligne[1:] for ligne in db.session.query(modele.id, *colonnes).filter(
+                modele.id.in_([obj.id for obj in objets])
+            ).execution_options(autoflush=False)
+        }
+        for obj in objets:
+            ligne = lignes.get(obj.id)
+            if ligne is None:
+                continue
+            for champ, valeur in zip(champs, ligne):
+                avant[obj].setdefault(champ, valeur)
+
+    return {obj: SimpleNamespace(**valeurs) for obj, valeurs in avant.items()}
+
+
+def _valeurs_apres(obj, valeurs_avant):
+    """Valeurs suivies après le flush : les nouvelles valeurs affectées, sinon les anciennes."""
+    valeurs = dict(vars(valeurs_avant))
+    etat = inspect(obj)
+    for champ in CHAMPS_SUIVIS[type(obj)]:
+        historique = etat.attrs[champ].history
+        if historique.added:
+            valeurs[champ] = historique.added[0]
+    return SimpleNamespace(**valeurs)
+
+
+@event.listens_for(Session, 'before_flush')
+def _preparer_deltas(session, flush_context, instances):
+    """Calcule les deltas des objets modifiés ou supprimés (les anciennes valeurs disparaissent au flush)."""
+    deltas = defaultdict(float)
+    session.info['stats_deltas'] = deltas
+
+    modifies = defaultdict(list)
+    supprimes = defaultdict(list)
+    for obj in session.dirty:
+        modele = type(obj)
+        if modele in CHAMPS_SUIVIS and session.is_modified(obj, include_collections=False):
+            etat = inspect(obj)
+            if any(etat.attrs[champ].history.has_changes() for champ in CHAMPS_SUIVIS[modele]):
+                modifies[modele].append(obj)
+    for obj in session.deleted:
+        if type(obj) in CHAMPS_SUIVIS:
+            supprimes[type(obj)].append(obj)
+    if not modifies and not supprimes:
+        return
+
+    objets = defaultdict(list)
+    for source in (modifies, supprimes):
+        for modele, liste in source.items():
+            objets[modele].extend(liste)
+    avant = _valeurs_avant(objets)
+
+    for modele, liste in modifies.items():
+        for obj in liste:
+            _ajouter(deltas, contributions(modele, avant[obj]), -1)
+            _ajouter(deltas, contributions(modele, _valeurs_apres(obj, avant[obj])), 1)
+    for modele, liste in supprimes.items():
+        for obj in liste:
+            _ajouter(deltas, contributions(modele, avant[obj]), -1)
+
+
+@event.listens_for(Session, 'after_flush')
+def _ecrire_deltas(session, flush_context):
+    """Ajoute les objets créés (valeurs par défaut renseignées) et écrit les deltas."""
+    deltas = session.info.pop('stats_deltas', None)
+    if deltas is None:
+        deltas = defaultdict(float)
+    for obj in session.new:
+        if type(obj) in CHAMPS_SUIVIS:
+            _ajouter(deltas, contributions(type(obj), obj), 1)
+    if deltas:
+        appliquer_deltas(session.connection(), deltas)
+
+
+def reconstruire(taille_lot=TAILLE_LOT_DEFAUT, journal=None):
+    """
+    Reconstruit entièrement stats_daily à partir des tables sources.
+
+    Les tables sont lues par lots de `taille_lot` lignes (pagination sur l'id)
+    et seules les colonnes suivies sont chargées ; les agrégats tiennent en
+    mémoire (quelques lignes par jour). L'ancienne table est remplacée dans la
+    transaction de l'appelant, qui doit valider (commit).
+
+    Returns:
+        int: Nombre de lignes d'agrégats écrites
+    """
+    deltas = defaultdict(float)
+    for modele, champs in CHAMPS_SUIVIS.items():
+        colonnes = [getattr(modele, champ).label(champ) for champ in champs]
+        dernier_id = 0
+        total = 0
+        while True:
+            lot = db.session.query(modele.id, *colonnes).filter(
+                modele.id > dernier_id
+            ).order_by(modele.id).limit(taille_lot).all()
+            if not lot:
+                break
+            for ligne in lot:
+                _ajouter(deltas, contributions(modele, ligne), 1)
+            dernier_id = lot[-1].id
+            total += len(lot)
+            if journal:
+                journal(f"{modele.__tablename__}: {total} lignes lues")
+
+    connexion = db.session.connection()
+    connexion.execute(StatJournaliere.__table__.delete())
+    cles = [cle for cle, valeur in deltas.items() if valeur]
+    for debut in range(0, len(cles), taille_lot):
+        appliquer_deltas(connexion, {cle: deltas[cle] for cle in cles[debut:debut + taille_lot]})
+    return len(cles)
+
+
+def statistiques_periode(debut, fin):
+    """
+    Indicateurs de chaque jour de [debut, fin] (dates incluses), lus dans stats_daily.
+
+    Returns:
+        list: un dict par jour (jour, clients_nouveaux, prestations_creees,
+        prestations_debutees, prestations_terminees (dict par statut),
+        factures_emises, factures_payees, montant_paye, loyers_stockage
+        (loyer mensuel en vigueur) et revenu_stockage (loyer du jour))
+    """
+    debut, fin = _jour(debut), _jour(fin)
+    jours = {}
+    courant = debut
+    while courant <= fin:
+        jours[courant] = {
+            'jour': courant.isoformat(),
+            **{indicateur: 0 for indicateur in INDICATEURS_SIMPLES},
+            **{indicateur: {} for indicateur in INDICATEURS_PRESTATION},
+        }
+        courant += timedelta(days=1)
+
+    # Loyers : variations antérieures cumulées, puis variations de la période
+    loyers = db.session.query(func.coalesce(func.sum(StatJournaliere.valeur), 0)).filter(
+        StatJournaliere.indicateur == INDICATEUR_LOYERS, StatJournaliere.jour < debut
+    ).scalar()
+    variations_loyers = defaultdict(float)
+
+    for jour, indicateur, valeur in db.session.query(
+        StatJournaliere.jour, StatJournaliere.indicateur, StatJournaliere.valeur
+    ).filter(StatJournaliere.jour >= debut, StatJournaliere.jour <= fin):
+        if indicateur == INDICATEUR_LOYERS:
+            variations_loyers[jour] += valeur
+            continue
+        ligne = jours[jour]
+        nom, _, statut = indicateur.partition(':')
+        if nom in INDICATEURS_PRESTATION:
+            ligne[nom][statut] = int(valeur)
+        elif nom in ligne:
+            ligne[nom] = round(valeur, 2) if nom == 'montant_paye' else int(valeur)
+
+    for jour, ligne in jours.items():
+        loyers += variations_loyers.get(jour, 0)
+        ligne['loyers_stockage'] = round(loyers, 2)
+        ligne['revenu_stockage'] = round(loyers / calendar.monthrange(jour.year, jour.month)[1], 2)
+
+    return list(jours.values())
@@ -0,0 +1,249 @@
+"""
+Historique des versions des prestations, stocké par différences.
+
+Chaque flush qui crée ou modifie une prestation ajoute une ligne à
+prestation_version, dans la même transaction :
+- la première version, puis une version sur INTERVALLE_INSTANTANE, est un
+  instantané complet de la ligne (colonnes et transporteurs) ;
+- les autres ne contiennent que les champs modifiés ({champ: valeur}) ; un
+  texte prolongé (observations complétées par les réponses des
+  transporteurs) n'enregistre que la suite ajoutée ({champ: {'ajout': ...}}).
+
+Le coût d'une modification est donc proportionnel à ce qui a changé. Une
+version se reconstruit en une requête, à partir de l'instantané qui la
+précède et d'au plus INTERVALLE_INSTANTANE - 1 deltas. Les écritures qui
+contournent l'ORM (Query.update, SQL brut) ne sont pas suivies : les
+déclarer avec enregistrer_versions().
+"""
+import json
+from datetime import date, datetime
+
+from flask import has_request_context
+from flask_login import current_user
+from sqlalchemy import case, event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Prestation, PrestationVersion, prestation_transporteurs
+
+# Une version sur INTERVALLE_INSTANTANE est un instantané complet
+INTERVALLE_INSTANTANE = 10
+
+# Colonnes non versionnées (identifiant et dates tenues par la base)
+CHAMPS_EXCLUS = ('id', 'date_creation', 'date_modification')
+CHAMPS = tuple(
+    attribut.key for attribut in Prestation.__mapper__.column_attrs if attribut.key not in CHAMPS_EXCLUS
+)
+CHAMP_TRANSPORTEURS = 'transporteurs'
+
+
+def _valeur(valeur):
+    """Valeur sérialisable en JSON (dates au format ISO)."""
+    if isinstance(valeur, (datetime, date)):
+        return valeur.isoformat()
+    return valeur
+
+
+def _delta(prestation):
+    """Champs modifiés d'une prestation en cours de flush : {champ: valeur ou {'ajout': suite}}."""
+    etat = inspect(prestation)
+    delta = {}
+    for champ in CHAMPS:
+        historique = etat.attrs[champ].history
+        if not historique.added:
+            continue
+        nouvelle = historique.added[0]
+        ancienne = historique.deleted[0] if historique.deleted else None
+        if isinstance(nouvelle, str) and isinstance(ancienne, str) and ancienne and nouvelle.startswith(ancienne):
+            delta[champ] = {'ajout': nouvelle[len(ancienne):]}
+        else:
+            delta[champ] = _valeur(nouvelle)
+    if etat.attrs[CHAMP_TRANSPORTEURS].history.has_changes():
+        delta[CHAMP_TRANSPORTEURS] = sorted(t.id for t in prestation.transporteurs)
+    return delta
+
+
+def _instantanes(connexion, prestation_ids):
+    """Données complètes (colonnes et transporteurs) de prestations, lues dans la transaction."""
+    if not prestation_ids:
+        return {}
+    table = Prestation.__table__
+    instantanes = {
+        ligne.id: {champ: _valeur(getattr(ligne, champ)) for champ in CHAMPS}
+        for ligne in connexion.execute(select(table).where(table.c.id.in_(prestation_ids)))
+    }
+    for instantane in instantanes.values():
+        instantane[CHAMP_TRANSPORTEURS] = []
+    for prestation_id, user_id in connexion.execute(
+        select(prestation_transporteurs.c.prestation_id, prestation_transporteurs.c.user_id)
+        .where(prestation_transporteurs.c.prestation_id.in_(prestation_ids))
+        .order_by(prestation_transporteurs.c.user_id)
+    ):
+        instantanes[prestation_id][CHAMP_TRANSPORTEURS].append(user_id)
+    return instantanes
+
+
+def _utilisateur_courant():
+    if has_request_context() and current_user.is_authenticated:
+        return current_user.id
+    return None
+
+
+def enregistrer_versions(connexion, deltas, modifie_par=None):
+    """
+    Ajoute une version à chaque prestation, dans la transaction de `connexion`.
+
+    Args:
+        connexion: Connexion de la transaction en cours (session.connection())
+        deltas: {prestation_id: {champ: valeur}} ; un dict vide (création)
+            ou une prestation sans version donne un instantané complet
+        modifie_par: Identifiant de l'auteur (utilisateur connecté par défaut)
+
+    Returns:
+        int: Nombre de versions écrites
+    """
+    if not deltas:
+        return 0
+    ids = list(deltas)
+    versions = PrestationVersion.__table__
+
+    # Dernière version et dernier instantané de chaque prestation, en une requête
+    etats = {
+        prestation_id: (derniere, dernier_instantane or 0)
+        for prestation_id, derniere, dernier_instantane in connexion.execute(
+            select(
+                versions.c.prestation_id,
+                func.max(versions.c.version),
+                func.max(case((versions.c.instantane, versions.c.version)))
+            ).where(versions.c.prestation_id.in_(ids)).group_by(versions.c.prestation_id)
+        )
+    }
+    a_photographier = [
+        prestation_id for prestation_id in ids
+        if not deltas[prestation_id] or prestation_id not in etats
+        or etats[prestation_id][0] + 1 - etats[prestation_id][1] >= INTERVALLE_INSTANTANE
+    ]
+    instantanes = _instantanes(connexion, a_photographier)
+
+    if modifie_par is None:
+        modifie_par = _utilisateur_courant()
+    maintenant = datetime.utcnow()
+    lignes = []
+    for prestation_id in ids:
+        derniere = etats.get(prestation_id, (0, 0))[0]
+        instantane = prestation_id in instantanes
+        lignes.append({
+            'prestation_id': prestation_id,
+            'version': derniere + 1,
+            'donnees': json.dumps(
+                instantanes[prestation_id] if instantane else deltas[prestation_id], ensure_ascii=False
+            ),
+            'instantane': instantane,
+            'champs': ','.join(sorted(deltas[prestation_id]))[:500] or None,
+            'modifie_par': modifie_par,
+            'date_modification': maintenant,
+        })
+    connexion.execute(versions.insert(), lignes)
+    return len(lignes)
+
+
+@event.listens_for(Session, 'after_flush')
+def _capturer_versions(session, flush_context):
+    """Versionne les prestations créées ou modifiées par le flush."""
+    deltas = {}
+    for obj in session.new:
+        if isinstance(obj, Prestation):
+            deltas[obj.id] = {}
+    for obj in session.dirty:
+        if isinstance(obj, Prestation) and obj not in session.deleted:
+            delta = _delta(obj)
+            if delta:
+                deltas[obj.id] = delta
+    if deltas:
+        enregistrer_versions(session.connection(), deltas)
+
+
+def _appliquer(etat, instantane, donnees):
+    """État après une version (instantané ou delta)."""
+    if instantane:
+        return dict(donnees)
+    etat = dict(etat)
+    for champ, valeur in donnees.items():
+        if isinstance(valeur, dict) and 'ajout' in valeur:
+            etat[champ] = (etat.get(champ) or '') + valeur['ajout']
+        else:
+            etat[champ] = valeur
+    return etat
+
+
+def reconstruire_versions(prestation_id, numeros):
+    """
+    Données complètes de plusieurs versions d'une prestation, en une requête.
+
+    Seules les lignes depuis l'instantané précédant la plus ancienne version
+    demandée sont lues.
+
+    Returns:
+        dict: {numero: données} des versions existantes
+    """
+    numeros = set(numeros)
+    if not numeros:
+        return {}
+    base = select(func.max(PrestationVersion.version)).where(
+        PrestationVersion.prestation_id == prestation_id,
+        PrestationVersion.instantane.is_(True),
+        PrestationVersion.version <= min(numeros)
+    ).scalar_subquery()
+    lignes = db.session.query(
+        PrestationVersion.version, PrestationVersion.instantane, PrestationVersion.donnees
+    ).filter(
+        PrestationVersion.prestation_id == prestation_id,
+        PrestationVersion.version >= base,
+        PrestationVersion.version <= max(numeros)
+    ).order_by(PrestationVersion.version)
+
+    etat = {}
+    resultats = {}
+    for numero, instantane, donnees in lignes:
+        etat = _appliquer(etat, instantane, json.loads(donnees))
+        if numero in numeros:
+            resultats[numero] = etat
+    return resultats
+
+
+def reconstruire_version(prestation_id, numero):
+    """Données complètes d'une version, ou None si elle n'existe pas."""
+    return reconstruire_versions(prestation_id, [numero]).get(numero)
+
+
+def comparer(avant, apres):
+    """
+    Différences entre deux états d'une prestation.
+
+    Returns:
+        dict: {champ: {'avant': valeur, 'apres': valeur}}, ou {champ: {'ajout': suite}}
+        pour un texte prolongé
+    """
+    differences = {}
+    for champ in sorted(set(avant) | set(apres)):
+        ancienne, nouvelle = avant.get(champ), apres.get(champ)
+        if ancienne == nouvelle:
+            continue
+        if isinstance(ancienne, str) and isinstance(nouvelle, str) and ancienne and nouvelle.startswith(ancienne):
+            differences[champ] = {'ajout': nouvelle[len(ancienne):]}
+        else:
+            differences[champ] = {'avant': ancienne, 'apres': nouvelle}
+    return differences
+
+
+def comparer_versions(prestation_id, de, a):
+    """
+    Différences entre deux versions d'une prestation (voir comparer()).
+
+    Returns:
+        dict ou None si l'une des versions n'existe pas
+    """
+    etats = reconstruire_versions(prestation_id, [de, a])
+    if de not in etats or a not in etats:
+        return None
+    return comparer(etats[de], etats[a])